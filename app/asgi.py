@@ -1,11 +1,12 @@
+import time
+started = time.perf_counter()
+
 import os
-from venv import logger
+import logging
 import django
 from django.core.asgi import get_asgi_application
 
 from app.views import set_ready, set_not_ready
-import signal
-import sys
 import asyncio
 
 # Initialize Django first
@@ -14,40 +15,44 @@ django.setup()
 
 # Then import Channels components
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from app.chat.consumers import ChatConsumer
+from app.chat.shutdown import drain_on_signals
+from app.chat.warmup import startup_seconds, warmup
 from django.urls import path
 
+logger = logging.getLogger("chat")
+
+async def lifespan(scope, receive, send):
+    # Warm up before the server takes connections, then report ready
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await warmup.ensure()
+            # The server has installed its signal handlers by now; drain
+            # connections first, then hand the signal on to it
+            drain_on_signals(asyncio.get_event_loop(), ChatConsumer.active_ws_connections.values(),
+                             on_signal=set_not_ready)
+            set_ready()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            set_not_ready()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
 application = ProtocolTypeRouter({
+    "lifespan": lifespan,
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
-        URLRouter([
-            path("ws/chat/", ChatConsumer.as_asgi()),
-            path("ws/chat", ChatConsumer.as_asgi()),
-        ])
-    ),
+    # No AuthMiddlewareStack: nothing reads the user or session, and in
+    # channels 3.0.0 its SessionMiddleware keeps the last connection's send
+    # on the shared instance, so every socket sent through the newest one
+    "websocket": URLRouter([
+        path("ws/chat/", ChatConsumer.as_asgi()),
+        path("ws/chat", ChatConsumer.as_asgi()),
+        path("ws/chat/<str:room>/", ChatConsumer.as_asgi()),
+        path("ws/chat/<str:room>", ChatConsumer.as_asgi()),
+    ]),
 })
-set_ready()
-
-def handle_shutdown(signum, frame):
-    logger.info('Received SIGTERM, Shutting down gracefully...')
-    set_not_ready()
-    
-    # Close all WebSocket connections with code 1001
-    async def close_connections():
-        logger.info('Closing all WebSocket connections...')
-        for consumer in ChatConsumer.active_connections:
-            await consumer.close(code=1001)
-    
-    # Run the close_connections coroutine with a timeout of 10 seconds
-    try:
-        logger.info('Finishing Event Loop or InFlight Requests...')
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(asyncio.wait_for(close_connections(), timeout=10))
-    except asyncio.TimeoutError:
-        logger.warning("Timeout while closing WebSocket connections")
-    
-    sys.exit(0)
-
-signal.signal(signal.SIGTERM, handle_shutdown)
-signal.signal(signal.SIGINT, handle_shutdown)
\ No newline at end of file
+
+# Not ready until warmed up: by lifespan startup, or by the first /ready on
+# servers that don't speak lifespan
+startup_seconds.labels('import').set(time.perf_counter() - started)
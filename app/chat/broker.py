@@ -0,0 +1,240 @@
+# broker.py for Django WebSocket Service
+#
+# Local message broker for UnixSocketChannelLayer: one per host, shared by
+# every uvicorn worker on it. Run with
+#   python -m app.chat.broker --path /tmp/chat-broker.sock
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import deque
+
+from app.chat.layers import client_of, pack_frame, read_frame
+
+logger = logging.getLogger("chat")
+
+# Bytes buffered for a worker before the broker waits for it to catch up
+HIGH_WATER = 1 << 20
+
+
+class Client:
+    """One connected worker and the delivery accounting for its channels."""
+
+    def __init__(self, client_id, writer, capacity, channel_capacity):
+        self.client_id = client_id
+        self.writer = writer
+        self.capacity = capacity
+        self.channel_capacity = [(re.compile(pattern), value) for pattern, value in channel_capacity]
+        # {channel: messages routed and not yet received}
+        self.pending = {}
+        # One drain() at a time: every worker sending here may wait on it
+        self.draining = asyncio.Lock()
+
+    def get_capacity(self, channel):
+        for pattern, capacity in self.channel_capacity:
+            if pattern.match(channel):
+                return capacity
+        return self.capacity
+
+    def admit(self, channel):
+        pending = self.pending.get(channel, 0)
+        if pending >= self.get_capacity(channel):
+            return False
+        self.pending[channel] = pending + 1
+        return True
+
+    def write(self, *items):
+        self.writer.write(pack_frame(*items))
+
+    def behind(self):
+        return self.writer.transport.get_write_buffer_size() > HIGH_WATER
+
+    async def drain(self):
+        async with self.draining:
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                # Its own handler forgets it
+                pass
+
+
+class Broker:
+    """Routes channel and group messages between the workers on a host.
+
+    Process-specific channels are pushed to the worker that owns them.
+    Channels without a ``!`` are queued here until a worker asks for them.
+    """
+
+    def __init__(self, capacity=100, group_expiry=86400, clock=time.time):
+        self.capacity = capacity
+        self.group_expiry = group_expiry
+        self.clock = clock
+        # {client_id: Client}
+        self.clients = {}
+        # {group: {channel: joined_at}}
+        self.groups = {}
+        # Channels without an owner: {channel: deque of payloads}, and
+        # {channel: deque of (client, request_id)} waiting on them
+        self.queues = {}
+        self.waiting = {}
+        self.dropped = 0
+
+    async def handle(self, reader, writer):
+        client = None
+        try:
+            frame = await read_frame(reader)
+            if frame[0] != 'hello':
+                raise ValueError("Expected hello, got %r" % frame[0])
+            _, client_id, capacity, channel_capacity, group_expiry = frame
+            client = self.clients[client_id] = Client(client_id, writer, capacity, channel_capacity)
+            self.group_expiry = group_expiry
+            while True:
+                self.dispatch(client, await read_frame(reader))
+                # Stop reading from this worker while any worker it routes
+                # to, itself included, has a backlog
+                for target in list(self.clients.values()):
+                    if target.behind():
+                        await target.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception as e:
+            logger.error("Error in channel broker connection", extra={"event": "error", "extra": {"error": str(e)}})
+        finally:
+            if client is not None:
+                self.forget(client)
+            writer.close()
+
+    def dispatch(self, client, frame):
+        op = frame[0]
+        if op == 'group_send':
+            self.group_send(client, *frame[1:])
+        elif op == 'received':
+            pending = client.pending
+            for channel in frame[1]:
+                count = pending.get(channel, 0) - 1
+                if count > 0:
+                    pending[channel] = count
+                else:
+                    pending.pop(channel, None)
+        elif op == 'group_add':
+            self.groups.setdefault(frame[1], {})[frame[2]] = self.clock()
+        elif op == 'group_discard':
+            members = self.groups.get(frame[1])
+            if members is not None:
+                members.pop(frame[2], None)
+                if not members:
+                    del self.groups[frame[1]]
+        elif op == 'send':
+            _, request_id, channel, payload = frame
+            client.write('reply', request_id, self.send(channel, payload))
+        elif op == 'receive':
+            self.receive(client, frame[1], frame[2])
+        elif op == 'close':
+            client.pending.pop(frame[1], None)
+        elif op == 'flush':
+            self.groups.clear()
+            self.queues.clear()
+            client.write('reply', frame[1], True)
+        else:
+            raise ValueError("Unknown op %r" % op)
+
+    def send(self, channel, payload):
+        """Route one message; False if the channel is at capacity."""
+        owner = client_of(channel)
+        if owner is None:
+            return self.enqueue(channel, payload)
+        target = self.clients.get(owner)
+        if target is None:
+            # Its worker is gone; like sending to an abandoned channel
+            return True
+        if not target.admit(channel):
+            return False
+        target.write('msg', channel, payload)
+        return True
+
+    def group_send(self, sender, group, payload, exclude_sender):
+        members = self.groups.get(group)
+        if not members:
+            return
+        expired = self.clock() - self.group_expiry
+        # One frame per worker, listing its member channels
+        batches = {}
+        for channel, joined in list(members.items()):
+            if joined < expired:
+                del members[channel]
+                continue
+            owner = client_of(channel)
+            if owner is None:
+                self.enqueue(channel, payload)
+                continue
+            target = self.clients.get(owner)
+            if target is None or (exclude_sender and target is sender):
+                continue
+            if target.admit(channel):
+                batches.setdefault(target, []).append(channel)
+            else:
+                self.dropped += 1
+        for target, channels in batches.items():
+            target.write('gmsg', channels, payload)
+
+    def enqueue(self, channel, payload):
+        waiting = self.waiting.get(channel)
+        while waiting:
+            client, request_id = waiting.popleft()
+            if client.client_id in self.clients:
+                client.write('reply', request_id, payload)
+                return True
+        queue = self.queues.setdefault(channel, deque())
+        if len(queue) >= self.capacity:
+            return False
+        queue.append(payload)
+        return True
+
+    def receive(self, client, request_id, channel):
+        queue = self.queues.get(channel)
+        if queue:
+            client.write('reply', request_id, queue.popleft())
+        else:
+            self.waiting.setdefault(channel, deque()).append((client, request_id))
+
+    def forget(self, client):
+        """Drop a disconnected worker's channels from every group."""
+        if self.clients.get(client.client_id) is not client:
+            # A stale connection; the worker has reconnected and owns its channels again
+            return
+        del self.clients[client.client_id]
+        for group, members in list(self.groups.items()):
+            for channel in [channel for channel in members if client_of(channel) == client.client_id]:
+                del members[channel]
+            if not members:
+                del self.groups[group]
+
+
+async def serve(path, broker=None):
+    broker = broker or Broker()
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(broker.handle, path)
+    logger.info("Channel broker listening", extra={"event": "broker", "extra": {"path": path}})
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local channel broker for UnixSocketChannelLayer.')
+    parser.add_argument('--path', default=os.environ.get('CHAT_BROKER_PATH', '/tmp/chat-broker.sock'))
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def run():
+        server = await serve(options.path)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
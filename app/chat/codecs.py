@@ -0,0 +1,199 @@
+# codecs.py for Django WebSocket Service
+
+import json
+import time
+import zlib
+
+from django.conf import settings
+from prometheus_client import Counter, Histogram
+
+from app.chat.metrics import LATENCY_BUCKETS, batch as metric_batch
+
+compression_input = metric_batch.counter(Counter(
+    'chat_compression_input_bytes_total', 'Bytes of frames over the compression threshold, before compression'))
+compression_output = metric_batch.counter(Counter(
+    'chat_compression_output_bytes_total', 'Bytes actually sent for frames over the compression threshold'))
+compression_seconds = metric_batch.histogram(Histogram(
+    'chat_compression_seconds', 'Time spent compressing one frame', buckets=LATENCY_BUCKETS))
+compression_skipped = metric_batch.counter(Counter(
+    'chat_compression_skipped_total', 'Frames over the threshold sent uncompressed because deflate did not shrink them'))
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional codec
+    msgpack = None
+
+
+class JsonCodec:
+    """Text frames holding compact JSON; the default when no subprotocol is asked for."""
+
+    name = 'json'
+    subprotocol = 'chat.json'
+
+    if orjson is not None:
+        def encode(self, obj):
+            return orjson.dumps(obj).decode()
+
+        def loads(self, data):
+            return orjson.loads(data)
+    else:
+        def encode(self, obj):
+            return json.dumps(obj, separators=(',', ':'))
+
+        def loads(self, data):
+            return json.loads(data)
+
+    def decode(self, text_data=None, bytes_data=None):
+        return self.loads(text_data if text_data is not None else bytes_data)
+
+    def join(self, frames):
+        return '{"batch":[' + ','.join(frames) + ']}'
+
+
+class MsgpackCodec:
+    """Binary MessagePack frames, negotiated with the ``chat.msgpack`` subprotocol."""
+
+    name = 'msgpack'
+    subprotocol = 'chat.msgpack'
+
+    def __init__(self):
+        self.batch_key = msgpack.packb('batch')
+        self.packer = msgpack.Packer()
+
+    def encode(self, obj):
+        return msgpack.packb(obj)
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            # Plain JSON text is still accepted on a msgpack connection
+            return JSON.decode(text_data)
+        return msgpack.unpackb(bytes_data)
+
+    def join(self, frames):
+        # {"batch": [...]} around frames that are already packed
+        return b''.join([b'\x81', self.batch_key, self.packer.pack_array_header(len(frames))] + frames)
+
+
+class DeflateCodec:
+    """Wraps another codec and zlib-compresses frames above ``threshold`` bytes.
+
+    Negotiated as ``<subprotocol>+deflate``. Compressed frames are binary
+    and start with the zlib header byte 0x78, which neither JSON text nor a
+    msgpack map frame can; smaller frames go out exactly as the wrapped codec
+    sends them. Clients may compress what they send the same way.
+    """
+
+    def __init__(self, inner, threshold=1024, level=6, max_size=1 << 20):
+        self.inner = inner
+        self.name = inner.name + '+deflate'
+        self.subprotocol = inner.subprotocol + '+deflate'
+        self.threshold = threshold
+        self.level = level
+        self.max_size = max_size
+
+    def encode(self, obj):
+        return self.compress(self.inner.encode(obj))
+
+    def compress(self, frame):
+        size = len(frame)
+        if size < self.threshold:
+            return frame
+        start = time.perf_counter()
+        compressed = zlib.compress(frame.encode() if isinstance(frame, str) else frame, self.level)
+        compression_seconds.observe(time.perf_counter() - start)
+        compression_input.inc(size)
+        if len(compressed) >= size:
+            compression_skipped.inc()
+            compression_output.inc(size)
+            return frame
+        compression_output.inc(len(compressed))
+        return compressed
+
+    def inflate(self, frame):
+        if not isinstance(frame, bytes) or frame[:1] != b'\x78':
+            return frame
+        inflater = zlib.decompressobj()
+        data = inflater.decompress(frame, self.max_size)
+        if inflater.unconsumed_tail:
+            raise ValueError("Compressed frame inflates past %d bytes" % self.max_size)
+        # Text codecs get text back
+        return data.decode() if isinstance(self.inner, JsonCodec) else data
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            bytes_data = self.inflate(bytes_data)
+            if isinstance(bytes_data, str):
+                return self.inner.decode(text_data=bytes_data)
+        return self.inner.decode(text_data, bytes_data)
+
+    def join(self, frames):
+        # Batches are rare (a backed up client), so inflate and redo them
+        return self.compress(self.inner.join([self.inflate(frame) for frame in frames]))
+
+
+JSON = JsonCodec()
+
+CODECS = {JSON.subprotocol: JSON}
+if msgpack is not None:
+    CODECS[MsgpackCodec.subprotocol] = MsgpackCodec()
+
+_compression = getattr(settings, 'CHAT_COMPRESSION', {})
+if _compression.get('ENABLED', True):
+    for _codec in list(CODECS.values()):
+        _deflate = DeflateCodec(
+            _codec,
+            threshold=_compression.get('THRESHOLD', 1024),
+            level=_compression.get('LEVEL', 6),
+            max_size=_compression.get('MAX_INFLATED_SIZE', 1 << 20),
+        )
+        CODECS[_deflate.subprotocol] = _deflate
+
+
+def negotiate(scope):
+    """Pick the codec for a connection from its Sec-WebSocket-Protocol offers.
+
+    Returns ``(codec, subprotocol)``; subprotocol is None when the client
+    didn't offer one we speak, in which case it gets plain JSON.
+    """
+    for subprotocol in scope.get('subprotocols') or ():
+        codec = CODECS.get(subprotocol)
+        if codec is not None:
+            return codec, subprotocol
+    return JSON, None
+
+
+def encode_for(event, codec, keys):
+    """Encode the ``keys`` fields of ``event`` for ``codec`` once per event.
+
+    Encoded frames are cached on the event under ``frames``, so every
+    recipient of a broadcast that shares a codec reuses the same frame, and
+    compressed frames are compressed once.
+    """
+    frames = event.get('frames')
+    if frames is None:
+        frames = event['frames'] = {}
+    frame = frames.get(codec.name)
+    if frame is None:
+        inner = getattr(codec, 'inner', None)
+        if inner is not None:
+            # Compress the wrapped codec's (shared) frame, once per event
+            frame = codec.compress(encode_for(event, inner, keys))
+        else:
+            frame = codec.encode({key: event[key] for key in keys})
+        frames[codec.name] = frame
+    return frame
+
+
+def transcode(frame, codec):
+    """A JSON text frame as ``codec`` would have encoded it, for replays."""
+    if codec is JSON:
+        return frame
+    inner = getattr(codec, 'inner', None)
+    if inner is not None:
+        return codec.compress(transcode(frame, inner))
+    return codec.encode(JSON.loads(frame))
@@ -1,57 +1,86 @@
 # consumers.py for Django WebSocket Service
 
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 
 import asyncio
-import datetime
+import itertools
+import re
+import sys
 import uuid
 from urllib.parse import parse_qs
 from prometheus_client import Counter, Gauge, Histogram
 import time
 import logging
 
-# Define Prometheus metrics
-total_messages = Counter('total_messages', 'Total number of messages processed')
-active_connections = Gauge('active_connections', 'Number of active WebSocket connections')
-error_count = Counter('error_count', 'Number of errors encountered')
-shutdown_time = Histogram('shutdown_time_seconds', 'Time taken to shut down the service')
+from app.chat import codecs, relay
+from app.chat.fanout import WORKER_ID, local_groups, spans_processes
+from app.chat.health import health_checker
+from app.chat.heartbeat import scheduler as heartbeat_scheduler
+from app.chat.history import room_histories
+from app.chat.logs import configure as configure_logging
+from app.chat.loopmon import loop_monitor
+from app.chat.metrics import batch as metric_batch, broadcast_seconds, delivery_seconds, send_seconds
+from app.chat.migration import migration
+from app.chat.outbound import outbound_queue
+from app.chat.ratelimit import CLOSE, THROTTLE, rate_limiter
+from app.chat.sessions import get_session_store
 
-class JsonFormatter(logging.Formatter):
-    def format(self, record):
-        import json
-        log_record = {
-            "level": record.levelname,
-            "message": record.getMessage(),
-            "time": self.formatTime(record, self.datefmt),
-        }
-        if hasattr(record, "request_id"):
-            log_record["request_id"] = record.request_id
-        if hasattr(record, "event"):
-            log_record["event"] = record.event
-        if hasattr(record, "extra"):
-            log_record.update(record.extra)
-        return json.dumps(log_record)
+# Define Prometheus metrics. The hot-path ones are batched on the event loop
+# and flushed into the registry periodically and on every scrape.
+total_messages = metric_batch.counter(Counter('total_messages', 'Total number of messages processed'))
+active_connections = metric_batch.gauge(Gauge('active_connections', 'Number of active WebSocket connections', multiprocess_mode='livesum'))
+error_count = metric_batch.counter(Counter('error_count', 'Number of errors encountered'))
+shutdown_time = Histogram('shutdown_time_seconds', 'Time taken to shut down the service')
 
 logger = logging.getLogger("chat")
-handler = logging.StreamHandler()
-handler.setFormatter(JsonFormatter())
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
+configure_logging(logger)
+
+DEFAULT_ROOM = 'chat_room'
+# Room names end up in channel layer group names, which only allow these
+ROOM_NAME = re.compile(r'^[a-zA-Z0-9\-_.]{1,90}$')
+
+# Event fields that make up the client-facing payload
+CHAT_FIELDS = ('message', 'count', 'seq')
+HEARTBEAT_FIELDS = ('ts',)
+
+# Request ids only need to tell this worker's connections apart in the logs
+connection_ids = itertools.count(1)
 
 class ChatConsumer(AsyncWebsocketConsumer):
-    # In-memory session store: {session_id: message_count}
-    sessions = {}
-    active_ws_connections = []
+    # Live connections in this worker: {channel_name: consumer}
+    active_ws_connections = {}
+
+    # Our own per-connection fields live in slots. The channels base classes
+    # aren't slotted, so every consumer still has an instance dict, holding
+    # scope, channel_layer, channel_name, base_send, groups and the rest.
+    __slots__ = ('message_count', 'session_id', 'room_name', 'room_group_name', 'bucket', 'codec',
+                 'outbound', 'request_id', 'last_seen')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.message_count = 0
         self.session_id = None
+        self.room_name = None
+        self.room_group_name = None
+        self.bucket = None
+        self.codec = codecs.JSON
+        self.outbound = outbound_queue(self)
+        self.request_id = None
+        # time.monotonic() of the last frame from the client
+        self.last_seen = time.monotonic()
 
     async def connect(self):
         try:
+            metric_batch.ensure_running()
+            health_checker.ensure_running()
+            loop_monitor.ensure_running()
             active_connections.inc()
+            # Admission control: a full worker turns new connections away
+            if not rate_limiter.admit(len(ChatConsumer.active_ws_connections)):
+                await self.accept()
+                await self.send_frame(self.codec.encode({"error": "overloaded", "retry_after": rate_limiter.retry_after}))
+                await self.close(code=1013)
+                return
             # Parse session_id from query string, or generate a new one
             query_string = self.scope.get("query_string", b"").decode()
             params = parse_qs(query_string)
@@ -59,12 +88,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if session_id is None:
                 session_id = str(uuid.uuid4())
             self.session_id = session_id
+            self.bucket = rate_limiter.connection_bucket()
 
             # Resume message count if session exists, else start at 0
-            self.message_count = ChatConsumer.sessions.get(self.session_id, 0)
+            self.message_count = await get_session_store().aget(self.session_id, 0)
 
-            self.room_name = 'chat_room'
-            self.room_group_name = 'chat_%s' % self.room_name
+            # Room comes from the route (ws/chat/<room>/) or ?room=
+            route_kwargs = self.scope.get("url_route", {}).get("kwargs", {})
+            room_name = route_kwargs.get("room") or params.get("room", [DEFAULT_ROOM])[0]
+            if not ROOM_NAME.match(room_name):
+                await self.close()
+                return
+            # Interned, so a room's members share one copy of each name
+            self.room_name = sys.intern(room_name)
+            self.room_group_name = sys.intern('chat_%s' % room_name)
 
             # Join room group
             await self.channel_layer.group_add(
@@ -72,13 +109,30 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
 
-            await self.accept()
-            # Optionally, send the session_id to the client
-            await self.send(text_data=json.dumps({"session": self.session_id, "count": self.message_count}))
-            self.request_id = str(uuid.uuid4())
+            # Pick the wire codec from the client's Sec-WebSocket-Protocol
+            self.codec, subprotocol = codecs.negotiate(self.scope)
+            self.outbound.codec = self.codec
+            await self.accept(subprotocol=subprotocol)
+            # Optionally, send the session_id to the client, with where the
+            # room's sequence is so it can resume from there later
+            history = room_histories.room(self.room_group_name)
+            await self.send_frame(self.codec.encode({
+                "session": self.session_id, "count": self.message_count, "room": self.room_name,
+                "seq": history.seq, "epoch": history.epoch,
+            }))
+            # Replay what a resuming client missed, then start taking local
+            # broadcasts. Nothing awaits in between, so the queue keeps order.
+            last_seq = params.get("last_seq", [None])[0]
+            if last_seq is not None and last_seq.isdigit():
+                self.replay(int(last_seq), params.get("epoch", [None])[0])
+            local_groups.add(self.room_group_name, self)
+            self.request_id = next(connection_ids)
             logger.info("WebSocket connected", extra={"request_id": self.request_id, "event": "connect"})
-            ChatConsumer.active_ws_connections.append(self)
-            asyncio.create_task(self.send_heartbeat())
+            ChatConsumer.active_ws_connections[self.channel_name] = self
+            heartbeat_scheduler.register(self)
+            # Clients that still land here mid-cutover move on with the rest
+            if migration.draining:
+                migration.schedule(self)
         except Exception as e:
             logger.error(f"Exception: str({e})")
             error_count.inc()
@@ -88,18 +142,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
         try:
             start = time.time()
             active_connections.dec()
+            heartbeat_scheduler.unregister(self)
+            ChatConsumer.active_ws_connections.pop(self.channel_name, None)
+            self.outbound.close()
             # Save the message count in the session store
             if self.session_id:
-                ChatConsumer.sessions[self.session_id] = self.message_count
+                get_session_store().set(self.session_id, self.message_count)
             # Leave room group
-            await self.channel_layer.group_discard(
-                self.room_group_name,
-                self.channel_name
-            )
+            if self.room_group_name:
+                local_groups.discard(self.room_group_name, self)
+                await self.channel_layer.group_discard(
+                    self.room_group_name,
+                    self.channel_name
+                )
             # send a bye message
-            await self.send(text_data=json.dumps({"bye": True, "total": self.message_count}))
+            await self.send_frame(self.codec.encode({"bye": True, "total": self.message_count}))
             logger.info("WebSocket disconnected", extra={"request_id": self.request_id, "event": "disconnect", "extra": {"close_code": close_code}})
-            ChatConsumer.active_ws_connections.remove(self)
             shutdown_time.observe(time.time() - start)
         except Exception as e:
             if (close_code != 1005):
@@ -108,59 +166,138 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 logger.error("Error disconnecting WebSocket", extra={"request_id": self.request_id, "event": "error", "extra": {"error": str(e)}})
             else:
                 logger.info("WebSocket disconnected by user", extra={"request_id": self.request_id, "event": "disconnect", "extra": {"close_code": close_code}})
-                ChatConsumer.active_ws_connections.remove(self)
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            text_data_json = json.loads(text_data)
-            message = text_data_json['message']
+            received = time.perf_counter()
+            self.last_seen = time.monotonic()
+            if relay.ENABLED and relay.is_relay(bytes_data):
+                await self.relay_frame(bytes_data, received)
+                return
+            data = self.codec.decode(text_data, bytes_data)
+            if 'pong' in data:
+                # Answer to a heartbeat: proof of life for the idle reaper
+                return
+            message = data['message']
+            if not await self.allow_message():
+                return
             self.message_count += 1
             total_messages.inc()
             logger.info("Message received", extra={"request_id": self.request_id, "event": "receive", "extra": {"message": message, "count": self.message_count}})
 
             # Save updated count in session store
             if self.session_id:
-                ChatConsumer.sessions[self.session_id] = self.message_count
+                get_session_store().set(self.session_id, self.message_count)
 
-            # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'count': self.message_count
-                }
-            )
+            # Send message to room group. The JSON frame is encoded here once
+            # so remote workers can forward it, and is all the replay buffer
+            # keeps; other codecs are encoded once per broadcast by the first
+            # recipient that needs them.
+            # stamp is wall clock so delivery latency holds across workers
+            history = room_histories.room(self.room_group_name)
+            event = {
+                'type': 'chat_message',
+                'message': message,
+                'count': self.message_count,
+                'seq': history.seq + 1,
+                'stamp': time.time(),
+            }
+            history.append(event['seq'], codecs.encode_for(event, codecs.JSON, CHAT_FIELDS))
+            await local_groups.group_send(self.channel_layer, self.room_group_name, event)
+            broadcast_seconds.observe(time.perf_counter() - received)
         except Exception as e:
             error_count.inc()
             logger.error("Error processing message", extra={"request_id": self.request_id, "event": "error", "extra": {"error": str(e)}})
 
+    async def relay_frame(self, frame, received):
+        # Routed on the header alone; the payload is opaque to the server
+        try:
+            kind, room = relay.parse(frame)
+            if room and room != self.room_name:
+                raise relay.RelayError('wrong_room', "Relay frame for room %s sent from %s" % (room, self.room_name))
+        except relay.RelayError as e:
+            relay.relay_rejected.labels(e.reason).inc()
+            self.outbound.put(self.codec.encode({"error": e.reason}))
+            return
+        if not await self.allow_message():
+            return
+        total_messages.inc()
+        relay.relay_frames.inc()
+        relay.relay_bytes.inc(len(frame))
+        logger.info("Relay frame received", extra={"request_id": self.request_id, "event": "receive", "extra": {"type": kind, "size": len(frame)}})
+        # Recipients get the frame exactly as it arrived, one bytes object
+        # shared by all of them. It isn't kept for replay.
+        event = {'type': 'chat_relay', 'frame': frame, 'stamp': time.time()}
+        await local_groups.group_send(self.channel_layer, self.room_group_name, event)
+        broadcast_seconds.observe(time.perf_counter() - received)
+
+    async def allow_message(self):
+        wait, _ = rate_limiter.check(self.bucket, self.session_id)
+        while wait:
+            if rate_limiter.policy == THROTTLE:
+                # Hold this connection's receive loop until a token frees up
+                await asyncio.sleep(wait)
+            elif rate_limiter.policy == CLOSE:
+                await self.close(code=1008)
+                return False
+            else:
+                self.outbound.put(self.codec.encode({"error": "rate_limited", "retry_after": round(wait, 3)}))
+                return False
+            wait, _ = rate_limiter.check(self.bucket, self.session_id)
+        return True
+
+    def replay(self, last_seq, epoch):
+        if spans_processes(self.channel_layer):
+            # seq is numbered per worker, and other workers number this room
+            # too, so resuming here could skip or repeat messages
+            missed = None
+        else:
+            missed = room_histories.resume(self.room_group_name, last_seq, epoch)
+        if missed is None:
+            history = room_histories.room(self.room_group_name)
+            self.outbound.put(self.codec.encode({"error": "gap_too_large", "seq": history.seq, "epoch": history.epoch}))
+        elif missed:
+            self.outbound.put(self.codec.join([codecs.transcode(frame, self.codec) for frame in missed]))
+
+    async def dispatch(self, message):
+        # Members in this worker already got our own broadcasts in-process
+        if message.get('origin') == WORKER_ID:
+            return
+        await super().dispatch(message)
+
+    async def send_frame(self, frame):
+        start = time.perf_counter()
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+            send_seconds.labels('binary').observe(time.perf_counter() - start)
+        else:
+            await self.send(text_data=frame)
+            send_seconds.labels('text').observe(time.perf_counter() - start)
+
     async def chat_message(self, event):
-        message = event['message']
-        count = event['count']
-
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'message': message,
-            'count': count
-        }))
-
-    async def send_heartbeat(self):
-        while True:
-            logger.info("Sending heartbeat", extra={"request_id": self.request_id, "event": "heartbeat"})
-            await asyncio.sleep(30)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'heartbeat_message',
-                    'ts': datetime.datetime.now().isoformat()
-                }
-            )
+        # Reuse the frame already encoded for this codec, if any
+        frame = codecs.encode_for(event, self.codec, CHAT_FIELDS)
+        if 'stamp' in event:
+            path = 'local' if event.get('origin') == WORKER_ID else 'remote'
+            delivery_seconds.labels(path).observe(max(0.0, time.time() - event['stamp']))
+
+        # Queue message for the WebSocket writer
+        self.outbound.put(frame, coalesce=True)
+
+    async def chat_relay(self, event):
+        if 'stamp' in event:
+            path = 'local' if event.get('origin') == WORKER_ID else 'remote'
+            delivery_seconds.labels(path).observe(max(0.0, time.time() - event['stamp']))
+
+        # Never coalesced: the codec's batch frame would have to copy it
+        self.outbound.put(event['frame'])
 
     async def heartbeat_message(self, event):
-        ts = event['ts']
+        frame = codecs.encode_for(event, self.codec, HEARTBEAT_FIELDS)
+
+        # Queue heartbeat for the WebSocket writer
+        self.outbound.put(frame)
+
 
-        # Send heartbeat to WebSocket
-        await self.send(text_data=json.dumps({
-            'ts': ts
-        }))
\ No newline at end of file
+health_checker.watch(ChatConsumer.active_ws_connections)
+migration.watch(ChatConsumer.active_ws_connections)
@@ -0,0 +1,84 @@
+# fanout.py for Django WebSocket Service
+
+import logging
+import uuid
+
+from channels.layers import InMemoryChannelLayer
+from prometheus_client import Gauge
+
+from app.chat.metrics import fanout_size
+
+logger = logging.getLogger("chat")
+
+rooms_active = Gauge('chat_rooms_active', 'Rooms with at least one member in this worker', multiprocess_mode='livesum')
+
+# Tags messages this worker pushed through the channel layer, so members that
+# were already served in-process can drop the copy the layer hands back.
+WORKER_ID = uuid.uuid4().hex
+
+
+def spans_processes(channel_layer):
+    """Whether ``channel_layer`` reaches other workers, not just this one."""
+    return not isinstance(channel_layer, InMemoryChannelLayer)
+
+
+class LocalGroups:
+    """Process-local group registry with direct same-worker delivery.
+
+    Members of a group living in this worker get the message straight into
+    their handler. The channel layer is only used to reach other workers, and
+    skipped entirely when it can't span processes (InMemoryChannelLayer).
+
+    Each room is its own group, so this doubles as the room index: member
+    lookups and per-room counts are plain dict operations.
+    """
+
+    def __init__(self):
+        # {group: {channel_name: consumer}}
+        self.groups = {}
+
+    def add(self, group, consumer):
+        members = self.groups.get(group)
+        if members is None:
+            members = self.groups[group] = {}
+            rooms_active.inc()
+        members[consumer.channel_name] = consumer
+
+    def discard(self, group, consumer):
+        members = self.groups.get(group)
+        if members is None:
+            return
+        members.pop(consumer.channel_name, None)
+        if not members:
+            del self.groups[group]
+            rooms_active.dec()
+
+    def members(self, group):
+        return self.groups.get(group, {})
+
+    def count(self, group):
+        members = self.groups.get(group)
+        return len(members) if members else 0
+
+    def is_member(self, group, channel_name):
+        members = self.groups.get(group)
+        return members is not None and channel_name in members
+
+    async def group_send(self, channel_layer, group, message):
+        message['origin'] = WORKER_ID
+        members = self.groups.get(group)
+        if members:
+            fanout_size.observe(len(members))
+            handler_name = message['type'].replace('.', '_')
+            for consumer in list(members.values()):
+                try:
+                    await getattr(consumer, handler_name)(message)
+                except Exception as e:
+                    logger.error("Error in local delivery", extra={"event": "error", "extra": {"error": str(e)}})
+        if spans_processes(channel_layer):
+            # Layers that can leave out this worker's members save the echo
+            send = getattr(channel_layer, 'group_send_remote', None) or channel_layer.group_send
+            await send(group, message)
+
+
+local_groups = LocalGroups()
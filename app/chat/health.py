@@ -0,0 +1,120 @@
+# health.py for Django WebSocket Service
+
+import asyncio
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from prometheus_client import Gauge
+
+from app.chat.loopmon import loop_monitor
+from app.chat.sessions import get_session_store
+
+logger = logging.getLogger("chat")
+
+worker_ready = Gauge('chat_worker_ready', 'Whether this worker reports ready (1) or not (0)', multiprocess_mode='livesum')
+
+
+class HealthChecker:
+    """Refreshes dependency and saturation checks in the background.
+
+    Probes only read the cached result, so a burst of probes costs nothing
+    and can't pile onto a struggling channel layer. The worker is not ready
+    when a dependency check fails, or when it is past any of its saturation
+    thresholds: connections, frames queued for clients, or event loop lag.
+    """
+
+    def __init__(self, interval=1.0, timeout=0.5, max_connections=None, max_queue_depth=None, max_loop_lag=None):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_queue_depth = max_queue_depth
+        self.max_loop_lag = max_loop_lag
+        self.consumers = {}
+        self.result = None
+        self.task = None
+
+    def watch(self, consumers):
+        """Live connections to measure: ``{channel_name: consumer}``."""
+        self.consumers = consumers
+
+    def ensure_running(self):
+        loop = asyncio.get_event_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+
+    async def status(self):
+        if self.result is None:
+            # Only the very first probe waits for a check of its own
+            self.result = await self.check(0.0)
+        return self.result
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        lag = 0.0
+        while True:
+            try:
+                self.result = await self.check(lag)
+            except Exception as e:
+                logger.error("Error in health check", extra={"event": "error", "extra": {"error": str(e)}})
+            worker_ready.set(1 if self.result and self.result['ready'] else 0)
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            # The loop monitor's probes catch spikes between our ticks
+            lag = max(0.0, loop.time() - expected, loop_monitor.take_peak())
+
+    async def check(self, lag):
+        reasons = []
+        checks = {
+            'channel_layer': await self.check_channel_layer(),
+            'session_store': self.check_session_store(),
+        }
+        for name, outcome in checks.items():
+            if outcome != 'ok':
+                reasons.append(name)
+
+        connections = len(self.consumers)
+        queue_depth = sum(len(consumer.outbound) for consumer in list(self.consumers.values()))
+        load = {'connections': connections, 'queue_depth': queue_depth, 'loop_lag': round(lag, 4)}
+        if self.max_connections is not None and connections >= self.max_connections:
+            reasons.append('connections')
+        if self.max_queue_depth is not None and queue_depth >= self.max_queue_depth:
+            reasons.append('queue_depth')
+        if self.max_loop_lag is not None and lag >= self.max_loop_lag:
+            reasons.append('loop_lag')
+        return {'ready': not reasons, 'reasons': reasons, 'checks': checks, 'load': load, 'checked_at': time.time()}
+
+    async def check_channel_layer(self):
+        layer = get_channel_layer()
+        if layer is None:
+            return 'missing'
+        if not hasattr(layer, 'connection'):
+            # In-process layers have nothing to lose a connection to
+            return 'ok'
+        try:
+            await asyncio.wait_for(layer.connection(0), self.timeout)
+        except Exception as e:
+            return 'error: %s' % (str(e) or type(e).__name__)
+        return 'ok'
+
+    def check_session_store(self):
+        try:
+            get_session_store().ping()
+        except Exception as e:
+            return 'error: %s' % (str(e) or type(e).__name__)
+        return 'ok'
+
+
+def health_checker_from_settings():
+    config = getattr(settings, 'CHAT_HEALTH', {})
+    return HealthChecker(
+        interval=config.get('INTERVAL', 1.0),
+        timeout=config.get('TIMEOUT', 0.5),
+        max_connections=config.get('MAX_CONNECTIONS'),
+        max_queue_depth=config.get('MAX_QUEUE_DEPTH'),
+        max_loop_lag=config.get('MAX_LOOP_LAG'),
+    )
+
+
+health_checker = health_checker_from_settings()
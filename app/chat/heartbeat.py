@@ -0,0 +1,111 @@
+# heartbeat.py for Django WebSocket Service
+
+import asyncio
+import datetime
+import logging
+import random
+import time
+
+from django.conf import settings
+from prometheus_client import Counter
+
+logger = logging.getLogger("chat")
+
+idle_reaped = Counter('chat_idle_reaped_total', 'Connections closed for sending nothing within the idle timeout')
+
+
+class HeartbeatScheduler:
+    """Process-wide heartbeat timer wheel.
+
+    The heartbeat interval is split into ``slots`` buckets. Each connection is
+    dropped into a random bucket when it registers, so every live connection
+    gets exactly one heartbeat per revolution and the sends are spread evenly
+    across the interval instead of all landing on the same tick.
+
+    The wheel is also the idle reaper: with ``idle_timeout`` set, a
+    connection whose ``last_seen`` (``time.monotonic()`` of its last frame,
+    heartbeat pongs included) is older than that is closed with 1001 when
+    its slot comes up, instead of getting a heartbeat. No connection needs a
+    timer of its own for either.
+    """
+
+    def __init__(self, interval=30.0, slots=60, idle_timeout=None):
+        self.interval = float(interval)
+        self.idle_timeout = idle_timeout
+        self.slots = max(1, int(slots))
+        self.tick = self.interval / self.slots
+        # One dict per slot: {channel_name: consumer}
+        self.buckets = [{} for _ in range(self.slots)]
+        # {channel_name: slot} so unregister never has to scan the wheel
+        self.index = {}
+        self.cursor = 0
+        self.task = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def register(self, consumer):
+        slot = random.randrange(self.slots)
+        self.buckets[slot][consumer.channel_name] = consumer
+        self.index[consumer.channel_name] = slot
+        self._ensure_running()
+
+    def unregister(self, consumer):
+        slot = self.index.pop(consumer.channel_name, None)
+        if slot is not None:
+            self.buckets[slot].pop(consumer.channel_name, None)
+        if not self.index and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            # Absolute deadlines so slow ticks don't push the whole wheel back
+            deadline += self.tick
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            self.cursor = (self.cursor + 1) % self.slots
+            bucket = self.buckets[self.cursor]
+            if bucket:
+                await self.beat(list(bucket.values()))
+
+    async def beat(self, consumers):
+        # Shared by every consumer in the bucket, so each codec encodes the
+        # frame once per tick
+        event = {
+            'type': 'heartbeat_message',
+            'ts': datetime.datetime.now().isoformat()
+        }
+        logger.info("Sending heartbeat", extra={"event": "heartbeat", "extra": {"connections": len(consumers)}})
+        idle_before = time.monotonic() - self.idle_timeout if self.idle_timeout else None
+        reaped = []
+        # One after the other: the handlers only queue a frame, and a gather
+        # would wrap every one of them in a task
+        for consumer in consumers:
+            try:
+                if idle_before is not None and consumer.last_seen < idle_before:
+                    reaped.append(consumer)
+                    await consumer.close(code=1001)
+                else:
+                    await consumer.heartbeat_message(event)
+            except Exception as e:
+                logger.error("Error sending heartbeat", extra={"event": "error", "extra": {"error": str(e)}})
+        if reaped:
+            idle_reaped.inc(len(reaped))
+            logger.info("Closed idle connections", extra={"event": "heartbeat", "extra": {"connections": len(reaped)}})
+            # Off the wheel now, even before their disconnect comes through
+            for consumer in reaped:
+                self.unregister(consumer)
+
+
+scheduler = HeartbeatScheduler(
+    interval=getattr(settings, 'CHAT_HEARTBEAT_INTERVAL', 30),
+    slots=getattr(settings, 'CHAT_HEARTBEAT_SLOTS', 60),
+    idle_timeout=getattr(settings, 'CHAT_IDLE_TIMEOUT', None),
+)
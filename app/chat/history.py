@@ -0,0 +1,161 @@
+# history.py for Django WebSocket Service
+
+import asyncio
+import sys
+import uuid
+from collections import OrderedDict, deque
+from itertools import islice
+
+from django.conf import settings
+from prometheus_client import Counter, Gauge
+
+history_bytes = Gauge('chat_history_bytes', 'Memory held by the frames in room replay buffers', multiprocess_mode='livesum')
+history_rooms = Gauge('chat_history_rooms', 'Rooms with a replay buffer in this worker', multiprocess_mode='livesum')
+history_replayed = Counter('chat_history_replayed_total', 'Messages replayed to reconnecting clients')
+history_gaps = Counter('chat_history_gaps_total', 'Resumes that asked for more than the replay buffer holds')
+
+
+def frame_size(frame):
+    # What the buffer really holds for a frame, object header included
+    return sys.getsizeof(frame)
+
+
+class RoomHistory:
+    """Ring buffer of a room's recent chat frames, with sequence numbers.
+
+    Only each message's JSON frame is kept, the same string the broadcast
+    sent, not the event it was built from. Frames are appended with ``seq``
+    one higher than the last and dropped from the old end once the buffer
+    holds more than ``max_messages`` or ``max_bytes``. ``epoch`` changes
+    whenever the sequence restarts (a new buffer for the room), so a client
+    can't resume against the wrong one.
+    """
+
+    def __init__(self, max_messages=1000, max_bytes=1 << 20):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        # (seq, JSON frame)
+        self.entries = deque()
+        self.bytes = 0
+
+    def append(self, seq, frame):
+        """Keep the JSON ``frame`` of message ``seq``, which must be ``self.seq + 1``."""
+        self.seq = seq
+        self.entries.append((seq, frame))
+        size = frame_size(frame)
+        self.bytes += size
+        history_bytes.inc(size)
+        entries = self.entries
+        while len(entries) > self.max_messages or (self.bytes > self.max_bytes and len(entries) > 1):
+            _, dropped = entries.popleft()
+            size = frame_size(dropped)
+            self.bytes -= size
+            history_bytes.dec(size)
+
+    def since(self, last_seq):
+        """JSON frames after ``last_seq``, oldest first, or None if some are gone."""
+        if last_seq >= self.seq:
+            # Nothing missed, unless the client saw more than we ever had
+            return [] if last_seq == self.seq else None
+        first = self.entries[0][0] if self.entries else self.seq + 1
+        if last_seq + 1 < first:
+            return None
+        return [frame for _, frame in islice(self.entries, last_seq + 1 - first, None)]
+
+    def clear(self):
+        history_bytes.dec(self.bytes)
+        self.entries.clear()
+        self.bytes = 0
+
+
+class RoomHistories:
+    """Replay buffers by room group, the least recently used dropped past ``max_rooms``.
+
+    Buffers outlive their room's members so clients can resume after
+    everyone dropped off for a moment.
+    """
+
+    def __init__(self, max_rooms=10000, max_messages=1000, max_bytes=1 << 20):
+        self.max_rooms = max_rooms
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        # {group: RoomHistory}
+        self.rooms = OrderedDict()
+
+    def room(self, group):
+        history = self.rooms.get(group)
+        if history is None:
+            history = self.rooms[group] = RoomHistory(self.max_messages, self.max_bytes)
+            history_rooms.inc()
+            if len(self.rooms) > self.max_rooms:
+                _, evicted = self.rooms.popitem(last=False)
+                evicted.clear()
+                history_rooms.dec()
+        else:
+            self.rooms.move_to_end(group)
+        return history
+
+    def resume(self, group, last_seq, epoch=None):
+        """JSON frames a client that saw up to ``last_seq`` missed, or None for a gap."""
+        history = self.room(group)
+        if epoch is not None and epoch != history.epoch:
+            missed = None
+        else:
+            missed = history.since(last_seq)
+        if missed is None:
+            history_gaps.inc()
+        else:
+            history_replayed.inc(len(missed))
+        return missed
+
+    def dump(self):
+        """Every buffer as plain data, for a snapshot: ``{group: {epoch, seq, entries}}``."""
+        rooms = {}
+        for group, history in self.rooms.items():
+            entries = [list(entry) for entry in history.entries]
+            rooms[group] = {'epoch': history.epoch, 'seq': history.seq, 'entries': entries}
+        return rooms
+
+    def load(self, rooms):
+        """Take buffers from ``dump()`` output; returns how many were taken.
+
+        A room already further along here than in ``rooms`` is left alone,
+        so loading the same snapshot twice changes nothing.
+        """
+        loaded = 0
+        for group, room in rooms.items():
+            current = self.rooms.get(group)
+            if current is not None and current.seq >= room['seq']:
+                continue
+            history = self.room(group)
+            history.clear()
+            history.epoch = room['epoch']
+            for seq, frame in room['entries']:
+                history.append(seq, frame)
+            # A trimmed buffer still resumes from where the room really was
+            history.seq = room['seq']
+            loaded += 1
+        return loaded
+
+    async def aload(self, rooms, chunk=100):
+        """``load`` for the event loop, ``chunk`` rooms at a time."""
+        rooms = list(rooms.items())
+        loaded = 0
+        for start in range(0, len(rooms), chunk):
+            loaded += self.load(dict(rooms[start:start + chunk]))
+            await asyncio.sleep(0)
+        return loaded
+
+
+def room_histories_from_settings():
+    config = getattr(settings, 'CHAT_HISTORY', {})
+    return RoomHistories(
+        max_rooms=config.get('MAX_ROOMS', 10000),
+        max_messages=config.get('MAX_MESSAGES', 1000),
+        max_bytes=config.get('MAX_BYTES', 1 << 20),
+    )
+
+
+room_histories = room_histories_from_settings()
@@ -0,0 +1,300 @@
+# layers.py for Django WebSocket Service
+
+import asyncio
+import itertools
+import logging
+import random
+import string
+import time
+import uuid
+from collections import deque
+from copy import deepcopy
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger("chat")
+
+# Frames between a layer and the broker: 4-byte big-endian length, then a
+# msgpack array whose first item is the op. Message bodies are packed once by
+# the sender and relayed by the broker as opaque bytes.
+HEADER = 4
+
+
+def pack_frame(*items):
+    data = msgpack.packb(items, use_bin_type=True)
+    return len(data).to_bytes(HEADER, 'big') + data
+
+
+async def read_frame(reader):
+    size = int.from_bytes(await reader.readexactly(HEADER), 'big')
+    return msgpack.unpackb(await reader.readexactly(size), raw=False)
+
+
+def client_of(channel):
+    """Routing key of a process-specific channel: ``specific.<client>!x`` -> ``<client>``."""
+    head, bang, _ = channel.partition('!')
+    if not bang:
+        return None
+    return head.rpartition('.')[2]
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """Channel layer for workers on one host, through ``app.chat.broker``.
+
+    Every process-specific channel (``new_channel``) lives in the worker that
+    created it; the broker only routes. ``group_send`` is fire-and-forget and
+    pipelined: the broker sends each worker one frame per group message,
+    listing that worker's member channels, and the worker hands every member
+    its own copy. ``send`` waits for the broker's answer, so a channel at
+    capacity raises ``ChannelFull`` like the other layers.
+
+    Capacity is counted at the broker: messages routed to a channel and not
+    yet received. Workers report what they received in one frame per loop
+    iteration. Messages delivered to a worker and not received within
+    ``expiry`` seconds are dropped, so a channel whose consumer has gone
+    doesn't keep its mailbox.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path='/tmp/chat-broker.sock', expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, high_water=1 << 20, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.path = path
+        self.group_expiry = group_expiry
+        self.high_water = high_water
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.client_id = uuid.uuid4().hex
+        # Messages not yet received, {channel: deque of (deadline, message)},
+        # only while there are some; and {channel: future} of a receive()
+        # waiting for one. Idle channels cost a dict entry and a future, not
+        # an asyncio.Queue.
+        self.mailboxes = {}
+        self.waiters = {}
+        self.next_sweep = 0
+        # {(group, channel)} joined here; the broker forgets them when the
+        # connection drops, so they are sent again on every connect
+        self.memberships = set()
+        self.loop = None
+        self.connected = None
+        self.writer = None
+        self.listener = None
+        self.reconnecting = None
+        self.requests = {}
+        self.request_ids = itertools.count()
+        self.received = []
+
+    # Connection to the broker
+
+    async def connection(self, index=0):
+        # index only mirrors channels_redis, which has one connection per shard
+        loop = asyncio.get_event_loop()
+        if self.loop is not loop:
+            # Queues and futures belong to one event loop
+            self.reset()
+            self.mailboxes = {}
+            self.waiters = {}
+            self.loop = loop
+        if self.connected is None:
+            self.connected = loop.create_task(self.connect())
+        try:
+            return await asyncio.shield(self.connected)
+        except Exception:
+            self.connected = None
+            raise
+
+    async def connect(self):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        capacities = [(pattern.pattern, capacity) for pattern, capacity in self.channel_capacity]
+        writer.write(pack_frame('hello', self.client_id, self.capacity, capacities, self.group_expiry))
+        for group, channel in self.memberships:
+            writer.write(pack_frame('group_add', group, channel))
+        self.writer = writer
+        self.listener = self.loop.create_task(self.listen(reader, writer))
+        return writer
+
+    def reset(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.listener is not None and self.listener is not asyncio.current_task():
+            self.listener.cancel()
+        self.writer = None
+        self.listener = None
+        self.connected = None
+        for future in self.requests.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Lost connection to channel broker"))
+        self.requests = {}
+        self.received = []
+
+    async def listen(self, reader, writer):
+        try:
+            while True:
+                frame = await read_frame(reader)
+                op = frame[0]
+                if op == 'gmsg':
+                    _, channels, payload = frame
+                    message = msgpack.unpackb(payload, raw=False)
+                    for channel in channels:
+                        # Members share nothing but the values
+                        self.deliver(channel, dict(message))
+                elif op == 'msg':
+                    self.deliver(frame[1], msgpack.unpackb(frame[2], raw=False))
+                elif op == 'reply':
+                    future = self.requests.pop(frame[1], None)
+                    if future is not None and not future.done():
+                        future.set_result(frame[2])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning("Channel broker connection closed", extra={"event": "layer"})
+        except Exception as e:
+            logger.error("Error reading from channel broker", extra={"event": "error", "extra": {"error": str(e)}})
+        finally:
+            if self.writer is writer:
+                self.reset()
+                if self.memberships or self.waiters:
+                    self.reconnecting = self.loop.create_task(self.reconnect())
+
+    async def reconnect(self, delay=0.1):
+        # Rejoin groups now rather than on the next send, which a worker
+        # that only receives would never make
+        while self.writer is None and (self.memberships or self.waiters):
+            try:
+                await self.connection()
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    async def post(self, *items):
+        writer = await self.connection()
+        writer.write(pack_frame(*items))
+        if writer.transport.get_write_buffer_size() > self.high_water:
+            await writer.drain()
+
+    async def request(self, *items):
+        await self.connection()
+        request_id = next(self.request_ids)
+        future = self.requests[request_id] = asyncio.get_event_loop().create_future()
+        await self.post(items[0], request_id, *items[1:])
+        return await future
+
+    # Local delivery
+
+    def deliver(self, channel, message):
+        waiter = self.waiters.pop(channel, None)
+        if waiter is not None and not waiter.done():
+            # Only waits on an empty mailbox, so this keeps the order
+            waiter.set_result(message)
+            return
+        now = time.monotonic()
+        if now >= self.next_sweep:
+            self.expire(now)
+        mailbox = self.mailboxes.get(channel)
+        if mailbox is None:
+            mailbox = self.mailboxes[channel] = deque()
+        mailbox.append((now + self.expiry, message))
+
+    def expire(self, now):
+        """Drop messages past their deadline, and mailboxes left empty."""
+        self.next_sweep = now + self.expiry
+        for channel, mailbox in list(self.mailboxes.items()):
+            while mailbox and mailbox[0][0] <= now:
+                mailbox.popleft()
+                # Frees the capacity the broker counted for it
+                self.acknowledge(channel)
+            if not mailbox:
+                del self.mailboxes[channel]
+
+    def acknowledge(self, channel):
+        # Batch receipt reports into one frame per loop iteration
+        if not self.received:
+            asyncio.get_event_loop().call_soon(self.send_receipts)
+        self.received.append(channel)
+
+    def send_receipts(self):
+        received, self.received = self.received, []
+        if received and self.writer is not None:
+            self.writer.write(pack_frame('received', received))
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        if client_of(channel) == self.client_id:
+            if len(self.mailboxes.get(channel, ())) >= self.get_capacity(channel):
+                raise ChannelFull(channel)
+            self.deliver(channel, deepcopy(message))
+            return
+        if not await self.request('send', channel, msgpack.packb(message, use_bin_type=True)):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        # The broker has to know us before anything can be routed here
+        await self.connection()
+        if client_of(channel) != self.client_id:
+            payload = await self.request('receive', channel)
+            return msgpack.unpackb(payload, raw=False)
+        now = time.monotonic()
+        mailbox = self.mailboxes.get(channel)
+        if mailbox and mailbox[0][0] <= now:
+            self.expire(now)
+            mailbox = self.mailboxes.get(channel)
+        if mailbox:
+            _, message = mailbox.popleft()
+            if not mailbox:
+                del self.mailboxes[channel]
+        else:
+            waiter = self.waiters[channel] = asyncio.get_event_loop().create_future()
+            try:
+                message = await waiter
+            except asyncio.CancelledError:
+                if self.waiters.get(channel) is waiter:
+                    del self.waiters[channel]
+                if waiter.done() and not waiter.cancelled():
+                    # Delivered just as we were cancelled; keep it for the next receive
+                    self.mailboxes.setdefault(channel, deque()).appendleft((time.monotonic() + self.expiry, waiter.result()))
+                elif channel not in self.mailboxes and self.writer is not None:
+                    # The consumer is gone; let the broker forget the channel
+                    self.writer.write(pack_frame('close', channel))
+                raise
+        self.acknowledge(channel)
+        return message
+
+    async def new_channel(self, prefix='specific.'):
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return '%s%s!%s' % (prefix, self.client_id, suffix)
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self.memberships.add((group, channel))
+        await self.post('group_add', group, channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self.memberships.discard((group, channel))
+        await self.post('group_discard', group, channel)
+
+    async def group_send(self, group, message, exclude_self=False):
+        assert self.valid_group_name(group), "Group name not valid"
+        await self.post('group_send', group, msgpack.packb(message, use_bin_type=True), exclude_self)
+
+    async def group_send_remote(self, group, message):
+        """group_send to members in other workers only; this one already delivered locally."""
+        await self.group_send(group, message, exclude_self=True)
+
+    async def flush(self):
+        self.mailboxes = {}
+        self.memberships = set()
+        await self.request('flush')
+
+    async def close(self):
+        if self.reconnecting is not None:
+            self.reconnecting.cancel()
+            self.reconnecting = None
+        self.reset()
@@ -0,0 +1,76 @@
+# logs.py for Django WebSocket Service
+
+import atexit
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+from prometheus_client import Counter
+
+log_records_dropped = Counter('log_records_dropped_total', 'Log records dropped because the log queue was full')
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        log_record = {
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "time": self.formatTime(record, self.datefmt),
+        }
+        if hasattr(record, "request_id"):
+            log_record["request_id"] = record.request_id
+        if hasattr(record, "event"):
+            log_record["event"] = record.event
+        if hasattr(record, "extra"):
+            log_record.update(record.extra)
+        return json.dumps(log_record)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of records per ``event``; warnings and errors always pass."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "event", None))
+        if rate is None or rate >= 1:
+            return True
+        return rate > 0 and random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread without formatting or blocking."""
+
+    def prepare(self, record):
+        # Formatting is left to the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+
+def configure(logger):
+    """Route ``logger`` through a bounded queue to a JSON stream handler thread."""
+    config = getattr(settings, 'CHAT_LOGGING', {})
+    log_queue = queue.Queue(config.get('QUEUE_SIZE', 10000))
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addFilter(SamplingFilter(config.get('SAMPLING', {})))
+    logger.addHandler(NonBlockingQueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    return listener
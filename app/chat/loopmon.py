@@ -0,0 +1,169 @@
+# loopmon.py for Django WebSocket Service
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as Tally
+
+from django.conf import settings
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger("chat")
+
+loop_lag = Gauge('chat_event_loop_lag_seconds', 'How late the last loop probe woke up', multiprocess_mode='livemax')
+loop_delay = Histogram(
+    'chat_event_loop_delay_seconds', 'How late loop probes woke up',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+slow_callbacks = Counter('chat_slow_callbacks_total', 'Times a single callback held the event loop past the threshold')
+asyncio_tasks = Gauge('chat_asyncio_tasks', 'Pending asyncio tasks by coroutine, as of the last census', ['coroutine'], multiprocess_mode='livesum')
+
+
+def coroutine_name(task):
+    coro = task.get_coro()
+    return getattr(coro, '__qualname__', None) or type(coro).__name__
+
+
+def census(loop=None, stacks=0):
+    """Pending tasks on ``loop`` by coroutine name, most common first.
+
+    With ``stacks``, each entry also carries the stack of one of its tasks,
+    ``stacks`` frames deep.
+    """
+    tasks = asyncio.all_tasks(loop)
+    counts = Tally(coroutine_name(task) for task in tasks)
+    result = [{'coroutine': name, 'tasks': count} for name, count in counts.most_common()]
+    if stacks:
+        samples = {}
+        for task in tasks:
+            samples.setdefault(coroutine_name(task), task)
+        for entry in result:
+            frames = samples[entry['coroutine']].get_stack(limit=stacks)
+            entry['stack'] = ['%s:%d %s' % (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+                              for frame in frames]
+    return result
+
+
+class LoopMonitor:
+    """Watches one event loop for lag, blocking callbacks and piling-up tasks.
+
+    A probe on the loop wakes every ``interval`` seconds and records how late
+    it was. A watchdog thread checks that the probe keeps beating; when the
+    loop has been stuck for more than ``slow_callback`` seconds it logs the
+    loop thread's stack once, while the culprit is still running. Every
+    ``census_interval`` seconds the pending tasks are counted by coroutine
+    into ``chat_asyncio_tasks``.
+
+    The loop side costs one timer per ``interval``, and a census walks every
+    task, so it runs rarely.
+    """
+
+    def __init__(self, interval=0.1, slow_callback=0.1, census_interval=15.0, stack_depth=20, enabled=True):
+        self.enabled = enabled
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.census_interval = census_interval
+        self.stack_depth = stack_depth
+        self.loop = None
+        self.task = None
+        self.thread = None
+        self.thread_id = None
+        # loop.time() of the last probe, read by the watchdog
+        self.beat = None
+        self.reported = None
+        self.lag = 0.0
+        self.peak = 0.0
+        self.counted = set()
+        self.blocked = 0
+
+    def ensure_running(self):
+        if not self.enabled:
+            return
+        loop = asyncio.get_event_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.loop = loop
+            self.thread_id = threading.get_ident()
+            self.beat = None
+            self.task = loop.create_task(self.run())
+        if self.slow_callback and (self.thread is None or not self.thread.is_alive()):
+            self.thread = threading.Thread(target=self.watch, name='loop-watchdog', daemon=True)
+            self.thread.start()
+
+    def take_peak(self):
+        """Worst lag since the last call."""
+        peak, self.peak = self.peak, 0.0
+        return peak
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        next_census = loop.time() + self.census_interval
+        try:
+            while True:
+                expected = self.beat = loop.time()
+                await asyncio.sleep(self.interval)
+                now = loop.time()
+                lag = max(0.0, now - expected - self.interval)
+                self.lag = lag
+                if lag > self.peak:
+                    self.peak = lag
+                loop_lag.set(lag)
+                loop_delay.observe(lag)
+                if now >= next_census:
+                    next_census = now + self.census_interval
+                    self.count_tasks()
+        finally:
+            # Nothing left to watch
+            self.beat = None
+
+    def count_tasks(self):
+        counts = {entry['coroutine']: entry['tasks'] for entry in census(self.loop)}
+        for name in self.counted - counts.keys():
+            asyncio_tasks.labels(name).set(0)
+        for name, count in counts.items():
+            asyncio_tasks.labels(name).set(count)
+        self.counted = set(counts)
+
+    def watch(self):
+        # Checks twice per threshold, so a block is caught while it lasts
+        while True:
+            time.sleep(self.slow_callback / 2)
+            loop, beat = self.loop, self.beat
+            if loop is None or beat is None or beat == self.reported or not loop.is_running():
+                continue
+            stuck = loop.time() - beat - self.interval
+            if stuck > self.slow_callback:
+                self.reported = beat
+                self.report(stuck)
+
+    def report(self, stuck):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = traceback.format_stack(frame, limit=self.stack_depth) if frame is not None else []
+        self.blocked += 1
+        slow_callbacks.inc()
+        logger.warning("Event loop blocked", extra={"event": "loop", "extra": {
+            "blocked_for": round(stuck, 3), "stack": ''.join(stack)}})
+
+    def status(self):
+        return {
+            'lag': round(self.lag, 4),
+            'slow_callbacks': self.blocked,
+            'interval': self.interval,
+            'slow_callback': self.slow_callback,
+        }
+
+
+def loop_monitor_from_settings():
+    config = getattr(settings, 'CHAT_LOOP_MONITOR', {})
+    return LoopMonitor(
+        enabled=config.get('ENABLED', True),
+        interval=config.get('INTERVAL', 0.1),
+        slow_callback=config.get('SLOW_CALLBACK', 0.1),
+        census_interval=config.get('CENSUS_INTERVAL', 15.0),
+        stack_depth=config.get('STACK_DEPTH', 20),
+    )
+
+
+loop_monitor = loop_monitor_from_settings()
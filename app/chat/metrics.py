@@ -0,0 +1,224 @@
+# metrics.py for Django WebSocket Service
+
+import asyncio
+import bisect
+import logging
+import threading
+
+from django.conf import settings
+from prometheus_client import REGISTRY, Histogram
+
+logger = logging.getLogger("chat")
+
+
+class BatchedCounter:
+    """Counter (or gauge) whose increments accumulate in a plain number.
+
+    ``inc``/``dec`` are an attribute add on the event loop; the total is
+    pushed into the wrapped prometheus metric, which takes a lock per call,
+    once per flush.
+    """
+
+    __slots__ = ('metric', 'pending', 'batch', 'children')
+
+    def __init__(self, metric, batch):
+        self.metric = metric
+        self.pending = 0
+        self.batch = batch
+        self.children = {}
+
+    def inc(self, amount=1):
+        self.pending += amount
+
+    def dec(self, amount=1):
+        self.pending -= amount
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.batch.add(type(self)(self.metric.labels(*values), self.batch))
+        return child
+
+    def flush(self):
+        pending = self.pending
+        if pending:
+            self.pending = 0
+            self.metric.inc(pending)
+
+
+class BatchedGauge(BatchedCounter):
+    """Gauge that can also be ``set``; the flush pushes the last value set
+    plus whatever was added since."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, metric, batch):
+        super().__init__(metric, batch)
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+        self.pending = 0
+
+    def flush(self):
+        value = self.value
+        if value is None:
+            super().flush()
+            return
+        self.value = None
+        pending, self.pending = self.pending, 0
+        self.metric.set(value + pending)
+
+
+class BatchedHistogram:
+    """Histogram whose observations are bucketed locally between flushes."""
+
+    __slots__ = ('metric', 'bounds', 'counts', 'sum', 'batch', 'children')
+
+    def __init__(self, metric, batch):
+        self.metric = metric
+        self.batch = batch
+        self.children = {}
+        # Only a child (or unlabelled) histogram has buckets
+        self.bounds = list(getattr(metric, '_upper_bounds', ()))
+        self.counts = [0] * len(self.bounds)
+        self.sum = 0.0
+
+    def observe(self, amount):
+        self.counts[bisect.bisect_left(self.bounds, amount)] += 1
+        self.sum += amount
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.batch.add(type(self)(self.metric.labels(*values), self.batch))
+        return child
+
+    def flush(self):
+        counts = self.counts
+        if not any(counts):
+            return
+        self.counts = [0] * len(counts)
+        total, self.sum = self.sum, 0.0
+        # prometheus_client has no bulk observe; add to the bucket and sum
+        # values directly, the same ones Histogram.observe increments.
+        metric = self.metric
+        metric._sum.inc(total)
+        for bucket, count in zip(metric._buckets, counts):
+            if count:
+                bucket.inc(count)
+
+
+class MetricBatch:
+    """Accumulates hot-path metrics on the event loop and flushes them.
+
+    Flushes every ``interval`` seconds from a task on the loop, and at scrape
+    time so ``/metrics`` totals are exact. Scrapes are served from a worker
+    thread, so they hand the flush to the loop and wait up to ``timeout``.
+    """
+
+    def __init__(self, interval=1.0, timeout=1.0):
+        self.interval = interval
+        self.timeout = timeout
+        self.metrics = []
+        self.loop = None
+        self.task = None
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, metric):
+        return self.add(BatchedCounter(metric, self))
+
+    def gauge(self, metric):
+        return self.add(BatchedGauge(metric, self))
+
+    def histogram(self, metric):
+        return self.add(BatchedHistogram(metric, self))
+
+    def flush(self):
+        for metric in self.metrics:
+            metric.flush()
+
+    def ensure_running(self):
+        loop = asyncio.get_event_loop()
+        if self.loop is not loop or self.task is None or self.task.done():
+            self.loop = loop
+            self.task = loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Error flushing metrics", extra={"event": "error", "extra": {"error": str(e)}})
+
+    def sync(self):
+        """Flush before a scrape, from whichever thread is scraping."""
+        loop = self.loop
+        if loop is None or loop.is_closed() or not loop.is_running():
+            self.flush()
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self.flush()
+            return
+        done = threading.Event()
+
+        def flush():
+            try:
+                self.flush()
+            finally:
+                done.set()
+
+        loop.call_soon_threadsafe(flush)
+        if not done.wait(self.timeout):
+            logger.warning("Metrics flush timed out before scrape", extra={"event": "metrics"})
+
+
+class FlushOnCollect:
+    """Registry collector that yields nothing but flushes the batch.
+
+    The registry collects in registration order, so this is registered
+    before any batched metric is created.
+    """
+
+    def __init__(self, batch):
+        self.batch = batch
+
+    def collect(self):
+        self.batch.sync()
+        return []
+
+
+config = getattr(settings, 'CHAT_METRICS', {})
+batch = MetricBatch(interval=config.get('FLUSH_INTERVAL', 1.0), timeout=config.get('SCRAPE_TIMEOUT', 1.0))
+REGISTRY.register(FlushOnCollect(batch))
+
+# Sub-millisecond up to multi-second delays
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'),
+)
+# Members reached by one broadcast in this worker
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, float('inf'))
+
+broadcast_seconds = batch.histogram(Histogram(
+    'chat_broadcast_seconds', 'Time from a message being received to its group_send completing',
+    buckets=LATENCY_BUCKETS))
+# path is 'local' for in-process delivery, 'remote' for messages from another worker
+delivery_seconds = batch.histogram(Histogram(
+    'chat_delivery_latency_seconds', 'Time from a message being stamped on receive to its delivery in chat_message',
+    ['path'], buckets=LATENCY_BUCKETS))
+# kind is 'text' or 'binary'
+send_seconds = batch.histogram(Histogram(
+    'chat_send_seconds', 'Time spent in each WebSocket send',
+    ['kind'], buckets=LATENCY_BUCKETS))
+fanout_size = batch.histogram(Histogram(
+    'chat_fanout_size', 'Local members a broadcast was delivered to',
+    buckets=FANOUT_BUCKETS))
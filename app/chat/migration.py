@@ -0,0 +1,154 @@
+# migration.py for Django WebSocket Service
+
+import asyncio
+import logging
+import random
+import time
+import zlib
+
+import msgpack
+from django.conf import settings
+from prometheus_client import Counter, Gauge
+
+from app.chat.history import room_histories
+from app.chat.sessions import get_session_store
+
+logger = logging.getLogger("chat")
+
+migration_draining = Gauge('chat_migration_draining', 'Whether this worker is migrating its clients away (1) or not (0)', multiprocess_mode='livesum')
+migration_reconnects = Counter('chat_migration_reconnects_total', 'Clients asked to reconnect elsewhere')
+migration_closed = Counter('chat_migration_closed_total', 'Clients closed after ignoring a reconnect request')
+
+# 2: room buffers hold [seq, JSON frame] entries
+SNAPSHOT_VERSION = 2
+
+
+def pack(data):
+    return zlib.compress(msgpack.packb(data, use_bin_type=True))
+
+
+def unpack(payload):
+    # A session or a room per call: one unpackb over the whole snapshot
+    # holds the GIL, and with it the event loop, until it is done
+    data = zlib.decompress(payload)
+    unpacker = msgpack.Unpacker(raw=False, max_buffer_size=len(data))
+    unpacker.feed(data)
+    snapshot = {}
+    for _ in range(unpacker.read_map_header()):
+        key = unpacker.unpack()
+        if key == 'sessions':
+            snapshot[key] = [unpacker.unpack() for _ in range(unpacker.read_array_header())]
+        elif key == 'rooms':
+            snapshot[key] = {unpacker.unpack(): unpacker.unpack() for _ in range(unpacker.read_map_header())}
+        else:
+            snapshot[key] = unpacker.unpack()
+    return snapshot
+
+
+async def snapshot(store=None, histories=None):
+    """Session counts and room replay buffers, msgpack'd and deflated.
+
+    Reading the store and packing run off the event loop.
+    """
+    if store is None:
+        store = get_session_store()
+    if histories is None:
+        histories = room_histories
+    data = {
+        'version': SNAPSHOT_VERSION,
+        'created': time.time(),
+        'sessions': await store.aitems(),
+        'rooms': histories.dump(),
+    }
+    return await asyncio.get_event_loop().run_in_executor(None, pack, data)
+
+
+async def restore(payload, store=None, histories=None):
+    """Load a ``snapshot()``; returns ``(sessions, rooms)`` loaded.
+
+    Both halves merge rather than overwrite, so restoring the same
+    snapshot twice, or a newer one later, is safe. Unpacking runs off the
+    event loop, and the merge yields to it between chunks.
+    """
+    if store is None:
+        store = get_session_store()
+    if histories is None:
+        histories = room_histories
+    data = await asyncio.get_event_loop().run_in_executor(None, unpack, payload)
+    if data.get('version') != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported snapshot version %r" % data.get('version'))
+    await store.aload(data['sessions'])
+    rooms = await histories.aload(data['rooms'])
+    logger.info("Restored snapshot", extra={"event": "migration", "extra": {
+        "sessions": len(data['sessions']), "rooms": rooms, "age": round(time.time() - data['created'], 3)}})
+    return len(data['sessions']), rooms
+
+
+class Migration:
+    """Moves this worker's clients to the other color, a few at a time.
+
+    Each client gets a ``{"reconnect": {"after": seconds}}`` frame with a
+    delay drawn uniformly from ``[0, window)``, so reconnects to the new
+    color arrive spread out instead of all at once. Clients that haven't
+    left ``grace`` seconds after their turn are closed with 1012 (service
+    restart). Clients connecting while a migration runs are scheduled the
+    same way.
+    """
+
+    def __init__(self, window=30.0, grace=10.0):
+        self.window = window
+        self.grace = grace
+        self.consumers = {}
+        self.draining = False
+        self.deadline = None
+
+    def watch(self, consumers):
+        """Live connections to migrate: ``{channel_name: consumer}``."""
+        self.consumers = consumers
+
+    def start(self, window=None, grace=None):
+        """Schedule every connected client; returns how many were scheduled."""
+        if window is not None:
+            self.window = window
+        if grace is not None:
+            self.grace = grace
+        self.draining = True
+        self.deadline = asyncio.get_event_loop().time() + self.window
+        migration_draining.set(1)
+        consumers = list(self.consumers.values())
+        for consumer in consumers:
+            self.schedule(consumer)
+        logger.info("Migrating clients", extra={"event": "migration", "extra": {
+            "clients": len(consumers), "window": self.window, "grace": self.grace}})
+        return len(consumers)
+
+    def schedule(self, consumer):
+        loop = asyncio.get_event_loop()
+        # Late joiners spread over what is left of the window
+        delay = random.uniform(0, max(0.0, self.deadline - loop.time()))
+        consumer.outbound.put(consumer.codec.encode({"reconnect": {"after": round(delay, 3)}}))
+        migration_reconnects.inc()
+        loop.call_later(delay + self.grace, self.expire, consumer)
+
+    def expire(self, consumer):
+        if self.consumers.get(consumer.channel_name) is consumer:
+            migration_closed.inc()
+            asyncio.ensure_future(self.close(consumer))
+
+    async def close(self, consumer):
+        await consumer.outbound.flush()
+        await consumer.close(code=1012)
+
+    def stop(self):
+        """Leave migration mode; clients already scheduled keep their turn."""
+        self.draining = False
+        self.deadline = None
+        migration_draining.set(0)
+
+
+def migration_from_settings():
+    config = getattr(settings, 'CHAT_MIGRATION', {})
+    return Migration(window=config.get('WINDOW', 30.0), grace=config.get('GRACE', 10.0))
+
+
+migration = migration_from_settings()
@@ -0,0 +1,166 @@
+# multiprocess.py for Django WebSocket Service
+
+import atexit
+import fcntl
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from prometheus_client import (
+    REGISTRY, CollectorRegistry, GCCollector, PlatformCollector, generate_latest, multiprocess,
+)
+from prometheus_client.mmap_dict import MmapedDict
+
+from app.chat.metrics import batch as metric_batch
+
+logger = logging.getLogger("chat")
+
+# Sample files whose values keep counting after their worker is gone
+ARCHIVED_KINDS = ('counter', 'histogram', 'summary')
+
+
+def multiproc_dir():
+    """Shared metrics directory, or None when running single-process.
+
+    prometheus_client picks mmap-backed values when this is set at import
+    time, so it has to come from the environment, not from settings.
+    """
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+
+def parse(filename):
+    """``counter_123.db`` -> ``('counter', 123)``; None for anything else."""
+    if not filename.endswith('.db'):
+        return None
+    kind, _, pid = filename[:-3].rpartition('_')
+    if not kind or not pid.isdigit():
+        return None
+    return kind, int(pid)
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def locked(path, exclusive):
+    """flock on the metrics directory: reaping is exclusive, scrapes share."""
+    with open(os.path.join(path, '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def archive(source, target):
+    """Add every value in ``source`` into ``target``."""
+    archived = MmapedDict(target)
+    try:
+        for key, value, timestamp, _ in MmapedDict.read_all_values_from_file(source):
+            total, _ = archived.read_value(key)
+            archived.write_value(key, total + value, timestamp)
+    finally:
+        archived.close()
+
+
+def reap_dead_workers(path):
+    """Fold dead workers' files into per-kind archives and drop their gauges.
+
+    Counters and histograms of a dead worker still count towards the totals,
+    so they are summed into ``<kind>_archive.db`` rather than deleted. That
+    keeps the number of files a scrape reads bounded by the live workers,
+    however often they restart. Live gauges of a dead worker are deleted.
+    """
+    reaped = 0
+    with locked(path, exclusive=True):
+        for filename in os.listdir(path):
+            parsed = parse(filename)
+            if parsed is None:
+                continue
+            kind, pid = parsed
+            if pid == os.getpid() or alive(pid):
+                continue
+            source = os.path.join(path, filename)
+            if kind in ARCHIVED_KINDS:
+                archive(source, os.path.join(path, '%s_archive.db' % kind))
+            elif not kind.startswith('gauge_live'):
+                continue
+            os.remove(source)
+            reaped += 1
+    if reaped:
+        logger.info("Reaped metrics of dead workers", extra={"event": "metrics", "extra": {"files": reaped}})
+    return reaped
+
+
+class Exporter:
+    """Renders ``/metrics`` for this worker or, in multi-process mode, all of them.
+
+    Multi-process scrapes read every worker's files, so the rendered page is
+    cached for ``cache_ttl`` seconds and dead workers are reaped at most
+    every ``reap_interval`` seconds.
+    """
+
+    def __init__(self, path=None, cache_ttl=1.0, reap_interval=30.0, clock=time.monotonic):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self.reap_interval = reap_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.page = None
+        self.rendered = 0.0
+        self.reaped = None
+        if path:
+            self.registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(self.registry, path=path)
+            # Runtime stats of the worker that served the scrape
+            GCCollector(registry=self.registry)
+            PlatformCollector(registry=self.registry)
+        else:
+            self.registry = REGISTRY
+
+    def render(self):
+        with self.lock:
+            now = self.clock()
+            if self.page is not None and now - self.rendered < self.cache_ttl:
+                return self.page
+            if not self.path:
+                # The registry's own collector flushes the batch
+                self.page = generate_latest(self.registry)
+            else:
+                metric_batch.sync()
+                if self.reaped is None or now - self.reaped >= self.reap_interval:
+                    self.reaped = now
+                    reap_dead_workers(self.path)
+                with locked(self.path, exclusive=False):
+                    self.page = generate_latest(self.registry)
+            self.rendered = now
+            return self.page
+
+
+def worker_exit(path):
+    # Our live gauges stop counting the moment we exit; counters stay until
+    # another worker archives them.
+    metric_batch.flush()
+    multiprocess.mark_process_dead(os.getpid(), path)
+
+
+def exporter_from_settings():
+    path = multiproc_dir()
+    config = getattr(settings, 'CHAT_METRICS', {})
+    if path:
+        atexit.register(worker_exit, path)
+        return Exporter(path, cache_ttl=config.get('SCRAPE_CACHE', 1.0), reap_interval=config.get('REAP_INTERVAL', 30.0))
+    return Exporter(cache_ttl=0)
+
+
+exporter = exporter_from_settings()
@@ -0,0 +1,139 @@
+# outbound.py for Django WebSocket Service
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from django.conf import settings
+from prometheus_client import Counter, Gauge
+
+from app.chat import codecs
+from app.chat.metrics import batch as metric_batch, send_seconds
+
+logger = logging.getLogger("chat")
+
+# Touched once or twice per frame sent, so batched
+outbound_depth = metric_batch.gauge(Gauge('outbound_queue_depth', 'Frames waiting in per-connection outbound queues', multiprocess_mode='livesum'))
+outbound_dropped = metric_batch.counter(Counter('outbound_frames_dropped_total', 'Outbound frames dropped because a client fell behind', ['policy']))
+outbound_coalesced = metric_batch.counter(Counter('outbound_frames_coalesced_total', 'Chat frames merged into batch frames'))
+slow_consumer_closes = Counter('slow_consumer_closes_total', 'Connections closed with 1008 for falling behind')
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEW = 'drop_new'
+CLOSE = 'close'
+
+
+class OutboundQueue:
+    """Bounded per-connection send queue drained by a writer task.
+
+    Handlers enqueue and return immediately, so a slow client only ever backs
+    up its own queue. The writer task only exists while there is something to
+    send. When several chat frames are waiting, up to ``coalesce`` of them go
+    out as a single ``{"batch": [...]}`` frame built by the connection's codec.
+    Frames are ``str`` (text) or ``bytes`` (binary). ``max_bytes`` never
+    pushes out a frame that is queued on its own, so a frame near the cap
+    isn't lost to the small one behind it. There is one of these per
+    connection, so it is slotted.
+    """
+
+    __slots__ = ('consumer', 'max_frames', 'max_bytes', 'policy', 'coalesce', 'codec', 'frames', 'bytes', 'writer', 'closed')
+
+    def __init__(self, consumer, max_frames=1000, max_bytes=4 << 20, policy=DROP_OLDEST, coalesce=16):
+        if policy not in (DROP_OLDEST, DROP_NEW, CLOSE):
+            raise ValueError("Unknown slow consumer policy: %s" % policy)
+        self.consumer = consumer
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.coalesce = coalesce
+        self.codec = codecs.JSON
+        # (coalescable, frame). Kept between bursts: allocating one per burst
+        # costs broadcasts more than an idle deque costs memory.
+        self.frames = deque()
+        self.bytes = 0
+        self.writer = None
+        self.closed = False
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, frame, coalesce=False):
+        if self.closed:
+            return
+        while self.frames and (len(self.frames) >= self.max_frames or self.over_bytes(len(frame))):
+            if self.policy == DROP_NEW:
+                outbound_dropped.labels(self.policy).inc()
+                return
+            if self.policy == CLOSE:
+                self.close()
+                slow_consumer_closes.inc()
+                asyncio.ensure_future(self.consumer.close(code=1008))
+                return
+            _, dropped = self.frames.popleft()
+            self.bytes -= len(dropped)
+            outbound_depth.dec()
+            outbound_dropped.labels(self.policy).inc()
+        self.frames.append((coalesce, frame))
+        self.bytes += len(frame)
+        outbound_depth.inc()
+        if self.writer is None:
+            self.writer = asyncio.ensure_future(self.drain())
+
+    def over_bytes(self, size):
+        # A frame queued on its own stays, however large
+        return len(self.frames) > 1 and self.bytes + size > self.max_bytes
+
+    async def drain(self):
+        frames = self.frames
+        try:
+            while frames:
+                coalesce, frame = frames.popleft()
+                taken = 1
+                if coalesce and self.coalesce > 1 and frames and frames[0][0]:
+                    batch = [frame]
+                    while frames and frames[0][0] and len(batch) < self.coalesce:
+                        batch.append(frames.popleft()[1])
+                    taken = len(batch)
+                    self.bytes -= sum(len(f) for f in batch)
+                    frame = self.codec.join(batch)
+                    outbound_coalesced.inc(taken)
+                else:
+                    self.bytes -= len(frame)
+                outbound_depth.dec(taken)
+                start = time.perf_counter()
+                if isinstance(frame, bytes):
+                    await self.consumer.send(bytes_data=frame)
+                    send_seconds.labels('binary').observe(time.perf_counter() - start)
+                else:
+                    await self.consumer.send(text_data=frame)
+                    send_seconds.labels('text').observe(time.perf_counter() - start)
+        except Exception as e:
+            logger.error("Error sending frame", extra={"event": "error", "extra": {"error": str(e)}})
+            self.close()
+        finally:
+            self.writer = None
+
+    async def flush(self):
+        """Wait until everything queued so far has been handed to the socket."""
+        while self.writer is not None:
+            # wait() rather than await, so cancelling us leaves the writer alone
+            await asyncio.wait([self.writer])
+
+    def close(self):
+        self.closed = True
+        if self.frames:
+            outbound_depth.dec(len(self.frames))
+            self.frames.clear()
+            self.bytes = 0
+
+
+def outbound_queue(consumer):
+    config = getattr(settings, 'CHAT_OUTBOUND_QUEUE', {})
+    return OutboundQueue(
+        consumer,
+        max_frames=config.get('MAX_FRAMES', 1000),
+        max_bytes=config.get('MAX_BYTES', 4 << 20),
+        policy=config.get('POLICY', DROP_OLDEST),
+        coalesce=config.get('COALESCE', 16),
+    )
@@ -0,0 +1,131 @@
+# profiling.py for Django WebSocket Service
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger("chat")
+
+# One capture per worker at a time
+_busy = threading.Lock()
+
+
+class Busy(Exception):
+    """Another capture is already running in this worker."""
+
+
+def frame_label(code):
+    # The function's first line, not the current one, so samples taken
+    # anywhere in a function land on the same frame of the flamegraph
+    path = code.co_filename
+    for prefix in sorted({p for p in sys.path if p} | {os.getcwd()}, key=len, reverse=True):
+        if path.startswith(prefix + os.sep):
+            path = path[len(prefix) + 1:]
+            break
+    return '%s (%s:%d)' % (code.co_name, path, code.co_firstlineno)
+
+
+def collapse(frame, labels):
+    """One stack as ``root;...;leaf`` in collapsed-stack format."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        label = labels.get(code)
+        if label is None:
+            label = labels[code] = frame_label(code)
+        stack.append(label)
+        frame = frame.f_back
+    stack.reverse()
+    return ';'.join(stack)
+
+
+def sample_stacks(thread_ids, seconds, interval):
+    """Sample the stacks of ``thread_ids`` (None for all others) for ``seconds``.
+
+    Runs on its own thread; the sampled threads are never stopped, so the
+    cost to them is only the GIL switches. A busy thread hands over the GIL
+    every ``sys.getswitchinterval()`` (5ms), which caps the real rate.
+    """
+    me = threading.get_ident()
+    counts = Counter()
+    labels = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me or (thread_ids is not None and thread_id not in thread_ids):
+                continue
+            counts[collapse(frame, labels)] += 1
+        time.sleep(interval)
+    return counts
+
+
+def _capture(kind):
+    if not _busy.acquire(blocking=False):
+        raise Busy("A %s profile can't start while another capture is running" % kind)
+
+
+async def cpu_profile(seconds, interval=0.005, all_threads=False):
+    """Sampled CPU profile of this worker as collapsed stacks, one per line.
+
+    ``stack count`` lines, hottest first, ready for flamegraph.pl or
+    speedscope. Only the event loop's thread is sampled unless
+    ``all_threads``; stacks ending in the selector's ``select`` are the loop
+    waiting for I/O, i.e. idle.
+    """
+    _capture('cpu')
+    try:
+        loop = asyncio.get_event_loop()
+        thread_ids = None if all_threads else {threading.get_ident()}
+        start = time.monotonic()
+        counts = await loop.run_in_executor(None, sample_stacks, thread_ids, seconds, interval)
+    finally:
+        _busy.release()
+    logger.info("Captured CPU profile", extra={"event": "profile", "extra": {
+        "seconds": round(time.monotonic() - start, 3), "samples": sum(counts.values()), "stacks": len(counts)}})
+    return ''.join('%s %d\n' % (stack, count) for stack, count in counts.most_common())
+
+
+def _snapshot():
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')]
+    return tracemalloc.take_snapshot().filter_traces(ignore)
+
+
+def _report(before, after, traced, peak, limit, seconds):
+    stats = after.compare_to(before, 'traceback')[:limit]
+    lines = ['# %d KiB traced, %d KiB peak, top %d sites by growth over %ss' % (traced >> 10, peak >> 10, len(stats), seconds)]
+    for stat in stats:
+        lines.append('%+d KiB (%d KiB now), %+d blocks (%d now)' % (
+            stat.size_diff >> 10, stat.size >> 10, stat.count_diff, stat.count))
+        lines.extend('  ' + line for line in stat.traceback.format(most_recent_first=True))
+    return '\n'.join(lines) + '\n'
+
+
+async def memory_profile(seconds, limit=30, frames=10):
+    """Top allocation sites by growth over ``seconds``, from two tracemalloc snapshots.
+
+    tracemalloc is started for the capture if it isn't tracing already,
+    and stopped again afterwards. Tracing slows allocations down while it
+    runs, so keep captures short. Snapshots and their comparison walk every
+    traced block, so they run in a thread, not on the event loop.
+    """
+    _capture('memory')
+    loop = asyncio.get_event_loop()
+    started = not tracemalloc.is_tracing()
+    try:
+        if started:
+            tracemalloc.start(frames)
+        before = await loop.run_in_executor(None, _snapshot)
+        await asyncio.sleep(seconds)
+        after = await loop.run_in_executor(None, _snapshot)
+        traced, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+        _busy.release()
+    return await loop.run_in_executor(None, _report, before, after, traced, peak, limit, seconds)
+
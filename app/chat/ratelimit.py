@@ -0,0 +1,116 @@
+# ratelimit.py for Django WebSocket Service
+
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from prometheus_client import Counter, Gauge
+
+rate_limited = Counter('ratelimit_limited_total', 'Messages over the rate limit', ['scope', 'policy'])
+admission_rejected = Counter('admission_rejected_total', 'Connections rejected with 1013 because the worker was full')
+session_buckets = Gauge('ratelimit_session_buckets', 'Per-session token buckets held by this worker', multiprocess_mode='livesum')
+
+THROTTLE = 'throttle'
+REJECT = 'reject'
+CLOSE = 'close'
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait(self, now):
+        """Seconds until a token is available; 0 if one is available now."""
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.tokens = tokens
+        self.updated = now
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per connection and per session id, O(1) per check.
+
+    Session buckets outlive connections (so reconnecting doesn't reset the
+    budget) but are held in a bounded LRU.
+    """
+
+    def __init__(self, rate=20, burst=40, session_rate=40, session_burst=80, max_sessions=100000,
+                 policy=THROTTLE, max_connections=20000, retry_after=5, clock=time.monotonic):
+        if policy not in (THROTTLE, REJECT, CLOSE):
+            raise ValueError("Unknown rate limit policy: %s" % policy)
+        self.rate = rate
+        self.burst = burst
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.max_sessions = max_sessions
+        self.policy = policy
+        self.max_connections = max_connections
+        self.retry_after = retry_after
+        self.clock = clock
+        # {session_id: TokenBucket}
+        self.sessions = OrderedDict()
+
+    def connection_bucket(self):
+        return TokenBucket(self.rate, self.burst, self.clock())
+
+    def session_bucket(self, session_id, now):
+        bucket = self.sessions.get(session_id)
+        if bucket is None:
+            bucket = self.sessions[session_id] = TokenBucket(self.session_rate, self.session_burst, now)
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            session_buckets.set(len(self.sessions))
+        else:
+            self.sessions.move_to_end(session_id)
+        return bucket
+
+    def check(self, bucket, session_id):
+        """Take a token from both buckets if both have one.
+
+        Returns ``(wait, scope)``: wait is 0 when the message may go through,
+        otherwise the seconds until it could, and scope names the bucket
+        that ran dry.
+        """
+        now = self.clock()
+        session = self.session_bucket(session_id, now)
+        wait = bucket.wait(now)
+        scope = 'connection'
+        session_wait = session.wait(now)
+        if session_wait > wait:
+            wait, scope = session_wait, 'session'
+        if wait:
+            rate_limited.labels(scope, self.policy).inc()
+            return wait, scope
+        bucket.tokens -= 1
+        session.tokens -= 1
+        return 0.0, None
+
+    def admit(self, connections):
+        if connections < self.max_connections:
+            return True
+        admission_rejected.inc()
+        return False
+
+
+def rate_limiter_from_settings():
+    config = getattr(settings, 'CHAT_RATE_LIMIT', {})
+    return RateLimiter(
+        rate=config.get('RATE', 20),
+        burst=config.get('BURST', 40),
+        session_rate=config.get('SESSION_RATE', 40),
+        session_burst=config.get('SESSION_BURST', 80),
+        max_sessions=config.get('MAX_SESSIONS', 100000),
+        policy=config.get('POLICY', THROTTLE),
+        max_connections=config.get('MAX_CONNECTIONS', 20000),
+        retry_after=config.get('RETRY_AFTER', 5),
+    )
+
+
+rate_limiter = rate_limiter_from_settings()
@@ -0,0 +1,62 @@
+# relay.py for Django WebSocket Service
+
+import struct
+
+from django.conf import settings
+from prometheus_client import Counter
+
+from app.chat.metrics import batch as metric_batch
+
+relay_frames = metric_batch.counter(Counter('chat_relay_frames_total', 'Binary relay frames broadcast'))
+relay_bytes = metric_batch.counter(Counter('chat_relay_bytes_total', 'Bytes of binary relay frames broadcast, headers included'))
+relay_rejected = Counter('chat_relay_rejected_total', 'Binary relay frames refused', ['reason'])
+
+# First byte of every relay frame. MessagePack never uses 0xC1, and it can't
+# start JSON text or a zlib stream either, so no codec frame looks like one.
+MAGIC = 0xC1
+# magic, type, room length; the room name follows, then the payload
+HEADER = struct.Struct('!BBB')
+MAX_ROOM = 90
+
+_config = getattr(settings, 'CHAT_RELAY', {})
+ENABLED = _config.get('ENABLED', True)
+MAX_SIZE = _config.get('MAX_SIZE', 1 << 20)
+
+
+class RelayError(ValueError):
+    """A relay frame with a bad header. ``reason`` is the error sent back."""
+
+    def __init__(self, reason, detail):
+        super().__init__(detail)
+        self.reason = reason
+
+
+def pack(kind, room, payload):
+    """Build a relay frame; ``room`` may be empty for the sender's own room."""
+    room = room.encode('ascii')
+    if len(room) > MAX_ROOM:
+        raise ValueError("Room name longer than %d bytes" % MAX_ROOM)
+    return HEADER.pack(MAGIC, kind, len(room)) + room + payload
+
+
+def is_relay(bytes_data):
+    return bytes_data is not None and bytes_data[:1] == b'\xc1'
+
+
+def parse(frame, max_size=MAX_SIZE):
+    """``(type, room)`` from a relay frame's header.
+
+    Only the header is read: the payload is never sliced, decoded or copied.
+    """
+    if len(frame) > max_size:
+        raise RelayError('frame_too_large', "Relay frame of %d bytes is over %d" % (len(frame), max_size))
+    if len(frame) < HEADER.size:
+        raise RelayError('bad_relay_frame', "Relay frame shorter than its header")
+    _, kind, room_length = HEADER.unpack_from(frame)
+    if room_length > MAX_ROOM or len(frame) < HEADER.size + room_length:
+        raise RelayError('bad_relay_frame', "Relay frame room length %d out of range" % room_length)
+    try:
+        room = frame[HEADER.size:HEADER.size + room_length].decode('ascii')
+    except UnicodeDecodeError:
+        raise RelayError('bad_relay_frame', "Relay frame room is not ASCII")
+    return kind, room
@@ -0,0 +1,338 @@
+# sessions.py for Django WebSocket Service
+
+import asyncio
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from prometheus_client import Counter, Gauge
+
+from app.chat.metrics import batch as metric_batch
+
+logger = logging.getLogger("chat")
+
+# Lookups and the size move with every connect or message, so they are
+# batched on the event loop
+session_hits = metric_batch.counter(Counter('session_store_hits_total', 'Session store lookups that found a session', ['backend']))
+session_misses = metric_batch.counter(Counter('session_store_misses_total', 'Session store lookups that found nothing', ['backend']))
+session_evictions = Counter('session_store_evictions_total', 'Sessions evicted by capacity or TTL', ['backend', 'reason'])
+session_size = Gauge('session_store_size', 'Number of sessions held by the session store', ['backend'], multiprocess_mode='livesum')
+batched_session_size = metric_batch.gauge(session_size)
+
+
+class BaseSessionStore(ABC):
+    """Maps session ids to the message count of that session."""
+
+    name = 'base'
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.hits = session_hits.labels(self.name)
+        self.misses = session_misses.labels(self.name)
+        self.size = batched_session_size.labels(self.name)
+
+    @abstractmethod
+    def get(self, session_id, default=0):
+        pass
+
+    async def aget(self, session_id, default=0):
+        """``get`` for the event loop; stores that do I/O to read override it."""
+        return self.get(session_id, default)
+
+    @abstractmethod
+    def set(self, session_id, count):
+        pass
+
+    @abstractmethod
+    def items(self):
+        """``(session_id, count)`` for every live session, for snapshots."""
+
+    async def aitems(self):
+        """``items`` for the event loop."""
+        return self.items()
+
+    def load(self, items):
+        """Merge ``(session_id, count)`` pairs, keeping the higher count."""
+        for session_id, count in items:
+            if count > self.get(session_id, 0):
+                self.set(session_id, count)
+
+    async def aload(self, items, chunk=1000):
+        """``load`` for the event loop, ``chunk`` pairs at a time."""
+        for start in range(0, len(items), chunk):
+            self.load(items[start:start + chunk])
+            # Let connections run between chunks
+            await asyncio.sleep(0)
+
+    def ping(self):
+        """Raise if the store can't serve requests; used by health checks."""
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(BaseSessionStore):
+    """Bounded in-process LRU with a sliding TTL.
+
+    Every read or write pushes the entry to the back and resets its expiry to
+    ``now + ttl``, so the dict stays sorted by expiry and expired sessions can
+    always be popped from the front in O(1).
+    """
+
+    name = 'memory'
+
+    def __init__(self, capacity=100000, ttl=3600, clock=time.monotonic):
+        super().__init__(ttl=ttl)
+        self.capacity = capacity
+        self.clock = clock
+        # {session_id: (count, expires_at)}
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, session_id, default=0):
+        now = self.clock()
+        self.expire(now)
+        entry = self.entries.get(session_id)
+        if entry is None:
+            self.misses.inc()
+            return default
+        self.hits.inc()
+        self.entries[session_id] = (entry[0], now + self.ttl)
+        self.entries.move_to_end(session_id)
+        return entry[0]
+
+    def set(self, session_id, count):
+        now = self.clock()
+        self.expire(now)
+        self.entries[session_id] = (count, now + self.ttl)
+        self.entries.move_to_end(session_id)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            session_evictions.labels(self.name, 'capacity').inc()
+        self.size.set(len(self.entries))
+
+    def items(self):
+        self.expire(self.clock())
+        return [(session_id, count) for session_id, (count, _) in self.entries.items()]
+
+    def expire(self, now):
+        entries = self.entries
+        expired = 0
+        while entries:
+            session_id, (_, expires_at) = next(iter(entries.items()))
+            if expires_at > now:
+                break
+            del entries[session_id]
+            expired += 1
+        if expired:
+            session_evictions.labels(self.name, 'ttl').inc(expired)
+            self.size.set(len(entries))
+
+
+class SQLiteSessionStore(BaseSessionStore):
+    """Durable session store backed by SQLite in WAL mode.
+
+    Writes are buffered and flushed in batches by a background thread, so a
+    burst of messages on one session costs a single row update. Reads check
+    the unflushed buffers before going to the database; ``aget``, used from
+    the event loop, goes to the database on a read thread of its own.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path='sessions.sqlite3', ttl=3600, flush_interval=1.0, batch_size=1000, purge_interval=60.0):
+        super().__init__(ttl=ttl)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.purge_interval = purge_interval
+        self.last_purge = 0.0
+        # Set from the flush thread, which the batch can't be touched from
+        self.size = session_size.labels(self.name)
+        self.pending = {}
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+
+        # WAL lets the loop thread read while the flusher thread writes, each
+        # on its own connection.
+        self.writer = self._connect()
+        self.writer.execute('PRAGMA journal_mode=WAL')
+        self.writer.execute(
+            'CREATE TABLE IF NOT EXISTS sessions '
+            '(id TEXT PRIMARY KEY, count INTEGER NOT NULL, updated REAL NOT NULL)'
+        )
+        self.writer.execute('CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)')
+        self.writer.commit()
+        self.reader = self._connect()
+        # Reads from the event loop go through one thread with its own
+        # connection, so a slow disk never stalls the loop
+        self.read_conn = None
+        self.read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-store-read')
+
+        self.thread = threading.Thread(target=self._run, name='session-store-flush', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def unflushed(self, session_id):
+        with self.lock:
+            count = self.pending.get(session_id)
+            if count is None:
+                count = self.flushing.get(session_id)
+        return count
+
+    def select(self, conn, session_id):
+        row = conn.execute(
+            'SELECT count FROM sessions WHERE id = ? AND updated > ?',
+            (session_id, time.time() - self.ttl)
+        ).fetchone()
+        return row[0] if row else None
+
+    def select_in_thread(self, session_id):
+        if self.read_conn is None:
+            self.read_conn = self._connect()
+        return self.select(self.read_conn, session_id)
+
+    def counted(self, count, default):
+        if count is None:
+            self.misses.inc()
+            return default
+        self.hits.inc()
+        return count
+
+    def get(self, session_id, default=0):
+        count = self.unflushed(session_id)
+        if count is None:
+            count = self.select(self.reader, session_id)
+        return self.counted(count, default)
+
+    async def aget(self, session_id, default=0):
+        count = self.unflushed(session_id)
+        if count is None:
+            loop = asyncio.get_event_loop()
+            count = await loop.run_in_executor(self.read_executor, self.select_in_thread, session_id)
+        return self.counted(count, default)
+
+    def select_all(self, conn):
+        with self.lock:
+            unflushed = dict(self.flushing)
+            unflushed.update(self.pending)
+        rows = dict(conn.execute(
+            'SELECT id, count FROM sessions WHERE updated > ?', (time.time() - self.ttl,)
+        ))
+        rows.update(unflushed)
+        return list(rows.items())
+
+    def select_all_in_thread(self):
+        if self.read_conn is None:
+            self.read_conn = self._connect()
+        return self.select_all(self.read_conn)
+
+    def items(self):
+        return self.select_all(self.reader)
+
+    async def aitems(self):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.read_executor, self.select_all_in_thread)
+
+    async def aload(self, items, chunk=1000):
+        # One full read off the loop, rather than a SELECT per session on it
+        current = dict(await self.aitems())
+        for start in range(0, len(items), chunk):
+            for session_id, count in items[start:start + chunk]:
+                if count > current.get(session_id, 0):
+                    self.set(session_id, count)
+            await asyncio.sleep(0)
+
+    def ping(self):
+        if not self.thread.is_alive():
+            raise RuntimeError("Session flush thread has stopped")
+        self.reader.execute('SELECT 1').fetchone()
+
+    def set(self, session_id, count):
+        with self.lock:
+            self.pending[session_id] = count
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                batch = None
+            else:
+                batch, self.pending = self.pending, {}
+                self.flushing = batch
+        now = time.time()
+        purge = now - self.last_purge >= self.purge_interval
+        if not batch and not purge:
+            return
+        expired = 0
+        try:
+            if batch:
+                self.writer.executemany(
+                    'INSERT INTO sessions (id, count, updated) VALUES (?, ?, ?) '
+                    'ON CONFLICT(id) DO UPDATE SET count = excluded.count, updated = excluded.updated',
+                    [(session_id, count, now) for session_id, count in batch.items()]
+                )
+            if purge:
+                expired = self.writer.execute('DELETE FROM sessions WHERE updated <= ?', (now - self.ttl,)).rowcount
+            self.writer.commit()
+        finally:
+            with self.lock:
+                self.flushing = {}
+        if purge:
+            self.last_purge = now
+            if expired:
+                session_evictions.labels(self.name, 'ttl').inc(expired)
+            self.size.set(self.writer.execute('SELECT COUNT(*) FROM sessions').fetchone()[0])
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Error flushing session store", extra={"event": "error", "extra": {"error": str(e)}})
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        self.read_executor.shutdown()
+        if self.read_conn is not None:
+            self.read_conn.close()
+        self.reader.close()
+        self.writer.close()
+
+
+_session_store = None
+
+
+def get_session_store():
+    """Return the process-wide session store configured in CHAT_SESSION_STORE."""
+    global _session_store
+    if _session_store is None:
+        config = getattr(settings, 'CHAT_SESSION_STORE', {})
+        backend = import_string(config.get('BACKEND', 'app.chat.sessions.MemorySessionStore'))
+        _session_store = backend(**config.get('OPTIONS', {}))
+    return _session_store
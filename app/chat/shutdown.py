@@ -0,0 +1,96 @@
+# shutdown.py for Django WebSocket Service
+
+import asyncio
+import logging
+import os
+import signal
+import time
+
+from django.conf import settings
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger("chat")
+
+drain_duration = Histogram(
+    'shutdown_drain_seconds', 'Time taken to drain and close WebSocket connections on shutdown',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+)
+# A counter: a live gauge's series goes away with the exiting process, so
+# it would never be scraped
+connections_left = Counter('shutdown_connections_left_total', 'WebSocket connections still open when the shutdown deadline passed')
+
+
+async def drain_connections(consumers, deadline=None, parallelism=None):
+    """Flush and close ``consumers`` with code 1001, concurrently.
+
+    At most ``parallelism`` connections are being drained at once, and
+    whatever is still open after ``deadline`` seconds is abandoned. Returns
+    the number of connections left open.
+    """
+    config = getattr(settings, 'CHAT_SHUTDOWN', {})
+    if deadline is None:
+        deadline = config.get('DEADLINE', 10)
+    if parallelism is None:
+        parallelism = config.get('PARALLELISM', 500)
+
+    start = time.monotonic()
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async def drain(consumer):
+        async with semaphore:
+            await consumer.outbound.flush()
+            await consumer.close(code=1001)
+
+    tasks = [asyncio.ensure_future(drain(consumer)) for consumer in list(consumers)]
+    pending = ()
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+
+    elapsed = time.monotonic() - start
+    drain_duration.observe(elapsed)
+    connections_left.inc(len(pending))
+    log = logger.warning if pending else logger.info
+    log("Drained WebSocket connections", extra={"event": "shutdown", "extra": {
+        "closed": len(tasks) - len(pending), "left": len(pending), "seconds": round(elapsed, 3)}})
+    return len(pending)
+
+
+def drain_on_signals(loop, consumers, on_signal=None, signals=(signal.SIGTERM, signal.SIGINT)):
+    """Drain ``consumers`` on ``signals``, then run the handler this replaced.
+
+    Install it after the server has installed its own handlers (uvicorn does
+    so before lifespan startup). The server's handler runs once the drain is
+    done, so it still shuts down its own way; a second signal skips ahead to
+    it. Without one, the signal's default action ends the process. Returns
+    False where the loop can't handle signals (not the main thread, Windows).
+    """
+    draining = []
+
+    def hand_off(sig, previous):
+        if previous is not None and not previous.cancelled():
+            previous._run()
+        else:
+            loop.remove_signal_handler(sig)
+            os.kill(os.getpid(), sig)
+
+    def handle(sig, previous):
+        if draining:
+            hand_off(sig, previous)
+            return
+        logger.info("Received shutdown signal, draining WebSocket connections",
+                    extra={"event": "shutdown", "extra": {"signal": signal.Signals(sig).name}})
+        if on_signal is not None:
+            on_signal()
+        draining.append(loop.create_task(drain_connections(consumers)))
+        draining[0].add_done_callback(lambda _: hand_off(sig, previous))
+
+    try:
+        for sig in signals:
+            # asyncio keeps no public way to read a handler back
+            previous = getattr(loop, '_signal_handlers', {}).get(sig)
+            loop.add_signal_handler(sig, handle, sig, previous)
+    except (NotImplementedError, RuntimeError):
+        return False
+    return True
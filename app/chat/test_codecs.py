@@ -0,0 +1,71 @@
+import pytest
+from app.chat import codecs
+
+msgpack = pytest.importorskip("msgpack")
+
+
+def test_negotiate_prefers_first_supported_offer():
+    codec, subprotocol = codecs.negotiate({"subprotocols": ["unknown", "chat.msgpack", "chat.json"]})
+    assert codec.name == "msgpack"
+    assert subprotocol == "chat.msgpack"
+
+
+def test_negotiate_defaults_to_json():
+    codec, subprotocol = codecs.negotiate({"subprotocols": []})
+    assert codec is codecs.JSON
+    assert subprotocol is None
+
+
+def test_encode_for_encodes_once_per_codec():
+    event = {"type": "chat_message", "message": "hi", "count": 2}
+    packer = codecs.CODECS["chat.msgpack"]
+    first = codecs.encode_for(event, packer, ("message", "count"))
+    assert codecs.encode_for(event, packer, ("message", "count")) is first
+    assert msgpack.unpackb(first) == {"message": "hi", "count": 2}
+    assert codecs.JSON.decode(codecs.encode_for(event, codecs.JSON, ("message",))) == {"message": "hi"}
+
+
+def test_msgpack_batch_frame():
+    packer = codecs.CODECS["chat.msgpack"]
+    frames = [packer.encode({"n": i}) for i in range(3)]
+    assert msgpack.unpackb(packer.join(frames)) == {"batch": [{"n": 0}, {"n": 1}, {"n": 2}]}
+
+
+def test_deflate_only_compresses_above_threshold():
+    deflate = codecs.DeflateCodec(codecs.JSON, threshold=100)
+    small = deflate.encode({"message": "hi"})
+    large = deflate.encode({"message": "x" * 500})
+    assert small == '{"message":"hi"}'
+    assert isinstance(large, bytes) and large[:1] == b"\x78" and len(large) < 500
+    assert deflate.decode(bytes_data=large) == {"message": "x" * 500}
+    assert deflate.decode(text_data=small) == {"message": "hi"}
+
+
+def test_deflate_compresses_once_per_broadcast(monkeypatch):
+    deflate = codecs.DeflateCodec(codecs.CODECS["chat.msgpack"], threshold=10)
+    calls = []
+    compress = deflate.compress
+    monkeypatch.setattr(deflate, "compress", lambda frame: calls.append(frame) or compress(frame))
+    event = {"type": "chat_message", "message": "y" * 200, "count": 1}
+    first = codecs.encode_for(event, deflate, ("message", "count"))
+    assert codecs.encode_for(event, deflate, ("message", "count")) is first
+    assert len(calls) == 1
+    # The inner frame is the one cached for plain msgpack recipients
+    assert calls[0] is event["frames"]["msgpack"]
+    assert msgpack.unpackb(deflate.inflate(first)) == {"message": "y" * 200, "count": 1}
+
+
+def test_deflate_batch_and_inflate_limit():
+    deflate = codecs.DeflateCodec(codecs.JSON, threshold=50, max_size=1000)
+    frames = [deflate.encode({"n": i, "pad": "z" * 60}) for i in range(3)]
+    batch = deflate.decode(bytes_data=deflate.join(frames))
+    assert [item["n"] for item in batch["batch"]] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        deflate.decode(bytes_data=deflate.encode({"pad": "z" * 5000}))
+
+
+def test_transcode_matches_encoding_for_each_codec():
+    payload = {"message": "x" * 2000, "count": 1, "seq": 1}
+    frame = codecs.JSON.encode(payload)
+    for codec in codecs.CODECS.values():
+        assert codecs.transcode(frame, codec) == codec.encode(payload)
@@ -50,4 +50,169 @@ async def test_disconnect():
     response = await communicator.receive_from()
     response_data = json.loads(response)
     assert response_data["bye"] is True
-    assert response_data["total"] == 1
\ No newline at end of file
+    assert response_data["total"] == 1
+
+@pytest.mark.asyncio
+async def test_chat_message_forwards_pre_encoded_frame():
+    sent = []
+
+    async def base_send(message):
+        sent.append(message)
+
+    consumer = ChatConsumer()
+    consumer.base_send = base_send
+    await consumer.chat_message({"type": "chat_message", "message": "m", "count": 3, "frames": {"json": "pre-encoded"}})
+    await consumer.outbound.writer
+    await consumer.chat_message({"type": "chat_message", "message": "m", "count": 3, "seq": 7})
+    await consumer.outbound.writer
+
+    assert sent[0]["text"] == "pre-encoded"
+    assert json.loads(sent[1]["text"]) == {"message": "m", "count": 3, "seq": 7}
+
+
+@pytest.mark.asyncio
+async def test_messages_stay_in_their_room():
+    from channels.routing import URLRouter
+    from django.urls import path
+
+    application = URLRouter([
+        path("ws/chat/", ChatConsumer.as_asgi()),
+        path("ws/chat/<str:room>/", ChatConsumer.as_asgi()),
+    ])
+    lobby = WebsocketCommunicator(application, "/ws/chat/lobby/")
+    other = WebsocketCommunicator(application, "/ws/chat/?room=other")
+    await lobby.connect()
+    await other.connect()
+    assert json.loads(await lobby.receive_from())["room"] == "lobby"
+    assert json.loads(await other.receive_from())["room"] == "other"
+
+    await lobby.send_to(text_data=json.dumps({"message": "lobby only"}))
+    assert json.loads(await lobby.receive_from())["message"] == "lobby only"
+    assert await other.receive_nothing()
+
+    await lobby.disconnect()
+    await other.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_invalid_room_is_rejected():
+    communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/?room=no%20spaces")
+    connected, _ = await communicator.connect()
+    assert not connected
+
+
+@pytest.mark.asyncio
+async def test_full_worker_rejects_with_retry_after(monkeypatch):
+    from app.chat.ratelimit import rate_limiter
+    monkeypatch.setattr(rate_limiter, "max_connections", 0)
+
+    communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+    connected, _ = await communicator.connect()
+    assert connected
+    response = json.loads(await communicator.receive_from())
+    assert response["error"] == "overloaded"
+    assert response["retry_after"] == rate_limiter.retry_after
+    close = await communicator.receive_output()
+    assert close == {"type": "websocket.close", "code": 1013}
+
+
+@pytest.mark.asyncio
+async def test_broadcast_records_latency_and_fanout():
+    from prometheus_client import REGISTRY
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    before = {
+        "broadcast": sample("chat_broadcast_seconds_count"),
+        "delivery": sample("chat_delivery_latency_seconds_count", path="local"),
+        "send": sample("chat_send_seconds_count", kind="text"),
+        "fanout": sample("chat_fanout_size_sum"),
+    }
+    communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/?room=latency")
+    await communicator.connect()
+    await communicator.receive_from()
+    await communicator.send_to(text_data=json.dumps({"message": "timed"}))
+    assert json.loads(await communicator.receive_from())["message"] == "timed"
+    await communicator.disconnect()
+
+    assert sample("chat_broadcast_seconds_count") == before["broadcast"] + 1
+    assert sample("chat_delivery_latency_seconds_count", path="local") == before["delivery"] + 1
+    assert sample("chat_send_seconds_count", kind="text") >= before["send"] + 2
+    assert sample("chat_fanout_size_sum") == before["fanout"] + 1
+
+
+@pytest.mark.asyncio
+async def test_reconnect_replays_missed_messages():
+    application = ChatConsumer.as_asgi()
+    first = WebsocketCommunicator(application, "/ws/chat/?room=replay")
+    await first.connect()
+    greeting = json.loads(await first.receive_from())
+    for text in ("one", "two", "three"):
+        await first.send_to(text_data=json.dumps({"message": text}))
+        assert json.loads(await first.receive_from())["message"] == text
+
+    path = "/ws/chat/?room=replay&last_seq=%d&epoch=%s" % (greeting["seq"] + 1, greeting["epoch"])
+    second = WebsocketCommunicator(application, path)
+    await second.connect()
+    assert json.loads(await second.receive_from())["seq"] == greeting["seq"] + 3
+    replay = json.loads(await second.receive_from())
+    assert [item["message"] for item in replay["batch"]] == ["two", "three"]
+
+    stale = WebsocketCommunicator(application, "/ws/chat/?room=replay&last_seq=1&epoch=other")
+    await stale.connect()
+    await stale.receive_from()
+    assert json.loads(await stale.receive_from())["error"] == "gap_too_large"
+
+    for communicator in (first, second, stale):
+        await communicator.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_relay_frames_fan_out_unchanged():
+    from app.chat import relay
+
+    application = ChatConsumer.as_asgi()
+    sender = WebsocketCommunicator(application, "/ws/chat/?room=relay")
+    other = WebsocketCommunicator(application, "/ws/chat/?room=relay")
+    for communicator in (sender, other):
+        await communicator.connect()
+        await communicator.receive_from()
+
+    frame = relay.pack(3, "relay", bytes(range(256)) * 16)
+    await sender.send_to(bytes_data=frame)
+    received = [await sender.receive_output(), await other.receive_output()]
+    # The very object that came in, not a copy per recipient
+    assert all(message["bytes"] is frame for message in received)
+
+    await sender.send_to(bytes_data=relay.pack(3, "lobby", b"elsewhere"))
+    assert json.loads(await sender.receive_from())["error"] == "wrong_room"
+    assert await other.receive_nothing()
+
+    for communicator in (sender, other):
+        await communicator.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_resume_is_refused_when_the_layer_spans_workers(monkeypatch):
+    from app.chat import consumers
+    from app.chat.history import room_histories
+
+    application = ChatConsumer.as_asgi()
+    first = WebsocketCommunicator(application, "/ws/chat/?room=shared")
+    await first.connect()
+    greeting = json.loads(await first.receive_from())
+    await first.send_to(text_data=json.dumps({"message": "one"}))
+    await first.receive_from()
+    # The buffer holds the broadcast's JSON frame, not the event dict
+    assert room_histories.room("chat_shared").entries[-1] == (greeting["seq"] + 1, '{"message":"one","count":1,"seq":%d}' % (greeting["seq"] + 1))
+
+    monkeypatch.setattr(consumers, "spans_processes", lambda layer: True)
+    path = "/ws/chat/?room=shared&last_seq=%d&epoch=%s" % (greeting["seq"], greeting["epoch"])
+    second = WebsocketCommunicator(application, path)
+    await second.connect()
+    await second.receive_from()
+    assert json.loads(await second.receive_from())["error"] == "gap_too_large"
+
+    for communicator in (first, second):
+        await communicator.disconnect()
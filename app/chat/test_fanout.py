@@ -0,0 +1,72 @@
+import pytest
+from channels.layers import InMemoryChannelLayer
+from app.chat.fanout import LocalGroups, WORKER_ID
+
+
+class FakeConsumer:
+    def __init__(self, channel_name):
+        self.channel_name = channel_name
+        self.received = []
+
+    async def chat_message(self, event):
+        self.received.append(event)
+
+
+class RecordingLayer:
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message))
+
+
+@pytest.mark.asyncio
+async def test_local_members_skip_in_memory_layer():
+    groups = LocalGroups()
+    layer = InMemoryChannelLayer()
+    members = [FakeConsumer("c%d" % i) for i in range(3)]
+    for consumer in members:
+        groups.add("room", consumer)
+        await layer.group_add("room", consumer.channel_name)
+
+    await groups.group_send(layer, "room", {"type": "chat_message", "text": "hi"})
+
+    assert all(len(consumer.received) == 1 for consumer in members)
+    # Nothing was queued on the channel layer
+    assert all(not channel.qsize() for channel, _ in layer.channels.values())
+
+
+@pytest.mark.asyncio
+async def test_remote_layer_gets_tagged_copy():
+    groups = LocalGroups()
+    layer = RecordingLayer()
+    consumer = FakeConsumer("local")
+    groups.add("room", consumer)
+
+    await groups.group_send(layer, "room", {"type": "chat_message", "text": "hi"})
+
+    assert len(consumer.received) == 1
+    assert layer.sent[0][1]["origin"] == WORKER_ID
+
+
+def test_discard_drops_empty_groups():
+    groups = LocalGroups()
+    consumer = FakeConsumer("c")
+    groups.add("room", consumer)
+    groups.discard("room", consumer)
+    assert groups.members("room") == {}
+    assert groups.groups == {}
+
+
+def test_room_counts_and_membership():
+    groups = LocalGroups()
+    a, b = FakeConsumer("a"), FakeConsumer("b")
+    groups.add("chat_one", a)
+    groups.add("chat_one", b)
+    groups.add("chat_two", b)
+
+    assert groups.count("chat_one") == 2
+    assert groups.count("chat_two") == 1
+    assert groups.count("chat_none") == 0
+    assert groups.is_member("chat_two", "b")
+    assert not groups.is_member("chat_two", "a")
@@ -0,0 +1,36 @@
+import pytest
+
+from app.chat.health import HealthChecker
+
+
+class FakeConsumer:
+    def __init__(self, queued):
+        self.outbound = [None] * queued
+
+
+@pytest.mark.asyncio
+async def test_ready_below_thresholds():
+    checker = HealthChecker(max_connections=3, max_queue_depth=10, max_loop_lag=0.5)
+    checker.watch({"a": FakeConsumer(2), "b": FakeConsumer(3)})
+    status = await checker.status()
+    assert status["ready"]
+    assert status["checks"] == {"channel_layer": "ok", "session_store": "ok"}
+    assert status["load"]["connections"] == 2
+    assert status["load"]["queue_depth"] == 5
+
+
+@pytest.mark.asyncio
+async def test_saturation_makes_worker_not_ready():
+    checker = HealthChecker(max_connections=2, max_queue_depth=4, max_loop_lag=0.1)
+    checker.watch({"a": FakeConsumer(2), "b": FakeConsumer(3)})
+    status = await checker.check(lag=0.2)
+    assert not status["ready"]
+    assert status["reasons"] == ["connections", "queue_depth", "loop_lag"]
+
+
+@pytest.mark.asyncio
+async def test_probes_read_the_cached_result(monkeypatch):
+    checker = HealthChecker()
+    first = await checker.status()
+    monkeypatch.setattr(checker, "check", None)
+    assert await checker.status() is first
@@ -0,0 +1,70 @@
+import asyncio
+import time
+import pytest
+from app.chat.heartbeat import HeartbeatScheduler
+
+
+class FakeConsumer:
+    def __init__(self, channel_name):
+        self.channel_name = channel_name
+        self.beats = []
+
+    async def heartbeat_message(self, event):
+        self.beats.append(event['ts'])
+
+
+@pytest.mark.asyncio
+async def test_one_heartbeat_per_interval():
+    scheduler = HeartbeatScheduler(interval=0.2, slots=4)
+    consumers = [FakeConsumer("c%d" % i) for i in range(20)]
+    for consumer in consumers:
+        scheduler.register(consumer)
+
+    # Just under two full revolutions
+    await asyncio.sleep(0.38)
+    for consumer in consumers:
+        assert 1 <= len(consumer.beats) <= 2
+
+    for consumer in consumers:
+        scheduler.unregister(consumer)
+
+
+@pytest.mark.asyncio
+async def test_unregister_stops_heartbeats():
+    scheduler = HeartbeatScheduler(interval=0.1, slots=2)
+    consumer = FakeConsumer("gone")
+    scheduler.register(consumer)
+    assert len(scheduler) == 1
+
+    scheduler.unregister(consumer)
+    assert len(scheduler) == 0
+    assert scheduler.task is None
+    assert all(not bucket for bucket in scheduler.buckets)
+
+    await asyncio.sleep(0.25)
+    assert consumer.beats == []
+
+
+class IdleConsumer(FakeConsumer):
+    def __init__(self, channel_name, last_seen):
+        super().__init__(channel_name)
+        self.last_seen = last_seen
+        self.closed = None
+
+    async def close(self, code=None):
+        self.closed = code
+
+
+@pytest.mark.asyncio
+async def test_idle_connections_are_reaped_instead_of_pinged():
+    scheduler = HeartbeatScheduler(interval=10, slots=1, idle_timeout=60)
+    quiet = IdleConsumer("quiet", time.monotonic() - 120)
+    chatty = IdleConsumer("chatty", time.monotonic())
+    scheduler.register(quiet)
+    scheduler.register(chatty)
+
+    await scheduler.beat([quiet, chatty])
+    assert quiet.closed == 1001 and quiet.beats == []
+    assert chatty.closed is None and len(chatty.beats) == 1
+    assert len(scheduler) == 1
+    scheduler.unregister(chatty)
@@ -0,0 +1,53 @@
+import json
+
+from app.chat.history import RoomHistories, RoomHistory, frame_size
+
+
+def fill(history, count):
+    for _ in range(count):
+        history.append(history.seq + 1, json.dumps({'seq': history.seq + 1}))
+
+
+def seqs(frames):
+    return [json.loads(frame)['seq'] for frame in frames]
+
+
+def test_since_returns_the_missing_range():
+    history = RoomHistory(max_messages=10)
+    fill(history, 5)
+    assert seqs(history.since(2)) == [3, 4, 5]
+    assert history.since(5) == []
+
+
+def test_capped_by_count_and_bytes():
+    history = RoomHistory(max_messages=3, max_bytes=1000)
+    fill(history, 5)
+    assert [seq for seq, _ in history.entries] == [3, 4, 5]
+
+    size = frame_size(json.dumps({'seq': 1}))
+    history = RoomHistory(max_messages=100, max_bytes=2 * size)
+    fill(history, 5)
+    assert [seq for seq, _ in history.entries] == [4, 5]
+    # What is held, not just the encoded length
+    assert history.bytes == 2 * size > 2 * len(json.dumps({'seq': 1}))
+
+
+def test_gap_too_large():
+    history = RoomHistory(max_messages=3)
+    fill(history, 5)
+    assert history.since(1) is None
+    assert seqs(history.since(2)) == [3, 4, 5]
+    # Ahead of the buffer: the client saw a different sequence
+    assert history.since(9) is None
+
+
+def test_resume_checks_epoch_and_rooms_are_bounded():
+    histories = RoomHistories(max_rooms=2)
+    room = histories.room('chat_a')
+    fill(room, 2)
+    assert len(histories.resume('chat_a', 0, room.epoch)) == 2
+    assert histories.resume('chat_a', 0, 'stale') is None
+
+    histories.room('chat_b')
+    histories.room('chat_c')
+    assert list(histories.rooms) == ['chat_b', 'chat_c']
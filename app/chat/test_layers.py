@@ -0,0 +1,205 @@
+import asyncio
+
+import pytest
+from channels.exceptions import ChannelFull
+
+from app.chat.broker import HIGH_WATER, Broker, Client, serve
+from app.chat.layers import UnixSocketChannelLayer, client_of, pack_frame
+
+
+@pytest.fixture
+async def broker_path(tmp_path):
+    path = str(tmp_path / "broker.sock")
+    server = await serve(path)
+    yield path
+    # Let the broker see the layers hang up
+    await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+
+
+def test_client_of():
+    assert client_of("specific.abc!xyz") == "abc"
+    assert client_of("plain.channel") is None
+
+
+@pytest.mark.asyncio
+async def test_send_and_receive_across_workers(broker_path):
+    one, two = UnixSocketChannelLayer(path=broker_path), UnixSocketChannelLayer(path=broker_path)
+    channel = await two.new_channel()
+    await two.connection()
+    await one.send(channel, {"type": "test.message", "text": "hi"})
+    assert await asyncio.wait_for(two.receive(channel), 1) == {"type": "test.message", "text": "hi"}
+    await one.close()
+    await two.close()
+
+
+@pytest.mark.asyncio
+async def test_group_send_reaches_every_worker(broker_path):
+    one, two = UnixSocketChannelLayer(path=broker_path), UnixSocketChannelLayer(path=broker_path)
+    local = await one.new_channel()
+    remote = [await two.new_channel() for _ in range(3)]
+    for layer, channel in [(one, local)] + [(two, channel) for channel in remote]:
+        await layer.group_add("room", channel)
+
+    await one.group_send("room", {"type": "chat.message", "n": 1})
+    await one.group_send_remote("room", {"type": "chat.message", "n": 2})
+
+    for channel in remote:
+        assert (await asyncio.wait_for(two.receive(channel), 1))["n"] == 1
+        assert (await asyncio.wait_for(two.receive(channel), 1))["n"] == 2
+    assert (await asyncio.wait_for(one.receive(local), 1))["n"] == 1
+    # group_send_remote left this worker's member out
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(one.receive(local), 0.1)
+    await one.close()
+    await two.close()
+
+
+@pytest.mark.asyncio
+async def test_capacity_is_enforced_for_remote_channels(broker_path):
+    one, two = UnixSocketChannelLayer(path=broker_path), UnixSocketChannelLayer(path=broker_path, capacity=2)
+    channel = await two.new_channel()
+    await two.connection()
+    await one.send(channel, {"type": "test", "n": 1})
+    await one.send(channel, {"type": "test", "n": 2})
+    with pytest.raises(ChannelFull):
+        await one.send(channel, {"type": "test", "n": 3})
+
+    # Receiving frees capacity again
+    assert (await two.receive(channel))["n"] == 1
+    await asyncio.sleep(0.05)
+    await one.send(channel, {"type": "test", "n": 3})
+    await one.close()
+    await two.close()
+
+
+@pytest.mark.asyncio
+async def test_discard_and_flush(broker_path):
+    layer = UnixSocketChannelLayer(path=broker_path)
+    channel = await layer.new_channel()
+    await layer.group_add("room", channel)
+    await layer.group_discard("room", channel)
+    await layer.group_send("room", {"type": "test"})
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(layer.receive(channel), 0.1)
+    await layer.flush()
+    await layer.close()
+
+
+@pytest.mark.asyncio
+async def test_idle_channels_hold_no_queue(broker_path):
+    layer = UnixSocketChannelLayer(path=broker_path)
+    channel = await layer.new_channel()
+    waiting = asyncio.ensure_future(layer.receive(channel))
+    await asyncio.sleep(0.01)
+    assert channel in layer.waiters and channel not in layer.mailboxes
+
+    await layer.send(channel, {"type": "test", "n": 1})
+    assert (await waiting)["n"] == 1
+    await layer.send(channel, {"type": "test", "n": 2})
+    assert len(layer.mailboxes[channel]) == 1
+    assert (await layer.receive(channel))["n"] == 2
+    assert not layer.mailboxes and not layer.waiters
+
+    cancelled = asyncio.ensure_future(layer.receive(channel))
+    await asyncio.sleep(0.01)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    assert not layer.waiters
+    await layer.close()
+
+
+@pytest.mark.asyncio
+async def test_unreceived_messages_expire(broker_path):
+    layer = UnixSocketChannelLayer(path=broker_path, expiry=0.05)
+    gone, live = await layer.new_channel(), await layer.new_channel()
+    await layer.connection()
+    await layer.send(gone, {"type": "test", "n": 1})
+    await asyncio.sleep(0.1)
+
+    # The next delivery sweeps the mailbox nobody received from
+    await layer.send(live, {"type": "test", "n": 2})
+    assert gone not in layer.mailboxes
+    assert (await layer.receive(live))["n"] == 2
+    await asyncio.sleep(0.1)
+    await layer.send(live, {"type": "test", "n": 3})
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(layer.receive(gone), 0.01)
+    assert list(layer.mailboxes) == [live]
+    await layer.close()
+
+
+class Transport:
+    def __init__(self, buffered):
+        self.buffered = buffered
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+
+class Writer:
+    def __init__(self, buffered=0):
+        self.transport = Transport(buffered)
+        self.drained = 0
+
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        self.drained += 1
+        self.transport.buffered = 0
+
+    def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_broker_waits_for_a_slow_target():
+    broker = Broker()
+    target = broker.clients["slow"] = Client("slow", Writer(HIGH_WATER + 1), 100, [])
+    reader = asyncio.StreamReader()
+    reader.feed_data(pack_frame("hello", "fast", 100, [], 86400))
+    reader.feed_data(pack_frame("send", 0, "specific.slow!abc", b"payload"))
+    reader.feed_eof()
+    await broker.handle(reader, Writer())
+    assert target.writer.drained == 1
+
+
+@pytest.mark.asyncio
+async def test_groups_survive_a_dropped_broker_connection(tmp_path):
+    broker = Broker()
+    path = str(tmp_path / "broker.sock")
+    server = await serve(path, broker)
+    one, two = UnixSocketChannelLayer(path=path), UnixSocketChannelLayer(path=path)
+    channel = await two.new_channel()
+    await two.group_add("room", channel)
+    receiving = asyncio.ensure_future(two.receive(channel))
+    await asyncio.sleep(0.01)
+
+    dropped = two.writer
+    dropped.transport.abort()
+    for _ in range(100):
+        if two.writer not in (None, dropped) and broker.groups:
+            break
+        await asyncio.sleep(0.01)
+
+    await one.group_send("room", {"type": "chat.message", "n": 1})
+    assert (await asyncio.wait_for(receiving, 1))["n"] == 1
+    await one.close()
+    await two.close()
+    await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+
+
+def test_stale_connection_does_not_unregister_its_successor():
+    broker = Broker()
+    stale = Client("worker", Writer(), 100, [])
+    current = broker.clients["worker"] = Client("worker", Writer(), 100, [])
+    broker.groups["room"] = {"specific.worker!abc": 0}
+
+    broker.forget(stale)
+
+    assert broker.clients["worker"] is current
+    assert broker.groups == {"room": {"specific.worker!abc": 0}}
@@ -0,0 +1,21 @@
+import argparse
+
+import pytest
+
+from benchmarks.loadgen import InProcessClient, LoadTest
+
+
+@pytest.mark.asyncio
+async def test_in_process_run_reports_round_trips():
+    # The full ASGI app, so the middleware stack is part of the run
+    from app.asgi import application
+
+    options = argparse.Namespace(connections=4, ramp=0.0, rate=10.0, senders=2, size=10, duration=0.5, room="loadgen-test")
+    results = await LoadTest(options, lambda: InProcessClient(application, "/ws/chat/loadgen-test/")).run()
+
+    assert results["connections"] == 4
+    assert results["errors"] == {}
+    sent = results["rtt_ms"]["count"]
+    assert sent > 0
+    # Every message reaches its sender once and the other three members once
+    assert results["fanout_ms"]["count"] == 3 * sent
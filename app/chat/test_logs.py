@@ -0,0 +1,37 @@
+import json
+import logging
+import queue
+from app.chat.logs import JsonFormatter, NonBlockingQueueHandler, SamplingFilter, log_records_dropped
+
+
+def make_record(level=logging.INFO, event=None):
+    record = logging.LogRecord("chat", level, __file__, 1, "hello %s", ("world",), None)
+    if event is not None:
+        record.event = event
+    return record
+
+
+def test_sampling_never_drops_errors():
+    sampler = SamplingFilter({"receive": 0.0})
+    assert not sampler.filter(make_record(event="receive"))
+    assert sampler.filter(make_record(level=logging.ERROR, event="receive"))
+    assert sampler.filter(make_record(event="connect"))
+
+
+def test_queue_handler_counts_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    before = log_records_dropped._value.get()
+    handler.handle(make_record())
+    handler.handle(make_record())
+    assert handler.queue.qsize() == 1
+    assert log_records_dropped._value.get() == before + 1
+
+
+def test_records_are_formatted_off_the_caller():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    record = make_record(event="receive")
+    handler.handle(record)
+    queued = handler.queue.get_nowait()
+    # Message args are left for the listener thread to format
+    assert queued.args == ("world",)
+    assert json.loads(JsonFormatter().format(queued))["message"] == "hello world"
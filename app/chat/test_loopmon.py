@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+import pytest
+
+from app.chat.loopmon import LoopMonitor, census
+
+
+async def idle():
+    await asyncio.sleep(10)
+
+
+@pytest.mark.asyncio
+async def test_census_groups_tasks_by_coroutine():
+    tasks = [asyncio.ensure_future(idle()) for _ in range(3)]
+    await asyncio.sleep(0)
+    entries = {entry["coroutine"]: entry for entry in census(stacks=5)}
+    assert entries["idle"]["tasks"] == 3
+    assert any("idle" in frame for frame in entries["idle"]["stack"])
+    for task in tasks:
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_blocking_callback_is_measured_and_reported(caplog):
+    monitor = LoopMonitor(interval=0.01, slow_callback=0.05, census_interval=0)
+    monitor.ensure_running()
+    await asyncio.sleep(0.03)
+    time.sleep(0.2)
+    await asyncio.sleep(0.03)
+    monitor.task.cancel()
+
+    assert monitor.blocked == 1
+    assert monitor.take_peak() >= 0.15
+    assert monitor.take_peak() == 0.0
+    record = next(record for record in caplog.records if record.getMessage() == "Event loop blocked")
+    # The stack was sampled while the loop was stuck in this test
+    assert "test_blocking_callback_is_measured_and_reported" in record.extra["stack"]
+    # census_interval=0 counts tasks on every probe
+    assert "LoopMonitor.run" in monitor.counted
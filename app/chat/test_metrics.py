@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+from app.chat.metrics import FlushOnCollect, LATENCY_BUCKETS, MetricBatch
+
+
+def test_histogram_flush_matches_direct_observe():
+    registry = CollectorRegistry()
+    direct = Histogram('direct_seconds', 'direct', buckets=LATENCY_BUCKETS, registry=registry)
+    batch = MetricBatch()
+    batched = batch.histogram(Histogram('batched_seconds', 'batched', buckets=LATENCY_BUCKETS, registry=registry))
+
+    for amount in (0.00005, 0.0001, 0.003, 0.003, 0.7, 42.0):
+        direct.observe(amount)
+        batched.observe(amount)
+    assert registry.get_sample_value('batched_seconds_count') == 0
+    batch.flush()
+
+    for le in ('0.0001', '0.005', '1.0', '+Inf'):
+        assert registry.get_sample_value('batched_seconds_bucket', {'le': le}) == \
+            registry.get_sample_value('direct_seconds_bucket', {'le': le})
+    assert registry.get_sample_value('batched_seconds_sum') == pytest.approx(
+        registry.get_sample_value('direct_seconds_sum'))
+
+
+def test_labelled_counter_children_are_cached():
+    registry = CollectorRegistry()
+    batch = MetricBatch()
+    counter = batch.counter(Counter('events', 'events', ['kind'], registry=registry))
+    assert counter.labels('a') is counter.labels('a')
+    counter.labels('a').inc()
+    counter.labels('a').inc(2)
+    counter.labels('b').inc()
+    batch.flush()
+    assert registry.get_sample_value('events_total', {'kind': 'a'}) == 3
+    assert registry.get_sample_value('events_total', {'kind': 'b'}) == 1
+
+
+def test_gauge_flush_pushes_last_set_plus_changes():
+    registry = CollectorRegistry()
+    batch = MetricBatch()
+    gauge = batch.gauge(Gauge('depth', 'depth', registry=registry))
+    gauge.inc(5)
+    batch.flush()
+    assert registry.get_sample_value('depth') == 5
+    gauge.set(10)
+    gauge.set(3)
+    gauge.inc()
+    gauge.dec(2)
+    assert registry.get_sample_value('depth') == 5
+    batch.flush()
+    assert registry.get_sample_value('depth') == 2
+    gauge.inc()
+    batch.flush()
+    assert registry.get_sample_value('depth') == 3
+
+
+@pytest.mark.asyncio
+async def test_scrape_from_another_thread_is_exact():
+    registry = CollectorRegistry()
+    batch = MetricBatch(interval=3600)
+    registry.register(FlushOnCollect(batch))
+    counter = batch.counter(Counter('messages', 'messages', registry=registry))
+    batch.ensure_running()
+
+    for _ in range(5):
+        counter.inc()
+    # Scrapes are served off the loop; the flush has to hop onto it
+    output = await asyncio.get_event_loop().run_in_executor(None, generate_latest, registry)
+    assert b'messages_total 5.0' in output
+    batch.task.cancel()
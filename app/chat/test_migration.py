@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+from django.test import RequestFactory, override_settings
+
+from app import views
+from app.chat import codecs
+from app.chat.history import RoomHistories
+from app.chat.migration import Migration, restore, snapshot
+from app.chat.sessions import MemorySessionStore, SQLiteSessionStore
+
+
+class FakeOutbound:
+    def __init__(self):
+        self.frames = []
+
+    def put(self, frame, coalesce=False):
+        self.frames.append(frame)
+
+    async def flush(self):
+        pass
+
+
+class FakeConsumer:
+    def __init__(self, channel_name):
+        self.channel_name = channel_name
+        self.codec = codecs.JSON
+        self.outbound = FakeOutbound()
+        self.closed = None
+
+    async def close(self, code=None):
+        self.closed = code
+
+
+@pytest.mark.asyncio
+async def test_snapshot_round_trip(tmp_path):
+    store = MemorySessionStore(capacity=10, ttl=60)
+    store.set("a", 3)
+    store.set("b", 7)
+    histories = RoomHistories(max_messages=2)
+    room = histories.room("chat_lobby")
+    for seq in (1, 2, 3):
+        room.append(seq, json.dumps({"message": "m%d" % seq, "count": seq, "seq": seq}))
+
+    warm = SQLiteSessionStore(path=str(tmp_path / "sessions.sqlite3"), flush_interval=60)
+    warm.set("a", 5)
+    warm_histories = RoomHistories()
+    assert await restore(await snapshot(store, histories), warm, warm_histories) == (2, 1)
+
+    # Higher counts win
+    assert sorted(warm.items()) == [("a", 5), ("b", 7)]
+    restored = warm_histories.room("chat_lobby")
+    assert (restored.epoch, restored.seq) == (room.epoch, 3)
+    assert [json.loads(frame)["message"] for frame in restored.since(1)] == ["m2", "m3"]
+    # Resuming past the trimmed buffer is still a gap
+    assert restored.since(0) is None
+    warm.close()
+
+
+@pytest.mark.asyncio
+async def test_restore_keeps_rooms_that_moved_on():
+    histories = RoomHistories()
+    histories.room("chat_lobby").append(1, "{}")
+    payload = await snapshot(MemorySessionStore(), histories)
+    histories.room("chat_lobby").append(2, "{}")
+    assert await restore(payload, MemorySessionStore(), histories) == (0, 0)
+    assert histories.room("chat_lobby").seq == 2
+
+
+@pytest.mark.asyncio
+async def test_migration_staggers_reconnects_and_closes_stragglers():
+    consumers = {name: FakeConsumer(name) for name in ("a", "b", "c")}
+    migration = Migration(window=0.05, grace=0.05)
+    migration.watch(consumers)
+    assert migration.start() == 3
+
+    delays = [json.loads(consumer.outbound.frames[0])["reconnect"]["after"] for consumer in consumers.values()]
+    assert all(0 <= delay <= 0.05 for delay in delays)
+    # "b" reconnected on its own
+    gone = consumers.pop("b")
+    await asyncio.sleep(0.15)
+    assert consumers["a"].closed == consumers["c"].closed == 1012
+    assert gone.closed is None
+    migration.stop()
+
+
+@override_settings(CHAT_ADMIN_TOKEN='secret')
+@pytest.mark.parametrize('query', ['window=soon', 'grace=-1', 'window=nan'])
+@pytest.mark.asyncio
+async def test_drain_rejects_bad_window_and_grace(query):
+    views.set_ready()
+    request = RequestFactory().post('/drain?' + query, HTTP_AUTHORIZATION='Bearer secret')
+    response = await views.drain(request)
+    assert response.status_code == 400
+    assert 'error' in json.loads(response.content)
+    # Nothing was started
+    assert views.is_ready
@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+from app.chat.multiprocess import Exporter, parse, reap_dead_workers
+
+WORKER = """
+from prometheus_client import Counter, Gauge
+Counter('worker_messages', 'messages').inc(%d)
+Gauge('worker_connections', 'connections', multiprocess_mode='livesum').set(7)
+"""
+
+
+def run_worker(path, messages):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(path))
+    subprocess.run([sys.executable, '-c', WORKER % messages], env=env, check=True)
+
+
+def sample(page, name):
+    for line in page.decode().splitlines():
+        if line.startswith(name + ' '):
+            return float(line.split()[1])
+    return None
+
+
+def test_parse_worker_files():
+    assert parse('counter_123.db') == ('counter', 123)
+    assert parse('gauge_livesum_9.db') == ('gauge_livesum', 9)
+    assert parse('counter_archive.db') is None
+    assert parse('.lock') is None
+
+
+def test_dead_workers_are_archived_and_their_gauges_dropped(tmp_path):
+    run_worker(tmp_path, 3)
+    run_worker(tmp_path, 4)
+    exporter = Exporter(str(tmp_path), cache_ttl=0)
+
+    page = exporter.render()
+    assert sample(page, 'worker_messages_total') == 7
+    assert sample(page, 'worker_connections') is None
+    assert sorted(f for f in os.listdir(tmp_path) if f.endswith('.db')) == ['counter_archive.db']
+
+    # A later worker adds on top of the archive
+    run_worker(tmp_path, 5)
+    assert reap_dead_workers(str(tmp_path)) == 2
+    assert sample(exporter.render(), 'worker_messages_total') == 12
+
+
+def test_scrapes_are_cached(tmp_path):
+    now = [0.0]
+    exporter = Exporter(str(tmp_path), cache_ttl=1.0, clock=lambda: now[0])
+    run_worker(tmp_path, 1)
+    first = exporter.render()
+    run_worker(tmp_path, 1)
+    assert exporter.render() is first
+    now[0] = 2.0
+    assert sample(exporter.render(), 'worker_messages_total') == 2
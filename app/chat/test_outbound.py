@@ -0,0 +1,92 @@
+import asyncio
+import json
+import pytest
+from app.chat.outbound import OutboundQueue
+
+
+class SlowConsumer:
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.gate = asyncio.Event()
+
+    async def send(self, text_data=None, bytes_data=None):
+        await self.gate.wait()
+        self.sent.append(text_data if text_data is not None else bytes_data)
+
+    async def close(self, code=None):
+        self.closed_with = code
+
+
+@pytest.mark.asyncio
+async def test_coalesces_queued_chat_frames():
+    consumer = SlowConsumer()
+    queue = OutboundQueue(consumer, coalesce=3)
+    queue.put(json.dumps({"message": 0}), coalesce=True)
+    # Let the writer pick up the first frame and block on the client
+    await asyncio.sleep(0)
+    for i in range(1, 5):
+        queue.put(json.dumps({"message": i}), coalesce=True)
+    consumer.gate.set()
+    await queue.writer
+
+    first = json.loads(consumer.sent[0])
+    assert first == {"message": 0}
+    batch = json.loads(consumer.sent[1])
+    assert [m["message"] for m in batch["batch"]] == [1, 2, 3]
+    assert json.loads(consumer.sent[2]) == {"message": 4}
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_keeps_newest_frames():
+    consumer = SlowConsumer()
+    queue = OutboundQueue(consumer, max_frames=2, policy='drop_oldest', coalesce=1)
+    queue.put("0")
+    await asyncio.sleep(0)
+    for i in range(1, 5):
+        queue.put(str(i))
+    consumer.gate.set()
+    await queue.writer
+    # "0" was already handed to the writer when the queue filled up
+    assert consumer.sent == ["0", "3", "4"]
+
+
+@pytest.mark.asyncio
+async def test_drop_new_keeps_oldest_frames():
+    consumer = SlowConsumer()
+    queue = OutboundQueue(consumer, max_frames=2, policy='drop_new', coalesce=1)
+    queue.put("0")
+    await asyncio.sleep(0)
+    for i in range(1, 5):
+        queue.put(str(i))
+    consumer.gate.set()
+    await queue.writer
+    assert consumer.sent == ["0", "1", "2"]
+
+
+@pytest.mark.asyncio
+async def test_byte_cap_keeps_a_large_frame_queued_on_its_own():
+    consumer = SlowConsumer()
+    queue = OutboundQueue(consumer, max_bytes=100, coalesce=1)
+    # Queued in the same tick, before the writer takes the first one
+    queue.put("x" * 95)
+    queue.put('{"type":"ping"}')
+    consumer.gate.set()
+    await queue.writer
+    assert consumer.sent == ["x" * 95, '{"type":"ping"}']
+
+
+@pytest.mark.asyncio
+async def test_close_policy_closes_with_1008():
+    consumer = SlowConsumer()
+    queue = OutboundQueue(consumer, max_frames=1, policy='close')
+    queue.put("0")
+    await asyncio.sleep(0)
+    for i in range(1, 4):
+        queue.put(str(i))
+    await asyncio.sleep(0)
+    assert consumer.closed_with == 1008
+    assert len(queue) == 0
+    consumer.gate.set()
+    await queue.writer
+    assert consumer.sent == ["0"]
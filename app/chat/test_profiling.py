@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import pytest
+
+from app.chat.profiling import Busy, cpu_profile, memory_profile
+
+
+def spin(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+async def keep_busy(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        spin(0.01)
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_cpu_profile_returns_collapsed_stacks_of_the_loop():
+    worker = asyncio.ensure_future(keep_busy(0.3))
+    profile = await cpu_profile(0.2, interval=0.002)
+    await worker
+    lines = profile.splitlines()
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    hot = sum(int(line.rsplit(" ", 1)[1]) for line in lines if "spin (" in line)
+    assert hot > 0
+    assert "keep_busy (app/chat/test_profiling.py" in profile
+    assert "sample_stacks" not in profile
+
+
+@pytest.mark.asyncio
+async def test_memory_profile_reports_growth_and_one_capture_at_a_time():
+    kept = []
+
+    async def allocate():
+        for _ in range(20):
+            kept.append(bytearray(64 * 1024))
+            await asyncio.sleep(0.005)
+
+    worker = asyncio.ensure_future(allocate())
+    capture = asyncio.ensure_future(memory_profile(0.2, limit=5))
+    await asyncio.sleep(0.01)
+    with pytest.raises(Busy):
+        await cpu_profile(0.1)
+    report = await capture
+    await worker
+    assert report.startswith("# ")
+    assert "test_profiling.py" in report.splitlines()[2]
@@ -0,0 +1,50 @@
+from app.chat.ratelimit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_connection_bucket_allows_burst_then_limits():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=2, burst=3, session_rate=100, session_burst=100, clock=clock)
+    bucket = limiter.connection_bucket()
+
+    assert [limiter.check(bucket, "s")[0] for _ in range(3)] == [0, 0, 0]
+    wait, scope = limiter.check(bucket, "s")
+    assert scope == "connection"
+    assert wait == 0.5
+
+    clock.now = 0.5
+    assert limiter.check(bucket, "s") == (0.0, None)
+
+
+def test_session_bucket_is_shared_across_connections():
+    clock = FakeClock()
+    limiter = RateLimiter(rate=100, burst=100, session_rate=1, session_burst=2, clock=clock)
+    first, second = limiter.connection_bucket(), limiter.connection_bucket()
+
+    assert limiter.check(first, "s")[0] == 0
+    assert limiter.check(second, "s")[0] == 0
+    wait, scope = limiter.check(first, "s")
+    assert scope == "session"
+    # A limited check takes nothing from the connection bucket
+    assert first.tokens == 99
+
+
+def test_session_buckets_are_bounded():
+    limiter = RateLimiter(max_sessions=2)
+    bucket = limiter.connection_bucket()
+    for session_id in ("a", "b", "c"):
+        limiter.check(bucket, session_id)
+    assert list(limiter.sessions) == ["b", "c"]
+
+
+def test_admission_ceiling():
+    limiter = RateLimiter(max_connections=2)
+    assert limiter.admit(1)
+    assert not limiter.admit(2)
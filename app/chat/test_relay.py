@@ -0,0 +1,31 @@
+import pytest
+
+from app.chat import relay
+
+
+def test_pack_and_parse_round_trip():
+    frame = relay.pack(7, "lobby", b"\x00payload")
+    assert frame[0] == relay.MAGIC
+    assert relay.is_relay(frame)
+    assert relay.parse(frame) == (7, "lobby")
+    assert relay.parse(relay.pack(1, "", b"x")) == (1, "")
+
+
+def test_codec_frames_are_not_relay_frames():
+    assert not relay.is_relay(None)
+    assert not relay.is_relay(b"")
+    assert not relay.is_relay(b"\x81\xa7message")
+    assert not relay.is_relay(b"\x78\x9c")
+
+
+@pytest.mark.parametrize("frame, reason", [
+    (b"\xc1\x01", "bad_relay_frame"),
+    (b"\xc1\x01\x05abc", "bad_relay_frame"),
+    (b"\xc1\x01\x5bx", "bad_relay_frame"),
+    (b"\xc1\x01\x02\xff\xfe", "bad_relay_frame"),
+    (relay.pack(1, "lobby", b"x" * 100), "frame_too_large"),
+])
+def test_bad_frames_are_refused(frame, reason):
+    with pytest.raises(relay.RelayError) as error:
+        relay.parse(frame, max_size=64)
+    assert error.value.reason == reason
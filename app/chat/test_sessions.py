@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from app.chat.sessions import BaseSessionStore, MemorySessionStore, SQLiteSessionStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(capacity=2, ttl=60)
+    store.set("a", 1)
+    store.set("b", 2)
+    # Touch "a" so "b" becomes the oldest entry
+    assert store.get("a") == 1
+    store.set("c", 3)
+
+    assert len(store) == 2
+    assert store.get("b") == 0
+    assert store.get("a") == 1
+    assert store.get("c") == 3
+
+
+def test_memory_store_expires_after_ttl():
+    clock = FakeClock()
+    store = MemorySessionStore(capacity=10, ttl=30, clock=clock)
+    store.set("a", 5)
+    clock.now = 20
+    store.set("b", 7)
+
+    clock.now = 40
+    assert store.get("a", None) is None
+    assert store.get("b") == 7
+    assert len(store) == 1
+
+
+def test_sqlite_store_coalesces_writes(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    store = SQLiteSessionStore(path=path, flush_interval=60)
+    for count in range(1, 101):
+        store.set("a", count)
+    # Unflushed writes are still visible to readers
+    assert store.get("a") == 100
+    assert store.pending == {"a": 100}
+    store.close()
+
+    reopened = SQLiteSessionStore(path=path, flush_interval=60)
+    assert reopened.get("a") == 100
+    assert reopened.get("missing") == 0
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_reads_off_the_event_loop(tmp_path):
+    store = SQLiteSessionStore(path=str(tmp_path / "sessions.sqlite3"), flush_interval=60)
+    store.set("a", 3)
+    assert await store.aget("a") == 3
+    store.flush()
+    assert await store.aget("a") == 3
+    assert await store.aget("missing", -1) == -1
+    assert store.read_conn is not None
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_bulk_load_merges_off_the_event_loop(tmp_path):
+    store = SQLiteSessionStore(path=str(tmp_path / "sessions.sqlite3"), flush_interval=60)
+    store.set("s0", 10)
+    store.flush()
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0)
+
+    ticker = asyncio.ensure_future(tick())
+    await store.aload([("s%d" % i, 5) for i in range(2500)], chunk=1000)
+    ticker.cancel()
+
+    # The loop ran between chunks; higher counts won
+    assert len(ticks) >= 3
+    assert dict(await store.aitems())["s0"] == 10
+    assert len(await store.aitems()) == 2500
+    store.close()
+
+
+def test_base_store_requires_the_storage_methods():
+    class Incomplete(BaseSessionStore):
+        def get(self, session_id, default=0):
+            return default
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import signal
+
+import pytest
+from app.chat.outbound import OutboundQueue
+from app.chat.shutdown import connections_left, drain_connections, drain_on_signals
+
+
+class FakeConsumer:
+    def __init__(self, tracker, hang=False):
+        self.tracker = tracker
+        self.hang = hang
+        self.sent = []
+        self.closed_with = None
+        self.outbound = OutboundQueue(self)
+
+    async def send(self, text_data=None, bytes_data=None):
+        self.sent.append(text_data)
+
+    async def close(self, code=None):
+        self.tracker["open"] += 1
+        self.tracker["peak"] = max(self.tracker["peak"], self.tracker["open"])
+        await asyncio.sleep(1 if self.hang else 0.01)
+        self.tracker["open"] -= 1
+        self.closed_with = code
+
+
+@pytest.mark.asyncio
+async def test_drain_flushes_and_closes_with_bounded_parallelism():
+    tracker = {"open": 0, "peak": 0}
+    consumers = [FakeConsumer(tracker) for _ in range(20)]
+    for consumer in consumers:
+        consumer.outbound.put("last words")
+
+    left = await drain_connections(consumers, deadline=5, parallelism=4)
+
+    assert left == 0
+    assert tracker["peak"] <= 4
+    assert all(c.closed_with == 1001 for c in consumers)
+    assert all(c.sent == ["last words"] for c in consumers)
+
+
+@pytest.mark.asyncio
+async def test_drain_gives_up_at_deadline():
+    tracker = {"open": 0, "peak": 0}
+    consumers = [FakeConsumer(tracker), FakeConsumer(tracker, hang=True)]
+    before = connections_left._value.get()
+
+    left = await drain_connections(consumers, deadline=0.2, parallelism=10)
+
+    assert left == 1
+    assert connections_left._value.get() == before + 1
+    assert consumers[0].closed_with == 1001
+    assert consumers[1].closed_with is None
+
+
+@pytest.mark.asyncio
+async def test_signal_drains_before_the_servers_own_handler():
+    loop = asyncio.get_event_loop()
+    tracker = {"open": 0, "peak": 0}
+    consumers = [FakeConsumer(tracker) for _ in range(3)]
+    events = []
+    # Stands in for the handler the server installed before lifespan startup
+    loop.add_signal_handler(signal.SIGUSR2, lambda: events.append(
+        ("server", [c.closed_with for c in consumers])))
+    try:
+        assert drain_on_signals(loop, consumers, on_signal=lambda: events.append("not ready"),
+                                signals=(signal.SIGUSR2,))
+        os.kill(os.getpid(), signal.SIGUSR2)
+        for _ in range(100):
+            if len(events) == 2:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        loop.remove_signal_handler(signal.SIGUSR2)
+
+    assert events == ["not ready", ("server", [1001, 1001, 1001])]
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from app.chat.warmup import Warmup, startup_seconds
+
+
+@pytest.mark.asyncio
+async def test_steps_run_in_order_and_are_timed():
+    calls = []
+
+    async def connect():
+        await asyncio.sleep(0.01)
+        calls.append("connect")
+
+    warmup = Warmup([("connect", connect), ("load", lambda: calls.append("load"))])
+    await warmup.ensure()
+    assert calls == ["connect", "load"]
+    assert warmup.done
+    assert warmup.timings["connect"] >= 0.01
+    assert startup_seconds.labels("load")._value.get() == warmup.timings["load"]
+
+
+@pytest.mark.asyncio
+async def test_failing_step_is_skipped(caplog):
+    def broken():
+        raise RuntimeError("no database")
+
+    calls = []
+    warmup = Warmup([("broken", broken), ("after", lambda: calls.append("after"))])
+    await warmup.ensure()
+    assert warmup.done
+    assert calls == ["after"]
+    assert any(record.getMessage() == "Warm-up step failed" for record in caplog.records)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_run():
+    calls = []
+
+    async def slow():
+        await asyncio.sleep(0.01)
+        calls.append("slow")
+
+    warmup = Warmup([("slow", slow)])
+    await asyncio.gather(warmup.ensure(), warmup.ensure())
+    await warmup.ensure()
+    assert calls == ["slow"]
@@ -0,0 +1,117 @@
+# warmup.py for Django WebSocket Service
+
+import asyncio
+import inspect
+import logging
+import os
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.urls import get_resolver
+from prometheus_client import Gauge
+
+from app.chat import codecs
+from app.chat.consumers import CHAT_FIELDS
+from app.chat.health import health_checker
+from app.chat.loopmon import loop_monitor
+from app.chat.metrics import batch as metric_batch
+from app.chat.migration import restore
+from app.chat.sessions import get_session_store
+
+logger = logging.getLogger("chat")
+
+startup_seconds = Gauge('chat_startup_seconds', 'Time this worker spent in each startup phase', ['phase'], multiprocess_mode='livemax')
+
+
+async def channel_layer():
+    layer = get_channel_layer()
+    if hasattr(layer, 'connection'):
+        await layer.connection(0)
+
+
+def session_store():
+    # Opens the database and starts the flush thread for SQLite
+    get_session_store().ping()
+
+
+async def snapshot():
+    path = getattr(settings, 'CHAT_MIGRATION', {}).get('SNAPSHOT_PATH')
+    if path and os.path.exists(path):
+        with open(path, 'rb') as f:
+            await restore(f.read())
+
+
+def codec_paths():
+    # First calls into orjson, msgpack and zlib are slower than the rest
+    for codec in codecs.CODECS.values():
+        event = {'type': 'chat_message', 'message': 'warm-up ' * 200, 'count': 0, 'seq': 0}
+        frame = codecs.encode_for(event, codec, CHAT_FIELDS)
+        if isinstance(frame, bytes):
+            codec.decode(None, frame)
+        else:
+            codec.decode(frame, None)
+        codec.join([frame, frame])
+
+
+def url_patterns():
+    # Django imports the URLconf, and django_prometheus with it, on the
+    # first HTTP request otherwise
+    get_resolver().url_patterns
+
+
+async def background_tasks():
+    metric_batch.ensure_running()
+    loop_monitor.ensure_running()
+    health_checker.ensure_running()
+    # So the first /ready is answered from a real check
+    await health_checker.status()
+
+
+class Warmup:
+    """Gets a worker ready for traffic before it reports ready.
+
+    Steps run once, in order, each timed into ``chat_startup_seconds``. A
+    failing step is logged and skipped: whether the worker can serve is the
+    health checker's call, and it keeps checking.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.task = None
+        self.done = False
+        self.timings = {}
+
+    async def ensure(self):
+        """Run the warm-up, or wait for the one already running."""
+        if self.done:
+            return
+        if self.task is None or self.task.get_loop() is not asyncio.get_event_loop():
+            self.task = asyncio.ensure_future(self.run())
+        await asyncio.shield(self.task)
+
+    async def run(self):
+        start = time.perf_counter()
+        for name, step in self.steps:
+            step_start = time.perf_counter()
+            try:
+                result = step()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error("Warm-up step failed", extra={"event": "error", "extra": {"step": name, "error": str(e)}})
+            self.timings[name] = round(time.perf_counter() - step_start, 4)
+            startup_seconds.labels(name).set(self.timings[name])
+        self.done = True
+        logger.info("Warm-up complete", extra={"event": "startup", "extra": {
+            "seconds": round(time.perf_counter() - start, 4), "steps": self.timings}})
+
+
+warmup = Warmup([
+    ('channel_layer', channel_layer),
+    ('session_store', session_store),
+    ('snapshot', snapshot),
+    ('codecs', codec_paths),
+    ('urls', url_patterns),
+    ('background_tasks', background_tasks),
+])
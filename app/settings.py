@@ -22,11 +22,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'channels',
     'app',
     'app.chat'
 ]
 
+# The channels app only exists to make runserver serve through daphne, and
+# importing it pulls in daphne and Twisted: about a third of startup. Under
+# uvicorn nothing needs it.
+if os.environ.get('CHAT_ASGI_SERVER') != 'uvicorn':
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('app'), 'channels')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -111,6 +116,181 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Several workers on one host share groups through the local broker
+# (python -m app.chat.broker) instead of Redis; scripts/serve.sh starts it
+# and sets CHAT_BROKER_PATH when WEB_CONCURRENCY > 1.
+if os.environ.get('CHAT_BROKER_PATH'):
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'app.chat.layers.UnixSocketChannelLayer',
+        'CONFIG': {
+            'path': os.environ['CHAT_BROKER_PATH'],
+            'capacity': 1000,
+        },
+    }
+
+# Heartbeats: one process-wide timer wheel, each connection gets one
+# heartbeat per interval at a random offset within it.
+CHAT_HEARTBEAT_INTERVAL = 30
+CHAT_HEARTBEAT_SLOTS = 60
+# Close connections that sent nothing, not even a {"pong": ...} answer to a
+# heartbeat, for this many seconds. Checked as the heartbeat wheel comes
+# round, so a connection can stay up to one heartbeat interval past it.
+# 0 (the default) disables it; with it on, listen-only clients have to pong
+# to stay connected.
+CHAT_IDLE_TIMEOUT = float(os.environ.get('CHAT_IDLE_TIMEOUT', 0)) or None
+
+# Session store: {session_id: message_count}. MemorySessionStore is a bounded
+# LRU with a sliding TTL; SQLiteSessionStore survives restarts and batches
+# writes (OPTIONS: path, ttl, flush_interval, batch_size).
+CHAT_SESSION_STORE = {
+    'BACKEND': 'app.chat.sessions.MemorySessionStore',
+    'OPTIONS': {
+        'capacity': int(os.environ.get('CHAT_SESSION_CAPACITY', 100000)),
+        'ttl': int(os.environ.get('CHAT_SESSION_TTL', 3600)),
+    },
+}
+
+# Per-connection outbound queue. When a client falls behind, POLICY decides
+# what happens: 'drop_oldest', 'drop_new' or 'close' (close code 1008).
+# Up to COALESCE queued chat messages are sent as one {"batch": [...]} frame.
+# MAX_BYTES leaves room for a few CHAT_RELAY['MAX_SIZE'] frames.
+CHAT_OUTBOUND_QUEUE = {
+    'MAX_FRAMES': 1000,
+    'MAX_BYTES': 4 << 20,
+    'POLICY': os.environ.get('CHAT_SLOW_CONSUMER_POLICY', 'drop_oldest'),
+    'COALESCE': 16,
+}
+
+# Admission control and rate limiting. RATE/BURST are messages per second per
+# connection, SESSION_RATE/SESSION_BURST per session id. Over-rate messages
+# are handled per POLICY: 'throttle' (delay), 'reject' (error frame) or
+# 'close' (close code 1008). Connections beyond MAX_CONNECTIONS per worker are
+# closed with 1013 and a retry_after hint in seconds.
+CHAT_RATE_LIMIT = {
+    'RATE': 20,
+    'BURST': 40,
+    'SESSION_RATE': 40,
+    'SESSION_BURST': 80,
+    'POLICY': os.environ.get('CHAT_RATE_LIMIT_POLICY', 'throttle'),
+    'MAX_CONNECTIONS': int(os.environ.get('CHAT_MAX_CONNECTIONS', 20000)),
+    'RETRY_AFTER': 5,
+}
+
+# SIGTERM drain: flush and close connections with code 1001, at most
+# PARALLELISM at a time, giving up on whatever is left after DEADLINE seconds.
+CHAT_SHUTDOWN = {
+    'DEADLINE': float(os.environ.get('CHAT_SHUTDOWN_DEADLINE', 10)),
+    'PARALLELISM': int(os.environ.get('CHAT_SHUTDOWN_PARALLELISM', 500)),
+}
+
+# Chat logs are formatted and written by a background thread. QUEUE_SIZE
+# bounds the records waiting for it (overflow is counted, not blocked on).
+# SAMPLING keeps that fraction of records per event; warnings and errors
+# are never sampled.
+CHAT_LOGGING = {
+    'QUEUE_SIZE': 10000,
+    'SAMPLING': {
+        'receive': float(os.environ.get('CHAT_LOG_SAMPLE_RECEIVE', 0.01)),
+        'heartbeat': float(os.environ.get('CHAT_LOG_SAMPLE_HEARTBEAT', 0.1)),
+    },
+}
+
+# Application-level compression, offered as a "+deflate" variant of every
+# codec subprotocol (chat.json+deflate, chat.msgpack+deflate). Frames of at
+# least THRESHOLD bytes are zlib-compressed once per broadcast. Leave it off
+# for clients that already get permessage-deflate from the server.
+CHAT_COMPRESSION = {
+    'ENABLED': os.environ.get('CHAT_COMPRESSION', '1') == '1',
+    'THRESHOLD': int(os.environ.get('CHAT_COMPRESSION_THRESHOLD', 1024)),
+    'LEVEL': 6,
+    # Largest frame a client may send compressed, once inflated
+    'MAX_INFLATED_SIZE': 1 << 20,
+}
+
+# Binary relay frames: bytes frames starting with 0xC1, then a type byte, the
+# room name's length and the room name. The server reads only that header and
+# broadcasts the frame as it came to everyone in the room, without decoding
+# it. MAX_SIZE bounds the whole frame; keep CHAT_OUTBOUND_QUEUE['MAX_BYTES']
+# well above it, or a large frame queued behind another pushes it out.
+CHAT_RELAY = {
+    'ENABLED': os.environ.get('CHAT_RELAY', '1') == '1',
+    'MAX_SIZE': int(os.environ.get('CHAT_RELAY_MAX_SIZE', 1 << 20)),
+}
+
+# Per-room replay buffers. Chat frames carry a room sequence number ("seq");
+# a client reconnecting with ?last_seq=N&epoch=E gets what it missed as one
+# batch frame, or {"error": "gap_too_large"} once those messages have been
+# dropped. Buffers hold each message's JSON frame, and MAX_BYTES counts the
+# memory those frames take. Sequences are numbered per worker, so with a
+# channel layer that spans workers every resume gets gap_too_large.
+CHAT_HISTORY = {
+    'MAX_MESSAGES': int(os.environ.get('CHAT_HISTORY_MESSAGES', 1000)),
+    'MAX_BYTES': int(os.environ.get('CHAT_HISTORY_BYTES', 1 << 20)),
+    'MAX_ROOMS': 10000,
+}
+
+# Readiness: dependencies are checked every INTERVAL seconds in the
+# background and /ready serves the cached result. The worker also reports
+# not ready (503) past any saturation threshold, so the load balancer and the
+# blue-green scripts steer new connections elsewhere. None disables one.
+CHAT_HEALTH = {
+    'INTERVAL': 1.0,
+    'TIMEOUT': 0.5,
+    'MAX_CONNECTIONS': int(os.environ.get('CHAT_READY_MAX_CONNECTIONS', 18000)),
+    'MAX_QUEUE_DEPTH': int(os.environ.get('CHAT_READY_MAX_QUEUE_DEPTH', 200000)),
+    'MAX_LOOP_LAG': float(os.environ.get('CHAT_READY_MAX_LOOP_LAG', 0.5)),
+}
+
+# Hot-path metrics are summed on the event loop and flushed into the
+# prometheus registry every FLUSH_INTERVAL seconds and on each scrape.
+CHAT_METRICS = {
+    'FLUSH_INTERVAL': float(os.environ.get('CHAT_METRICS_FLUSH_INTERVAL', 1.0)),
+    # How long a scrape waits for the event loop to flush
+    'SCRAPE_TIMEOUT': 1.0,
+    # With PROMETHEUS_MULTIPROC_DIR set (uvicorn --workers), /metrics merges
+    # every worker's files: the page is cached for SCRAPE_CACHE seconds and
+    # dead workers' files are folded into archives every REAP_INTERVAL.
+    'SCRAPE_CACHE': 1.0,
+    'REAP_INTERVAL': 30.0,
+}
+
+# Event loop instrumentation. A probe wakes every INTERVAL seconds to
+# measure loop lag; a watchdog thread logs the loop's stack when one callback
+# blocks it for more than SLOW_CALLBACK seconds. Pending tasks are counted
+# by coroutine every CENSUS_INTERVAL seconds; /ops/diagnostics counts them
+# on demand.
+CHAT_LOOP_MONITOR = {
+    'ENABLED': os.environ.get('CHAT_LOOP_MONITOR', '1') == '1',
+    'INTERVAL': 0.1,
+    'SLOW_CALLBACK': float(os.environ.get('CHAT_SLOW_CALLBACK', 0.1)),
+    'CENSUS_INTERVAL': 15.0,
+    'STACK_DEPTH': 20,
+}
+
+# On-demand profiling through /ops/profile (same token as the other /ops/
+# endpoints): a sampling CPU profile every SAMPLE_INTERVAL seconds, or a
+# tracemalloc diff keeping TRACEMALLOC_FRAMES frames per allocation. A
+# capture runs for at most MAX_SECONDS.
+CHAT_PROFILING = {
+    'MAX_SECONDS': 60,
+    'SAMPLE_INTERVAL': 0.005,
+    'TRACEMALLOC_FRAMES': 10,
+}
+
+# Blue-green cutover. POST /ops/drain asks every client to reconnect after a
+# random delay within WINDOW seconds, and closes those still here GRACE
+# seconds after their turn. /ops/snapshot exports (GET) or loads (POST) the
+# session counts and room replay buffers; SNAPSHOT_PATH is loaded at startup
+# if it exists. The /ops/ endpoints need "Authorization: Bearer <ADMIN_TOKEN>"
+# and are off while no token is set. /ops/diagnostics and
+# /ops/profile use the same token.
+CHAT_MIGRATION = {
+    'WINDOW': float(os.environ.get('CHAT_MIGRATION_WINDOW', 30)),
+    'GRACE': float(os.environ.get('CHAT_MIGRATION_GRACE', 10)),
+    'SNAPSHOT_PATH': os.environ.get('CHAT_SNAPSHOT_PATH'),
+}
+CHAT_ADMIN_TOKEN = os.environ.get('CHAT_ADMIN_TOKEN')
+
 # monkey patch to get rid of message below in docker
 from django.http.request import HttpRequest
 HttpRequest.get_host = HttpRequest._get_raw_host
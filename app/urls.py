@@ -7,8 +7,14 @@ from app.chat.consumers import ChatConsumer
 from app import views
 
 urlpatterns = [
+    # Ahead of django_prometheus.urls so /metrics aggregates across workers
+    path('metrics', views.metrics),
     path('', include('django_prometheus.urls')),
     path('admin/', admin.site.urls),
     path('health', views.health),
     path('ready', views.ready),
+    path('ops/drain', views.drain),
+    path('ops/snapshot', views.snapshot),
+    path('ops/diagnostics', views.diagnostics),
+    path('ops/profile', views.profile),
 ]
@@ -1,13 +1,32 @@
-from django.http import JsonResponse
+import functools
+import hmac
 
-# Module-level readiness flag
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+
+# Module-level readiness flag, set once the worker has warmed up
 is_ready = False
 
 def health(request):
     return JsonResponse({'status': 'ok'})
 
-def ready(request):
-    return JsonResponse({'status': 'ready' if is_ready else 'not ready'})
+async def ready(request):
+    # Reads the health checker's cached result; nothing is checked per probe
+    from app.chat.consumers import health_checker
+    from app.chat.loopmon import loop_monitor
+    from app.chat.warmup import warmup
+    if not warmup.done:
+        # Servers without lifespan support warm up on the first probe
+        await warmup.ensure()
+        set_ready()
+    health_checker.ensure_running()
+    loop_monitor.ensure_running()
+    health = await health_checker.status()
+    if not is_ready:
+        health = dict(health, ready=False, reasons=['shutting_down'] + health['reasons'])
+    return JsonResponse(dict(health, status='ready' if health['ready'] else 'not ready'),
+                        status=200 if health['ready'] else 503)
 
 def set_ready():
     global is_ready
@@ -15,4 +34,116 @@ def set_ready():
 
 def set_not_ready():
     global is_ready
-    is_ready = False
\ No newline at end of file
+    is_ready = False
+
+def metrics(request):
+    # Imported here so PROMETHEUS_MULTIPROC_DIR is read once the worker is up
+    from app.chat.multiprocess import exporter
+    return HttpResponse(exporter.render(), content_type=CONTENT_TYPE_LATEST)
+
+def admin_only(view):
+    """Guard an async ops view with ``Authorization: Bearer <CHAT_ADMIN_TOKEN>``.
+
+    Without a configured token the view doesn't exist (404).
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        token = getattr(settings, 'CHAT_ADMIN_TOKEN', None)
+        if not token:
+            return JsonResponse({'error': 'not found'}, status=404)
+        scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+        if scheme != 'Bearer' or not hmac.compare_digest(given.encode(), token.encode()):
+            return JsonResponse({'error': 'unauthorized'}, status=401)
+        return await view(request, *args, **kwargs)
+    # Token-authenticated, no cookies involved
+    wrapper.csrf_exempt = True
+    return wrapper
+
+@admin_only
+async def drain(request):
+    """Stop taking new traffic and move clients to the other color, staggered."""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    from app.chat.migration import migration
+    window = request.GET.get('window')
+    grace = request.GET.get('grace')
+    try:
+        window = float(window) if window is not None else None
+        grace = float(grace) if grace is not None else None
+    except ValueError:
+        return JsonResponse({'error': 'window and grace must be numbers'}, status=400)
+    # Also turns away nan and inf
+    if any(value is not None and not 0 <= value < float('inf') for value in (window, grace)):
+        return JsonResponse({'error': 'window and grace must be non-negative seconds'}, status=400)
+    set_not_ready()
+    clients = migration.start(window=window, grace=grace)
+    return JsonResponse({'status': 'draining', 'clients': clients,
+                         'window': migration.window, 'grace': migration.grace})
+
+@admin_only
+async def snapshot(request):
+    """GET exports this worker's sessions and room buffers; POST loads one."""
+    from app.chat import migration
+    if request.method == 'GET':
+        return HttpResponse(await migration.snapshot(), content_type='application/octet-stream')
+    if request.method == 'POST':
+        try:
+            sessions, rooms = await migration.restore(request.body)
+        except Exception as e:
+            return JsonResponse({'error': 'bad snapshot: %s' % e}, status=400)
+        return JsonResponse({'sessions': sessions, 'rooms': rooms})
+    return HttpResponseNotAllowed(['GET', 'POST'])
+
+@admin_only
+async def diagnostics(request):
+    """Event loop health and pending tasks by coroutine.
+
+    ``?stacks=N`` adds an N-frame stack sample per coroutine and ``?limit=``
+    caps how many coroutines are listed (50).
+    """
+    from app.chat.consumers import ChatConsumer
+    from app.chat.loopmon import census, loop_monitor
+    loop_monitor.ensure_running()
+    try:
+        stacks = int(request.GET.get('stacks', 0))
+        limit = int(request.GET.get('limit', 50))
+    except ValueError:
+        return JsonResponse({'error': 'stacks and limit must be integers'}, status=400)
+    tasks = census(stacks=stacks)
+    return JsonResponse({
+        'loop': loop_monitor.status(),
+        'connections': len(ChatConsumer.active_ws_connections),
+        'total_tasks': sum(entry['tasks'] for entry in tasks),
+        'tasks': tasks[:limit],
+    })
+
+@admin_only
+async def profile(request):
+    """Profile this worker for ``?seconds=`` without stopping it.
+
+    ``?kind=cpu`` (default) returns collapsed stacks for a flamegraph;
+    ``?threads=all`` samples every thread, not just the event loop's.
+    ``?kind=memory`` returns the top ``?limit=`` allocation sites by growth.
+    """
+    from app.chat import profiling
+    config = getattr(settings, 'CHAT_PROFILING', {})
+    kind = request.GET.get('kind', 'cpu')
+    try:
+        seconds = float(request.GET.get('seconds', 10))
+        limit = int(request.GET.get('limit', 30))
+    except ValueError:
+        return JsonResponse({'error': 'seconds and limit must be numbers'}, status=400)
+    if not 0 < seconds <= config.get('MAX_SECONDS', 60):
+        return JsonResponse({'error': 'seconds must be in (0, %s]' % config.get('MAX_SECONDS', 60)}, status=400)
+    try:
+        if kind == 'cpu':
+            result = await profiling.cpu_profile(
+                seconds, interval=config.get('SAMPLE_INTERVAL', 0.005),
+                all_threads=request.GET.get('threads') == 'all')
+        elif kind == 'memory':
+            result = await profiling.memory_profile(seconds, limit=limit, frames=config.get('TRACEMALLOC_FRAMES', 10))
+        else:
+            return JsonResponse({'error': 'kind must be cpu or memory'}, status=400)
+    except profiling.Busy as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    return HttpResponse(result, content_type='text/plain; charset=utf-8')
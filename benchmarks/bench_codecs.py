@@ -0,0 +1,66 @@
+# Benchmark: encode/decode throughput and frame size per wire codec.
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_codecs
+
+import json
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+django.setup()
+
+from app.chat import codecs  # noqa: E402
+
+PAYLOADS = {
+    'small': {'message': 'hello', 'count': 42},
+    'medium': {'message': 'x' * 1024, 'count': 123456},
+    'large': {'message': {'rows': [{'id': i, 'user': 'user-%d' % (i % 40), 'text': 'status update %d' % i} for i in range(400)]}, 'count': 9},
+    'nested': {'message': {'items': [{'id': i, 'name': 'item-%d' % i, 'tags': ['a', 'b']} for i in range(50)]}, 'count': 7},
+}
+
+
+class StdlibJsonCodec:
+    """The encoding the consumers used before codecs were negotiable."""
+
+    name = 'json (stdlib)'
+
+    def encode(self, obj):
+        return json.dumps(obj)
+
+    def decode(self, text_data=None, bytes_data=None):
+        return json.loads(text_data)
+
+
+def rate(fn, arg, budget=0.2):
+    n = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(100):
+            fn(arg)
+        n += 100
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget:
+            return n / elapsed
+
+
+def main():
+    candidates = [StdlibJsonCodec()] + list(codecs.CODECS.values())
+    print("%-8s %-22s %14s %14s %10s" % ("payload", "codec", "encode/s", "decode/s", "bytes"))
+    for label, payload in PAYLOADS.items():
+        for codec in candidates:
+            frame = codec.encode(payload)
+            if isinstance(frame, bytes):
+                decode = lambda f, c=codec: c.decode(bytes_data=f)
+                size = len(frame)
+            else:
+                decode = lambda f, c=codec: c.decode(text_data=f)
+                size = len(frame.encode())
+            print("%-8s %-22s %14.0f %14.0f %10d" % (
+                label, codec.name, rate(codec.encode, payload), rate(decode, frame), size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+# Microbenchmarks for the ChatConsumer hot paths.
+#
+# Drives ChatConsumer through channels.testing.WebsocketCommunicator, fully
+# offline, and measures:
+#   - broadcast throughput and allocation high-water per message by room size
+#   - heartbeat tick cost by room size
+#   - connect/disconnect churn
+#   - the logging and metrics calls on their own
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_consumer                  # report only
+#   python -m benchmarks.bench_consumer --check          # fail on regressions
+#   python -m benchmarks.bench_consumer --save           # refresh the baseline
+#
+# Results are compared against benchmarks/baseline.json. Keys ending in
+# _per_sec are higher-is-better, everything else lower-is-better. Baselines
+# are machine specific: refresh with --save on the machine doing the checks.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+django.setup()
+
+from channels.testing import WebsocketCommunicator  # noqa: E402
+
+from app.chat import consumers  # noqa: E402
+from app.chat.consumers import ChatConsumer  # noqa: E402
+from app.chat.heartbeat import scheduler as heartbeat_scheduler  # noqa: E402
+from app.chat.ratelimit import rate_limiter  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+APPLICATION = ChatConsumer.as_asgi()
+
+
+async def open_room(size, room):
+    """Connect ``size`` members; returns their communicators and the first member's consumer."""
+    communicators = []
+    for _ in range(size):
+        communicator = WebsocketCommunicator(APPLICATION, '/ws/chat/?room=%s' % room)
+        await communicator.connect()
+        communicators.append(communicator)
+    session = json.loads(await communicators[0].receive_from())['session']
+    sender = next(c for c in ChatConsumer.active_ws_connections.values() if c.session_id == session)
+    await settle(communicators)
+    return communicators, sender
+
+
+async def close_room(communicators):
+    for communicator in communicators:
+        await communicator.disconnect()
+
+
+async def settle(communicators):
+    """Wait for every outbound writer to finish, then drop what they sent."""
+    while any(c.outbound.writer is not None for c in ChatConsumer.active_ws_connections.values()):
+        await asyncio.sleep(0)
+    for communicator in communicators:
+        queue = communicator.output_queue
+        while not queue.empty():
+            queue.get_nowait()
+
+
+async def broadcast(communicators, sender, messages):
+    text = json.dumps({'message': 'x' * 100})
+    target = sender.message_count + messages
+    for _ in range(messages):
+        await communicators[0].send_to(text_data=text)
+    while sender.message_count < target:
+        await asyncio.sleep(0)
+    await settle(communicators)
+
+
+async def bench_room(size, messages):
+    communicators, sender = await open_room(size, 'bench%d' % size)
+    await broadcast(communicators, sender, 5)
+
+    start = time.perf_counter()
+    await broadcast(communicators, sender, messages)
+    elapsed = time.perf_counter() - start
+
+    # Allocation high-water for a single broadcast, averaged
+    samples = []
+    tracemalloc.start()
+    for _ in range(5):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        await broadcast(communicators, sender, 1)
+        samples.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    consumers_in_room = list(ChatConsumer.active_ws_connections.values())
+    rounds = 20
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await heartbeat_scheduler.beat(consumers_in_room)
+        await settle(communicators)
+    heartbeat = (time.perf_counter() - start) / rounds
+
+    await close_room(communicators)
+    return {
+        'broadcast_%d_msgs_per_sec' % size: round(messages / elapsed, 1),
+        'broadcast_%d_deliveries_per_sec' % size: round(messages * size / elapsed, 1),
+        'broadcast_%d_peak_alloc_bytes' % size: int(sum(samples) / len(samples)),
+        'heartbeat_%d_tick_us' % size: round(heartbeat * 1e6, 1),
+    }
+
+
+async def bench_churn(connections):
+    start = time.perf_counter()
+    for _ in range(connections):
+        communicator = WebsocketCommunicator(APPLICATION, '/ws/chat/?room=churn')
+        await communicator.connect()
+        await communicator.disconnect()
+    return {'churn_per_sec': round(connections / (time.perf_counter() - start), 1)}
+
+
+def per_call_us(fn, calls=20000):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return round((time.perf_counter() - start) / calls * 1e6, 3)
+
+
+def bench_instrumentation():
+    logger = logging.getLogger('chat')
+    extra = {'request_id': 'bench', 'event': 'receive', 'extra': {'message': 'x', 'count': 1}}
+    results = {
+        'log_receive_sampled_us': per_call_us(lambda: logger.info("Message received", extra=extra)),
+        'metric_counter_inc_us': per_call_us(consumers.total_messages.inc),
+        'metric_gauge_inc_dec_us': per_call_us(lambda: (consumers.active_connections.inc(), consumers.active_connections.dec())),
+    }
+    filters = logger.filters
+    logger.filters = []
+    try:
+        results['log_receive_unsampled_us'] = per_call_us(lambda: logger.info("Message received", extra=extra), calls=2000)
+    finally:
+        logger.filters = filters
+    return results
+
+
+async def run(sizes, messages, churn):
+    # Benchmarks measure the consumer, not the limiter
+    rate_limiter.rate = rate_limiter.burst = float('inf')
+    rate_limiter.session_rate = rate_limiter.session_burst = float('inf')
+    rate_limiter.max_connections = max(sizes) + 1
+
+    # Churn first: the in-memory layer's bookkeeping grows with every room
+    results = await bench_churn(churn)
+    for size in sizes:
+        results.update(await bench_room(size, messages if size < 1000 else max(10, messages // 10)))
+    results.update(bench_instrumentation())
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, value in sorted(results.items()):
+        if key not in baseline or not baseline[key]:
+            continue
+        change = (value - baseline[key]) / baseline[key]
+        worse = -change if key.endswith('_per_sec') else change
+        flag = 'REGRESSION' if worse > tolerance else ''
+        print("%-40s %14s %14s %+8.1f%% %s" % (key, baseline[key], value, change * 100, flag))
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the ChatConsumer hot paths.')
+    parser.add_argument('--sizes', default='1,100,10000', help='comma separated room sizes')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--churn', type=int, default=500)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before flagging')
+    parser.add_argument('--check', action='store_true', help='exit non-zero on regressions')
+    parser.add_argument('--save', action='store_true', help='write results as the new baseline')
+    options = parser.parse_args()
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    results = asyncio.run(run(sizes, options.messages, options.churn))
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, options.tolerance) if baseline else []
+    if not baseline:
+        print(json.dumps(results, indent=2))
+
+    if options.save:
+        with open(BASELINE, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if options.check and regressions:
+        sys.exit('%d benchmark(s) regressed beyond %d%%' % (len(regressions), options.tolerance * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Benchmark: per-recipient encoding vs encode-once broadcasts.
+#
+# Delivers one chat event to every member of a group through
+# ChatConsumer.chat_message, waiting for the outbound writers after each
+# broadcast. "per-recipient" hands each member its own copy of the event, so
+# every member encodes the frame; "encode-once" shares one event, so the
+# first member encodes it and the rest reuse the frame cached on it.
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_encode_once
+
+import asyncio
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+django.setup()
+
+from app.chat.consumers import ChatConsumer  # noqa: E402
+
+GROUP_SIZES = [1, 10, 100, 1000, 5000]
+MESSAGE = "x" * 200
+
+
+async def discard(message):
+    pass
+
+
+def make_recipients(n):
+    recipients = []
+    for _ in range(n):
+        consumer = ChatConsumer()
+        consumer.base_send = discard
+        recipients.append(consumer)
+    return recipients
+
+
+async def settle(recipients):
+    while any(consumer.outbound.writer is not None for consumer in recipients):
+        await asyncio.sleep(0)
+
+
+async def broadcast(recipients, encode_once, seq):
+    event = {'type': 'chat_message', 'message': MESSAGE, 'count': 1, 'seq': seq}
+    for consumer in recipients:
+        await consumer.chat_message(event if encode_once else dict(event))
+    await settle(recipients)
+
+
+async def measure(recipients, encode_once, rounds):
+    start = time.perf_counter()
+    for seq in range(rounds):
+        await broadcast(recipients, encode_once, seq)
+    return (time.perf_counter() - start) / rounds
+
+
+async def main():
+    print("%8s %16s %16s %10s" % ("group", "per-recipient", "encode-once", "saved"))
+    for size in GROUP_SIZES:
+        recipients = make_recipients(size)
+        rounds = max(3, 20000 // size)
+        before = await measure(recipients, False, rounds)
+        after = await measure(recipients, True, rounds)
+        print("%8d %13.1f us %13.1f us %9.1f%%" % (
+            size, before * 1e6, after * 1e6, 100 * (before - after) / before))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
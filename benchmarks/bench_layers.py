@@ -0,0 +1,102 @@
+# Benchmark: UnixSocketChannelLayer (through a broker process) vs InMemoryChannelLayer.
+#
+# InMemoryChannelLayer can't cross processes, so its numbers are the ceiling
+# for a single worker. The Unix socket layer is measured the way a second
+# worker would use it: sender and receiver are separate layer instances,
+# each with its own broker connection.
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_layers --messages 20000 --members 100
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+
+from app.chat.layers import UnixSocketChannelLayer
+
+
+async def bench_send(sender, receiver, messages):
+    channel = await receiver.new_channel()
+    message = {'type': 'chat.message', 'message': 'x' * 100, 'count': 1}
+
+    async def consume():
+        for _ in range(messages):
+            await receiver.receive(channel)
+
+    consumer = asyncio.ensure_future(consume())
+    start = time.perf_counter()
+    for _ in range(messages):
+        await sender.send(channel, message)
+    await consumer
+    return messages / (time.perf_counter() - start)
+
+
+async def bench_group_send(sender, receiver, messages, members):
+    channels = [await receiver.new_channel() for _ in range(members)]
+    for channel in channels:
+        await receiver.group_add('bench', channel)
+    message = {'type': 'chat.message', 'message': 'x' * 100, 'count': 1}
+
+    async def consume(channel):
+        for _ in range(messages):
+            await receiver.receive(channel)
+
+    consumers = [asyncio.ensure_future(consume(channel)) for channel in channels]
+    start = time.perf_counter()
+    for _ in range(messages):
+        await sender.group_send('bench', message)
+        # Stay under channel capacity, like a room that keeps up
+        await asyncio.sleep(0)
+    await asyncio.gather(*consumers)
+    return messages * members / (time.perf_counter() - start)
+
+
+async def run(options, path):
+    results = {}
+    memory = InMemoryChannelLayer(capacity=options.messages)
+    results['inmemory_send_per_sec'] = round(await bench_send(memory, memory, options.messages))
+    results['inmemory_group_deliveries_per_sec'] = round(
+        await bench_group_send(memory, memory, options.group_messages, options.members))
+
+    sender = UnixSocketChannelLayer(path=path, capacity=options.messages)
+    receiver = UnixSocketChannelLayer(path=path, capacity=options.messages)
+    await receiver.connection()
+    results['unix_send_per_sec'] = round(await bench_send(sender, receiver, options.messages))
+    results['unix_group_deliveries_per_sec'] = round(
+        await bench_group_send(sender, receiver, options.group_messages, options.members))
+    await sender.close()
+    await receiver.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UnixSocketChannelLayer vs InMemoryChannelLayer.')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--group-messages', type=int, default=500)
+    parser.add_argument('--members', type=int, default=100)
+    options = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+    broker = subprocess.Popen([sys.executable, '-m', 'app.chat.broker', '--path', path])
+    try:
+        deadline = time.time() + 10
+        while not os.path.exists(path):
+            if time.time() > deadline:
+                raise SystemExit('broker did not start')
+            time.sleep(0.05)
+        results = asyncio.run(run(options, path))
+    finally:
+        broker.terminate()
+        broker.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
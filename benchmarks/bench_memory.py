@@ -0,0 +1,132 @@
+# Benchmark: memory per idle WebSocket connection.
+#
+# Opens N idle connections straight through the ASGI application, the way
+# uvicorn drives it (one receive queue per connection, sends discarded), and
+# reports what they cost:
+#   - traced_bytes_per_conn: Python allocations, from tracemalloc
+#   - rss_bytes_per_conn: resident set growth, which includes allocator slack
+#
+# Connections are spread over rooms of --room-size members. Memory is what
+# caps how many connections a pod can hold, so watch both numbers.
+#
+# The default channel layer is UnixSocketChannelLayer, through a broker
+# subprocess. InMemoryChannelLayer (--layer memory) scans every channel on
+# each receive, so opening 50k connections with it takes far too long.
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_memory --sizes 1000 10000 50000
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+
+def rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak, not current, but it only grows during a run anyway
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def discard(message):
+    pass
+
+
+async def open_connections(count, room_size):
+    from app.chat.consumers import ChatConsumer
+    application = ChatConsumer.as_asgi()
+    connections = []
+    for i in range(count):
+        queue = asyncio.Queue()
+        queue.put_nowait({'type': 'websocket.connect'})
+        scope = {
+            'type': 'websocket', 'path': '/ws/chat/', 'headers': [], 'subprotocols': [],
+            'query_string': ('room=bench%d' % (i // room_size)).encode(),
+        }
+        connections.append((queue, asyncio.ensure_future(application(scope, queue.get, discard))))
+        if i % 500 == 499:
+            await asyncio.sleep(0)
+    while len(ChatConsumer.active_ws_connections) < count:
+        await asyncio.sleep(0.01)
+    # Let the session frames drain so only idle state is left
+    while any(consumer.outbound.writer is not None for consumer in ChatConsumer.active_ws_connections.values()):
+        await asyncio.sleep(0.01)
+    return connections
+
+
+async def close_connections(connections):
+    for queue, _ in connections:
+        queue.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+    await asyncio.gather(*(task for _, task in connections), return_exceptions=True)
+
+
+async def measure(count, room_size):
+    gc.collect()
+    traced_before, rss_before = tracemalloc.get_traced_memory()[0], rss()
+    connections = await open_connections(count, room_size)
+    gc.collect()
+    traced_after, rss_after = tracemalloc.get_traced_memory()[0], rss()
+    await close_connections(connections)
+    return {
+        'traced_bytes_per_conn': round((traced_after - traced_before) / count) if tracemalloc.is_tracing() else None,
+        'rss_bytes_per_conn': round((rss_after - rss_before) / count),
+    }
+
+
+async def run(options):
+    # Warm up imports, caches and the first room's objects
+    await close_connections(await open_connections(100, options.room_size))
+    results = {}
+    for count in options.sizes:
+        results[count] = await measure(count, options.room_size)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory per idle WebSocket connection.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--room-size', type=int, default=100)
+    parser.add_argument('--layer', choices=['unix', 'memory'], default='unix')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='RSS only; faster and less distorted')
+    options = parser.parse_args()
+
+    # Admission control would turn the larger runs away
+    os.environ.setdefault('CHAT_MAX_CONNECTIONS', str(max(options.sizes) + 1000))
+    broker = None
+    if options.layer == 'unix':
+        # Read by app.settings, so it has to be set before django.setup()
+        path = os.environ['CHAT_BROKER_PATH'] = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+        broker = subprocess.Popen([sys.executable, '-m', 'app.chat.broker', '--path', path])
+        deadline = time.time() + 10
+        while not os.path.exists(path):
+            if time.time() > deadline:
+                raise SystemExit('broker did not start')
+            time.sleep(0.05)
+    django.setup()
+    try:
+        if not options.no_tracemalloc:
+            tracemalloc.start()
+        results = asyncio.run(run(options))
+    finally:
+        if broker is not None:
+            broker.terminate()
+            broker.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
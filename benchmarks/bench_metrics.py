@@ -0,0 +1,84 @@
+# Per-message metric overhead, prometheus_client inline vs the batched facade.
+#
+# A chat message in a room of --fanout members touches: total_messages.inc(),
+# the session store's size gauge, chat_broadcast_seconds, chat_fanout_size,
+# and per member chat_delivery_latency_seconds, chat_send_seconds and the
+# outbound_queue_depth inc/dec around each frame. This times that set of
+# calls both ways, with the batched flush amortised in at its real cadence.
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_metrics --fanout 100
+
+import argparse
+import json
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+django.setup()
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram  # noqa: E402
+
+from app.chat.metrics import FANOUT_BUCKETS, LATENCY_BUCKETS, MetricBatch  # noqa: E402
+
+
+def build(registry, wrap=lambda metric: metric):
+    return (
+        wrap(Counter('total_messages', 'messages', registry=registry)),
+        wrap(Gauge('session_store_size', 'sessions', ['backend'], registry=registry)),
+        wrap(Gauge('outbound_queue_depth', 'depth', registry=registry)),
+        wrap(Histogram('chat_broadcast_seconds', 'broadcast', buckets=LATENCY_BUCKETS, registry=registry)),
+        wrap(Histogram('chat_fanout_size', 'fanout', buckets=FANOUT_BUCKETS, registry=registry)),
+        wrap(Histogram('chat_delivery_latency_seconds', 'delivery', ['path'], buckets=LATENCY_BUCKETS, registry=registry)),
+        wrap(Histogram('chat_send_seconds', 'send', ['kind'], buckets=LATENCY_BUCKETS, registry=registry)),
+    )
+
+
+def per_message_us(metrics, fanout, messages, flush=None, flush_every=None):
+    total, session_size, depth, broadcast, fanout_size, delivery, send = metrics
+    start = time.perf_counter()
+    for i in range(messages):
+        total.inc()
+        session_size.labels('memory').set(1000)
+        broadcast.observe(0.0004)
+        fanout_size.observe(fanout)
+        for _ in range(fanout):
+            depth.inc()
+            delivery.labels('local').observe(0.0007)
+            depth.dec()
+            send.labels('text').observe(0.00002)
+        if flush is not None and i % flush_every == 0:
+            flush()
+    return (time.perf_counter() - start) / messages * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-message metric overhead, inline vs batched.')
+    parser.add_argument('--fanout', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--flush-every', type=int, default=500,
+                        help='messages between flushes (rate x flush interval)')
+    options = parser.parse_args()
+
+    inline = per_message_us(build(CollectorRegistry()), options.fanout, options.messages)
+    batch = MetricBatch()
+
+    def wrap(metric):
+        if isinstance(metric, Histogram):
+            return batch.histogram(metric)
+        return batch.gauge(metric) if isinstance(metric, Gauge) else batch.counter(metric)
+
+    batched = per_message_us(build(CollectorRegistry(), wrap), options.fanout, options.messages,
+                             flush=batch.flush, flush_every=options.flush_every)
+    print(json.dumps({
+        'fanout': options.fanout,
+        'inline_us_per_message': round(inline, 2),
+        'batched_us_per_message': round(batched, 2),
+        'speedup': round(inline / batched, 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# Benchmark: binary relay frames vs the JSON chat path, by payload size.
+#
+# One sender broadcasts to a room of --room-size members, one message at a
+# time, each waited for until every member's outbound writer has sent it.
+# Members' sends are discarded, so the harness adds as little as it can, and
+# the best of --repeat runs is kept.
+# For each payload size it reports, per path:
+#   - per_sec: broadcasts per second
+#   - mb_per_sec: payload megabytes handed to sockets per second, all members
+#   - alloc_kb: allocation high-water per broadcast, from tracemalloc
+# The JSON path decodes the frame, logs it, keeps it for replay and encodes
+# it once per broadcast; the relay path reads the header and shares the
+# inbound bytes object with every member.
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_relay
+#   python -m benchmarks.bench_relay --sizes 1000 1000000 --room-size 10
+
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+from benchmarks.bench_consumer import close_room, open_room
+
+from app.chat import relay  # noqa: E402
+from app.chat.consumers import ChatConsumer  # noqa: E402
+from app.chat.ratelimit import rate_limiter  # noqa: E402
+
+
+async def discard(message):
+    pass
+
+
+async def settle():
+    while any(c.outbound.writer is not None for c in ChatConsumer.active_ws_connections.values()):
+        await asyncio.sleep(0)
+
+
+def frames_for(path, size, room):
+    if path == 'json':
+        return {'text_data': json.dumps({'message': 'x' * size})}
+    return {'bytes_data': relay.pack(1, room, b'x' * size)}
+
+
+async def measure(sender, frame, messages):
+    start = time.perf_counter()
+    for _ in range(messages):
+        await sender.receive(**frame)
+        await settle()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    await sender.receive(**frame)
+    await settle()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+async def run(sizes, room_size, repeat):
+    # Benchmarks measure the consumer, not the limiter
+    rate_limiter.rate = rate_limiter.burst = float('inf')
+    rate_limiter.session_rate = rate_limiter.session_burst = float('inf')
+    rate_limiter.max_connections = room_size + 1
+
+    communicators, sender = await open_room(room_size, 'bench-relay')
+    for consumer in ChatConsumer.active_ws_connections.values():
+        consumer.base_send = discard
+    results = {}
+    try:
+        for size in sizes:
+            messages = max(10, min(200, 20000000 // (size * room_size)))
+            frames = {path: frames_for(path, size, 'bench-relay') for path in ('json', 'relay')}
+            timings = {path: [] for path in frames}
+            for _ in range(repeat):
+                # Interleaved, so drift hits both paths alike
+                for path, frame in frames.items():
+                    await measure(sender, frame, 2)
+                    timings[path].append(await measure(sender, frame, messages))
+            for path, runs in timings.items():
+                elapsed = min(elapsed for elapsed, _ in runs)
+                peak = min(peak for _, peak in runs)
+                results['%s_%d' % (path, size)] = {
+                    'per_sec': round(messages / elapsed, 1),
+                    'mb_per_sec': round(size * room_size * messages / elapsed / 1e6, 1),
+                    'alloc_kb': round(peak / 1024, 1),
+                }
+    finally:
+        await close_room(communicators)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Binary relay vs JSON broadcasts by payload size.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--room-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    results = asyncio.run(run(options.sizes, options.room_size, options.repeat))
+    print("%10s %12s %12s %12s %12s %12s %12s" % (
+        'payload', 'json/s', 'relay/s', 'json MB/s', 'relay MB/s', 'json KB', 'relay KB'))
+    for size in options.sizes:
+        j, r = results['json_%d' % size], results['relay_%d' % size]
+        print("%10d %12.1f %12.1f %12.1f %12.1f %12.1f %12.1f" % (
+            size, j['per_sec'], r['per_sec'], j['mb_per_sec'], r['mb_per_sec'], j['alloc_kb'], r['alloc_kb']))
+
+
+if __name__ == '__main__':
+    main()
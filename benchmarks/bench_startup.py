@@ -0,0 +1,121 @@
+# Benchmark: worker startup, from a fresh interpreter to a ready worker.
+#
+# Each run starts a new Python process that does what a uvicorn worker
+# does, driving the ASGI application directly:
+#   - import: importing app.asgi (Django setup, settings, our modules)
+#   - startup: the lifespan startup, i.e. the warm-up
+#   - first_ready / second_ready: two GET /ready requests
+#   - total: process start to a 200 from /ready
+# and the medians over --runs are reported. Blue-green promotion waits on
+# total, so that is the number to watch.
+#
+# --importtime also prints the slowest imports of one run, from
+# python -X importtime, cumulative and in milliseconds.
+#
+# Run from the repository root:
+#   python -m benchmarks.bench_startup --runs 5
+#   CHAT_ASGI_SERVER=uvicorn SETUPTOOLS_USE_DISTUTILS=stdlib python -m benchmarks.bench_startup
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = r'''
+import asyncio, json, time
+started = time.perf_counter()
+import app.asgi
+imported = time.perf_counter()
+
+
+async def lifespan():
+    messages = asyncio.Queue()
+    sent = []
+    async def send(message):
+        sent.append(message)
+    messages.put_nowait({'type': 'lifespan.startup'})
+    task = asyncio.ensure_future(app.asgi.application({'type': 'lifespan', 'asgi': {'version': '3.0'}}, messages.get, send))
+    while not sent:
+        await asyncio.sleep(0)
+    assert sent[0]['type'] == 'lifespan.startup.complete', sent
+    return task, messages
+
+
+async def get(path):
+    sent = []
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+    async def send(message):
+        sent.append(message)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+        'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0), 'server': ('localhost', 8000),
+    }
+    start = time.perf_counter()
+    await app.asgi.application(scope, receive, send)
+    return sent[0]['status'], time.perf_counter() - start
+
+
+async def main():
+    task, messages = await lifespan()
+    warmed = time.perf_counter()
+    status, first = await get('/ready')
+    _, second = await get('/ready')
+    messages.put_nowait({'type': 'lifespan.shutdown'})
+    await task
+    print(json.dumps({
+        'import': imported - started, 'startup': warmed - imported,
+        'first_ready': first, 'second_ready': second,
+        'total': warmed - started + first, 'status': status,
+    }))
+
+asyncio.run(main())
+'''
+
+
+def run_once(env):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD], env=env, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def slowest_imports(env, top):
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app.asgi'], env=env, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative) / 1000, name.rstrip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker startup time, fresh process to ready.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', type=int, nargs='?', const=25, default=0, metavar='TOP',
+                        help='also print the TOP slowest imports (default 25)')
+    options = parser.parse_args()
+
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='app.settings')
+    runs = [run_once(env) for _ in range(options.runs)]
+    statuses = {run.pop('status') for run in runs}
+    results = {key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]}
+    results['status'] = sorted(statuses)
+    print(json.dumps(results, indent=2))
+
+    if options.importtime:
+        for cumulative, name in slowest_imports(env, options.importtime):
+            print('%8.1f ms  %s' % (cumulative, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+# Load generator for the chat WebSocket service.
+#
+# Ramps up to --connections sockets in one room, has each of them send
+# --rate messages per second of --size bytes for --duration seconds, and
+# reports connect, round-trip and fanout latency percentiles, throughput and
+# server errors. Results are printed and written as JSON so runs can be
+# compared across commits.
+#
+# Run from the repository root:
+#   python -m benchmarks.loadgen                                  # app in-process
+#   python -m benchmarks.loadgen --spawn                          # uvicorn on localhost
+#   python -m benchmarks.loadgen --url ws://localhost/ws/chat/    # running server
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+
+    return {'count': len(samples), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99),
+            'max': round(samples[-1] * 1000, 3)}
+
+
+class InProcessClient:
+    """Talks to the ASGI application directly, no sockets involved."""
+
+    def __init__(self, application, path):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=10)
+        return connected
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def recv(self):
+        while True:
+            try:
+                message = await self.communicator.receive_output(timeout=3600)
+            except asyncio.TimeoutError:
+                continue
+            if message['type'] == 'websocket.close':
+                return None
+            return message.get('text') or message.get('bytes')
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    """Talks to a real server through the websockets library."""
+
+    def __init__(self, url):
+        self.url = url
+        self.ws = None
+
+    async def connect(self):
+        import websockets
+        self.ws = await websockets.connect(self.url, max_size=None)
+        return True
+
+    async def send(self, text):
+        await self.ws.send(text)
+
+    async def recv(self):
+        try:
+            return await self.ws.recv()
+        except Exception:
+            return None
+
+    async def close(self):
+        await self.ws.close()
+
+
+class LoadTest:
+    def __init__(self, options, make_client):
+        self.options = options
+        self.make_client = make_client
+        self.connect_times = []
+        self.rtts = []
+        self.fanouts = []
+        # {client_id: send stamps of its messages not yet echoed back}
+        self.in_flight = {}
+        self.sent = 0
+        self.delivered = 0
+        self.errors = {}
+        self.clients = {}
+        self.stop = None
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def handle(self, client_id, frame):
+        now = time.time()
+        data = json.loads(frame)
+        if 'error' in data:
+            self.error(data['error'])
+            return
+        for item in data.get('batch', [data]):
+            message = item.get('message')
+            if not isinstance(message, dict) or 'sent_at' not in message:
+                continue
+            self.delivered += 1
+            sent_at = message['sent_at']
+            latency = now - sent_at
+            own = self.in_flight.get(client_id)
+            if message['client'] == client_id and own is not None and sent_at in own:
+                # The sender's own echo closes the round trip
+                own.discard(sent_at)
+                self.rtts.append(latency)
+            else:
+                self.fanouts.append(latency)
+
+    async def reader(self, client_id, client):
+        while not self.stop.is_set():
+            frame = await client.recv()
+            if frame is None:
+                if not self.stop.is_set():
+                    self.error('closed')
+                return
+            self.handle(client_id, frame)
+
+    async def writer(self, client_id, client):
+        interval = 1.0 / self.options.rate
+        padding = 'x' * self.options.size
+        in_flight = self.in_flight.setdefault(client_id, set())
+        await asyncio.sleep(interval * (client_id % 100) / 100)
+        while not self.stop.is_set():
+            sent_at = time.time()
+            text = json.dumps({'message': {'client': client_id, 'sent_at': sent_at, 'pad': padding}})
+            in_flight.add(sent_at)
+            try:
+                await client.send(text)
+            except Exception:
+                in_flight.discard(sent_at)
+                self.error('send')
+                return
+            self.sent += 1
+            await asyncio.sleep(interval)
+
+    async def session(self, client_id, started):
+        client = self.make_client()
+        start = time.perf_counter()
+        try:
+            if not await client.connect():
+                self.error('connect')
+                return
+        except Exception:
+            self.error('connect')
+            return
+        self.connect_times.append(time.perf_counter() - start)
+        # First frame is the session greeting
+        await client.recv()
+        self.clients[client_id] = client
+        started.append(client_id)
+        reader = asyncio.ensure_future(self.reader(client_id, client))
+        await self.stop.wait()
+        reader.cancel()
+        try:
+            await client.close()
+        except Exception:
+            pass
+
+    async def run(self):
+        options = self.options
+        self.stop = asyncio.Event()
+        started = []
+        sessions = []
+        step = options.ramp / max(1, options.connections)
+        for client_id in range(options.connections):
+            sessions.append(asyncio.ensure_future(self.session(client_id, started)))
+            if step:
+                await asyncio.sleep(step)
+        while len(started) + sum(self.errors.values()) < options.connections:
+            await asyncio.sleep(0.05)
+
+        writers = [
+            asyncio.ensure_future(self.writer(client_id, self.clients[client_id]))
+            for client_id in started[:options.senders or None]
+        ]
+        start = time.perf_counter()
+        await asyncio.sleep(options.duration)
+        self.stop.set()
+        elapsed = time.perf_counter() - start
+        # Give in-flight messages a moment to land
+        await asyncio.sleep(0.5)
+        for task in writers:
+            task.cancel()
+        await asyncio.gather(*sessions, return_exceptions=True)
+        return self.report(elapsed, len(started))
+
+    def report(self, elapsed, connected):
+        return {
+            'config': vars(self.options),
+            'commit': git_commit(),
+            'connections': connected,
+            'connect_ms': percentiles(self.connect_times),
+            'rtt_ms': percentiles(self.rtts),
+            'fanout_ms': percentiles(self.fanouts),
+            'throughput': {
+                'sent_per_sec': round(self.sent / elapsed, 1),
+                'delivered_per_sec': round(self.delivered / elapsed, 1),
+            },
+            'errors': self.errors,
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def spawn_server(port):
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app.asgi:application',
+                               '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'])
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen('http://127.0.0.1:%d/health' % port, timeout=1)
+            return server
+        except Exception:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit('uvicorn did not come up on port %d' % port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for the chat WebSocket service.')
+    parser.add_argument('--connections', type=int, default=100)
+    parser.add_argument('--ramp', type=float, default=2.0, help='seconds to reach --connections')
+    parser.add_argument('--rate', type=float, default=1.0, help='messages per second per sender')
+    parser.add_argument('--senders', type=int, default=0, help='connections that send (0 = all)')
+    parser.add_argument('--size', type=int, default=100, help='message padding in bytes')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--room', default='loadtest')
+    parser.add_argument('--url', help='target a running server instead of the in-process app')
+    parser.add_argument('--spawn', action='store_true', help='start uvicorn on localhost and target it')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', default='loadtest-results.json')
+    options = parser.parse_args()
+
+    server = None
+    if options.spawn:
+        server = spawn_server(options.port)
+        options.url = 'ws://127.0.0.1:%d/ws/chat/%s/' % (options.port, options.room)
+
+    if options.url:
+        make_client = lambda: SocketClient(options.url)  # noqa: E731
+    else:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+        from app.asgi import application
+        path = '/ws/chat/%s/' % options.room
+        make_client = lambda: InProcessClient(application, path)  # noqa: E731
+
+    try:
+        results = asyncio.run(LoadTest(options, make_client).run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(results, indent=2))
+    with open(options.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
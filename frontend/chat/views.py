@@ -1,3 +1,4 @@
+import asyncio
 import json
 from django.http import HttpResponse
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
@@ -16,15 +17,29 @@ async def healthz(request):
         return HttpResponse('Shutting down', status=503)
     return HttpResponse('OK')
 
+# Cached channel layer status, refreshed in the background so probes never
+# open connections themselves
+HEALTH_INTERVAL = 5
+layer_status = {'ok': False, 'error': 'starting'}
+health_task = None
+
+async def refresh_layer_status():
+    channel_layer = get_channel_layer()
+    while True:
+        try:
+            await asyncio.wait_for(channel_layer.connection(0), HEALTH_INTERVAL)
+            layer_status.update(ok=True, error=None)
+        except Exception as e:
+            layer_status.update(ok=False, error=str(e) or type(e).__name__)
+        await asyncio.sleep(HEALTH_INTERVAL)
+
 async def readyz(request):
     """Readiness probe"""
+    global health_task
+    if health_task is None or health_task.done():
+        health_task = asyncio.ensure_future(refresh_layer_status())
     if not is_ready or is_shutting_down:
         return HttpResponse('Not ready', status=503)
-    
-    # Check Redis connection
-    channel_layer = get_channel_layer()
-    try:
-        await channel_layer.connection(0)
-        return HttpResponse('Ready')
-    except:
-        return HttpResponse('Redis connection failed', status=503)
\ No newline at end of file
+    if not layer_status['ok']:
+        return HttpResponse('Redis connection failed', status=503)
+    return HttpResponse('Ready')
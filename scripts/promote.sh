@@ -19,18 +19,53 @@ fi
 
 # Run smoke tests
 echo "Running smoke tests for $NEXT_COLOR..."
-# Wait for the app to start
-sleep 10
+# Wait for the app to warm up; /ready answers 503 until it has
+READY_TIMEOUT=${READY_TIMEOUT:-60}
+waited=0
+until curl -fsS -o /dev/null "http://localhost:$APP_PORT/ready"; do
+    if [ "$waited" -ge "$(( READY_TIMEOUT * 2 ))" ]; then
+        echo "Smoke test failed: $NEXT_COLOR not ready after ${READY_TIMEOUT}s"
+        exit 1
+    fi
+    sleep 0.5
+    waited=$(( waited + 1 ))
+done
 if ! curl -fsS "http://localhost:$APP_PORT/health"; then
     echo "Smoke test failed: /health endpoint not healthy"
     exit 1
 fi
+if ! curl -fsS "http://localhost:$APP_PORT/ready"; then
+    echo "Smoke test failed: /ready reports $NEXT_COLOR not ready"
+    exit 1
+fi
 if ! curl -fsS "http://localhost:$APP_PORT/metrics" | grep -q "python_gc_objects_collected_total"; then
     echo "Smoke test failed: /metrics endpoint not reporting expected metrics"
     exit 1
 fi
 echo "Smoke tests passed."
 
+# Staggered migration needs the ops endpoints, which need CHAT_ADMIN_TOKEN
+if [ "$CURRENT_COLOR" == "blue" ]; then
+    OLD_PORT=8000
+else
+    OLD_PORT=8001
+fi
+MIGRATION_WINDOW=${CHAT_MIGRATION_WINDOW:-30}
+MIGRATION_GRACE=${CHAT_MIGRATION_GRACE:-10}
+
+copy_snapshot() {
+    curl -fsS -H "Authorization: Bearer $CHAT_ADMIN_TOKEN" "http://localhost:$OLD_PORT/ops/snapshot" \
+        | curl -fsS -H "Authorization: Bearer $CHAT_ADMIN_TOKEN" -H "Content-Type: application/octet-stream" \
+            --data-binary @- "http://localhost:$APP_PORT/ops/snapshot"
+    echo
+}
+
+if [ -n "$CHAT_ADMIN_TOKEN" ]; then
+    # Warm the new color's sessions and replay buffers before any client arrives
+    echo "Copying session snapshot from $CURRENT_COLOR to $NEXT_COLOR..."
+    copy_snapshot || echo "Snapshot copy failed; $NEXT_COLOR starts cold."
+fi
+
 # Flip traffic in Nginx
 if [ "$NEXT_COLOR" == "blue" ]; then
     sed -i '' 's/server app_green:8000;/server app_blue:8000;/' nginx.conf
@@ -44,6 +79,17 @@ echo "Reloading Nginx..."
 echo $NGINX_CONTAINER
 docker exec "$NGINX_CONTAINER" nginx -s reload
 
+if [ -n "$CHAT_ADMIN_TOKEN" ]; then
+    # Ask the old color's clients to reconnect, spread over the window, then
+    # bring over what they did in the meantime (counts merge, highest wins)
+    echo "Migrating clients off $CURRENT_COLOR over ${MIGRATION_WINDOW}s..."
+    curl -fsS -X POST -H "Authorization: Bearer $CHAT_ADMIN_TOKEN" \
+        "http://localhost:$OLD_PORT/ops/drain?window=$MIGRATION_WINDOW&grace=$MIGRATION_GRACE"
+    echo
+    sleep $(( ${MIGRATION_WINDOW%.*} + ${MIGRATION_GRACE%.*} ))
+    copy_snapshot || echo "Final snapshot copy failed."
+fi
+
 # Flip traffic
 if [ "$NEXT_COLOR" == "blue" ]; then
     docker-compose stop app_green
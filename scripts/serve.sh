@@ -0,0 +1,28 @@
+#!/bin/bash
+
+# Start script for the ASGI server
+#
+# WEB_CONCURRENCY sets the number of uvicorn workers. With more than one,
+# Prometheus metrics go to a shared directory that /metrics aggregates, and
+# it is emptied first so counters from a previous run don't carry over.
+# The workers share rooms through the local channel broker, started here.
+
+WORKERS=${WEB_CONCURRENCY:-1}
+
+# Skips the channels app, and with it daphne and Twisted, at startup
+export CHAT_ASGI_SERVER=uvicorn
+
+if [ "$WORKERS" -gt 1 ]; then
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-multiproc}
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+    export CHAT_BROKER_PATH=${CHAT_BROKER_PATH:-/tmp/chat-broker.sock}
+    rm -f "$CHAT_BROKER_PATH"
+    python -m app.chat.broker --path "$CHAT_BROKER_PATH" &
+    while [ ! -S "$CHAT_BROKER_PATH" ]; do
+        sleep 0.1
+    done
+fi
+
+exec uvicorn app.asgi:application --host 0.0.0.0 --port "${PORT:-8000}" --workers "$WORKERS" "$@"